@@ -24,6 +24,7 @@ setuptools.setup(
         "pyjwt",
         "pyyaml",
         "shortuuid",
+        "waitress",
     ],
 
     python_requires=">=3.6",
@@ -1,8 +1,27 @@
 import os
 
-from api import app
+from api import app, channels, replicator
+from customization import c11n
+from workers import serve
 
 
 host_binding = os.environ.get('SINGO_ADDRESS', '0.0.0.0')
 host_port = os.environ.get('SINGO_PORT', '5000')
-app.run(host=host_binding, port=int(host_port))
+workers = int(os.environ.get('SINGO_WORKERS', '0'))  # 0 for the development server
+threads = int(os.environ.get('SINGO_THREADS', '8'))  # per worker
+keep_alive = int(os.environ.get('SINGO_KEEP_ALIVE', '5'))  # seconds
+
+c11n.check_workers(workers)
+if workers:
+    for name in channels:  # load all channels before forking workers
+        channels[name]
+    serve(app,
+          host=host_binding,
+          port=int(host_port),
+          workers=workers,
+          threads=threads,
+          keep_alive=keep_alive,
+          before_fork=replicator.mark,
+          after_fork=replicator.start)
+else:
+    app.run(host=host_binding, port=int(host_port))
@@ -1,15 +1,23 @@
 from flask import Flask
 from flask_cors import CORS
 import logging
+from threading import BoundedSemaphore
 
 
 from api_channel import Channel
+from api_channels import Channels
 from api_handlers import Handlers
 from api_identities import Identities
 from api_maintenance import Maintenance
+from passwords import Passwords, get_hasher
 from permissions import Permissions
+from codec import register_codec
+from feeds import Feed
 from customization import c11n
 from commands import Commands
+from records import Records
+from users import Users
+from workers import Replicator
 
 
 logging.basicConfig(format='%(levelname)s %(message)s', level=logging.DEBUG)
@@ -17,29 +25,44 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 cors = CORS(app)
+register_codec(app)
 
 # WIP: Dockerfile optimised https://blog.realkinetic.com/building-minimal-docker-containers-for-python-applications-37d0272c52f3
 # WIP: deploy on AWS with zappa
 
 permissions = Permissions(path='fixtures/permissions.yaml')
 
-identities = Identities(permissions=permissions)
-identities.register_routes(app)
+commands = Commands()
+replicator = Replicator(app=app, commands=commands)  # keeps workers consistent, if any
+
+passwords = Passwords(hasher=get_hasher(c11n.password_hasher, cost=c11n.password_cost),
+                      workers=c11n.password_workers,
+                      queue_size=c11n.password_queue_size)
+identities = Identities(permissions=permissions,
+                        store=Users(store=c11n.get_store('users'), passwords=passwords))
+identities.register_routes(app, wrapper=replicator.wrap)
 
-channels = {k: Channel(name=k, permissions=permissions) for k in ['universe', 'community', 'board', 'item']}
-for _, channel in channels.items():
-    channel.register_routes(app, wrapper=identities.inject_identity)
+events_slots = BoundedSemaphore(c11n.events_subscribers)  # shared by channels, as each subscriber holds a thread
+channels = Channels(names=c11n.channels,
+                    factory=lambda k: Channel(name=k,
+                                              permissions=permissions,
+                                              feed=Feed(slots=events_slots),
+                                              store=Records(store=c11n.get_store(k),
+                                                            indexed_fields=c11n.get_indexed_fields(k),
+                                                            searchable=k in c11n.searchable_channels)))
+channels.register_routes(app, wrapper=lambda f: replicator.wrap(identities.inject_identity(f)))
 
 maintenance = Maintenance(permissions=permissions,
                           users=identities.store,
                           channels=channels,
-                          state_file=c11n.state_file)
+                          state_file=c11n.state_file,
+                          replicator=replicator)
 maintenance.register_routes(app, wrapper=identities.inject_identity)
 
-handlers = Handlers()
+handlers = Handlers(compression_level=c11n.compression_level,
+                    compression_minimum_size=c11n.compression_minimum_size)
 handlers.register_handlers(app)
 
-commands = Commands()
 identities.emitter = commands.emit
-for _, channel in channels.items():
-    channel.emitter = commands.emit
+channels.emitter = commands.emit
+replicator.dispatchers = [identities.replay, channels.replay]
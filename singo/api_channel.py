@@ -1,35 +1,63 @@
-from flask import jsonify, request, abort, url_for
+from flask import jsonify, request, abort, url_for, make_response, json, stream_with_context, Response
 from functools import wraps
 import logging
-from sys import getsizeof
+from shortuuid import uuid
+from time import time
 
+from feeds import Feed, FullError
+from payload import get_payload, get_size
 from permissions import Permissions
-from records import Records
+from records import Records, merge_patch, project
 
 
 logger = logging.getLogger(__name__)
 
 
+def _get_stamp(payload):
+    ''' Find the stamp given to records of some journaled command, if any '''
+    record = payload[0] if isinstance(payload, list) and payload else payload
+    return record.get('stamp', None) if isinstance(record, dict) else None
+
+
 class Channel:
     key_for_record = "item"
     key_for_list = "items"
+    rules = [('/', 'index', 'index', {}),  # (route, endpoint, method, options)
+             ('/page/<token>', 'page', 'page', {}),
+             ('/search', 'search', 'search', {}),
+             ('/export', 'export', 'export', {}),
+             ('/events', 'events', 'events', {}),
+             ('/since/<start>', 'since', 'between', {}),
+             ('/between/<start>/<stop>', 'between', 'between', {}),
+             ('/', 'post', 'post', dict(methods=['POST'])),
+             ('/batch', 'batch', 'batch', dict(methods=['POST'])),
+             ('/ids', 'multiget', 'multiget', dict(methods=['POST'])),
+             ('/<id>', 'get', 'get', {}),
+             ('/<id>', 'put', 'put', dict(methods=['PUT'])),
+             ('/<id>', 'patch', 'patch', dict(methods=['PATCH'])),
+             ('/<id>', 'delete', 'delete', dict(methods=['DELETE']))]
 
-    def __init__(self, name='', permissions=None, store=None, emitter=None):
+    def __init__(self, name='', permissions=None, store=None, emitter=None, feed=None):
         self.name = name or 'universe'
         self.prefix = '' if name == 'universe' else name
         self.permissions = permissions or Permissions(path='fixtures/permissions.yaml')
-        self.store = store or Records()
+        self.store = store or Records(searchable=True)
         self.emitter = emitter
         self.replay_stamp = None
         self.record_maximum_size = 1000000
+        self.request_maximum_size = 10000000  # e.g., for a batch of records
         self.page_size = 10
+        self.window_maximum_count = 1000
+        self.search_maximum_count = 50
+        self.batch_maximum_count = 1000
+        self.multiget_maximum_count = 1000
+        self.export_chunk_size = 100  # records per chunk of streamed output
+        self.feed = feed or Feed()
+        self.events_heartbeat = 15.0  # seconds between keep-alive comments
+        self.registry = None  # set when routes are shared with other channels
         self.routes = []
-        self._add_url_rule('/', 'index', self.index)
-        self._add_url_rule('/page/<token>', 'page', self.page)
-        self._add_url_rule('/', 'post', self.post, methods=['POST'])
-        self._add_url_rule('/<id>', 'get', self.get)
-        self._add_url_rule('/<id>', 'put', self.put, methods=['PUT'])
-        self._add_url_rule('/<id>', 'delete', self.delete, methods=['DELETE'])
+        for route, endpoint, method, kwargs in self.rules:
+            self._add_url_rule(route, endpoint, getattr(self, method), **kwargs)
 
     def _add_url_rule(self, route, endpoint, func, **kwargs):
         if len(self.prefix):
@@ -42,6 +70,11 @@ class Channel:
         else:
             return self.key_for_list + ':' + endpoint
 
+    def get_url(self, endpoint, **kwargs):
+        if self.registry:
+            return url_for(self.registry.get_endpoint(endpoint), channel=self.name, **kwargs)
+        return url_for(self.get_endpoint(endpoint), **kwargs)
+
     def register_routes(self, app, wrapper=None):
         for route, endpoint, func, kwargs in self.routes:
             if wrapper:
@@ -74,38 +107,218 @@ class Channel:
     @check_read_permission_decorator
     def index(self, persona='anonymous', **kwargs):
         logger.debug(f"channel index(persona='{persona}')")
+        ids = request.args.get('ids', None)
+        if ids is not None:
+            return self._multiget(ids=ids.split(','), persona=persona)
         return self.page(token=None, persona=persona, **kwargs)
 
+    @check_read_permission_decorator
+    def multiget(self, ids=None, persona='anonymous', **kwargs):
+        if ids is None:
+            payload = get_payload(self.request_maximum_size)
+            ids = payload.get('ids', None) if isinstance(payload, dict) else payload
+        return self._multiget(ids=ids, persona=persona)
+
+    def _multiget(self, ids, persona):
+        if not isinstance(ids, list) or not all(isinstance(x, str) for x in ids):
+            abort(400, "Please provide a list of ids")
+        ids = list(dict.fromkeys(x for x in ids if x))  # without duplicates, in order
+        logger.debug(f"channel multiget(persona='{persona}', count={len(ids)})")
+        if len(ids) > self.multiget_maximum_count:
+            abort(400, f"Please ask for at most {self.multiget_maximum_count} records")
+        records = self.store.read_many(ids)
+        return jsonify({self.key_for_list: [x for x in records if x is not None],
+                        'missing': [id for id, x in zip(ids, records) if x is None]})
+
+    def _not_modified(self, etag):
+        if etag and request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+        return None
+
+    def _get_fields(self):
+        fields = request.args.get('fields', '')  # e.g., '?fields=id,title,stamp'
+        return [x for x in fields.split(',') if x] or None
+
+    def _get_filter(self):
+        filters = {k: v for k, v in request.args.items() if k in self.store.indexed_fields}  # others are ignored, e.g., '?_=123'
+        if len(filters) > 1:
+            abort(400, "Please filter on one field at a time")
+        for field, value in filters.items():
+            return dict(field=field, value=value)
+        return {}
+
     @check_read_permission_decorator
     def page(self, token=None, persona='anonymous', **kwargs):
         logger.debug(f"channel page(persona='{persona}', token='{token}')")
+        filter = self._get_filter()
+        etag = self.store.etag()
+        not_modified = self._not_modified(etag)
+        if not_modified:
+            return not_modified
         try:
-            chunk = self.store.chunk(token=token, count=self.page_size)
+            chunk = self.store.chunk(token=token, count=self.page_size, **filter)
         except ValueError as error:
             abort(404, error)
-        next = 'EOF' if chunk.token == 'EOF' else url_for(self.get_endpoint('page'), token=chunk.token)
-        return jsonify({self.key_for_list: chunk.records,
-                        'next': next})
+        fields = self._get_fields()
+        if chunk.token == 'EOF':
+            next = 'EOF'
+        else:
+            args = {filter['field']: filter['value']} if filter else {}
+            if fields:
+                args['fields'] = ','.join(fields)
+            next = self.get_url('page', token=chunk.token, **args)
+        records = chunk.records if fields is None else [project(x, fields) for x in chunk.records]
+        response = jsonify({self.key_for_list: records,
+                            'next': next})
+        response.set_etag(etag)
+        return response
+
+    @check_read_permission_decorator
+    def between(self, start, stop=None, persona='anonymous', **kwargs):
+        logger.debug(f"channel between(persona='{persona}', start='{start}', stop='{stop}')")
+        try:
+            start = float(start)
+            stop = None if stop is None else float(stop)
+        except ValueError:
+            abort(400, "Please provide time stamps as numbers of seconds")
+        records = self.store.between(start=start, stop=stop, count=self.window_maximum_count)
+        return jsonify({self.key_for_list: records})
+
+    @check_read_permission_decorator
+    def search(self, persona='anonymous', **kwargs):
+        query = request.args.get('q', '')
+        logger.debug(f"channel search(persona='{persona}', q='{query}')")
+        if not query.strip():
+            abort(400, "Please provide a query with '?q='")
+        try:
+            records = self.store.search(query, count=self.search_maximum_count)
+        except ValueError as error:
+            abort(404, error)
+        return jsonify({self.key_for_list: records})
+
+    @check_read_permission_decorator
+    def export(self, persona='anonymous', **kwargs):
+        logger.debug(f"channel export(persona='{persona}')")
+        records = self.store.scan()
+
+        def generate():  # one JSON record per line
+            lines = []
+            for record in records:
+                lines.append(json.dumps(record) + '\n')
+                if len(lines) >= self.export_chunk_size:
+                    yield ''.join(lines)
+                    lines = []
+            if lines:
+                yield ''.join(lines)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    @check_read_permission_decorator
+    def events(self, persona='anonymous', **kwargs):
+        last_event_id = request.headers.get('Last-Event-ID', None)
+        logger.debug(f"channel events(persona='{persona}', last_event_id='{last_event_id}')")
+        try:
+            subscriber = self.feed.subscribe(last_event_id)
+        except FullError as error:
+            abort(503, error)
+        return Response(stream_with_context(self._generate_events(subscriber, persona)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    def _generate_events(self, subscriber, persona):
+        try:
+            if subscriber.reset:  # events have been missed, the client should read the channel again
+                yield 'event: reset\ndata: {}\n\n'
+            while True:
+                text = self._wait_for_events(subscriber, persona)
+                if text is None:
+                    return
+                yield text
+        finally:
+            self.feed.unsubscribe(subscriber)
+
+    def _wait_for_events(self, subscriber, persona):
+        events = self.feed.wait(subscriber, timeout=self.events_heartbeat)
+        if not self.permissions.authorize(scope='access-content',
+                                          persona=persona,
+                                          topic=self.prefix or 'universe'):
+            return None
+        if events:
+            return ''.join(f"id: {id}\nevent: {type}\ndata: {json.dumps(data)}\n\n"
+                           for id, type, data in events)
+        if subscriber.overflow:  # the client will resume with Last-Event-ID
+            return None
+        return ': keep-alive\n\n'
 
     @check_read_permission_decorator
     def get(self, id, persona='anonymous', **kwargs):
+        etag = self.store.etag(id)
+        not_modified = self._not_modified(etag)
+        if not_modified:
+            return not_modified
         record = self.store.read(id)
         if record is None:
             abort(404)
-        return jsonify({self.key_for_record: record})
+        fields = self._get_fields()
+        response = jsonify({self.key_for_record: record if fields is None else project(record, fields)})
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    def _get_payload(self, payload=None):
+        if payload is None:
+            payload = get_payload(self.record_maximum_size)
+        elif get_size(payload) > self.record_maximum_size:
+            abort(413, "Record exceeds maximum size")
+        if not isinstance(payload, dict):
+            abort(400, "Please provide a record")
+        return payload
 
     @check_write_permission_decorator
-    def post(self, payload=None, persona='anonymous', **kwargs):
+    def post(self, payload=None, persona='anonymous', stamp=None, **kwargs):
         logger.debug(f"post to channel ‘{self.name}’ for persona '{persona}'")
-        payload = payload or request.get_json(force=True)
+        payload = self._get_payload(payload)
         payload.pop('bearer', None)
-        if getsizeof(payload) > self.record_maximum_size:
-            abort(400, "Record exceeds maximum size")
+        payload['id'] = payload.get('id', None) or uuid()  # replayed with same id
+        payload = dict(payload, stamp=stamp or time())  # replayed with same stamp
         self.command(persona=persona, action='post', payload=payload)
         id = self.store.write(**payload)
+        self.feed.publish('post', self.store.read(id))
         path = f"/{self.prefix}" if self.prefix else ''
         return '', 201, {'Location': f"{path}/{id}"}
 
+    @check_write_permission_decorator
+    def batch(self, payload=None, persona='anonymous', stamp=None, **kwargs):
+        logger.debug(f"batch to channel ‘{self.name}’ for persona '{persona}'")
+        payload = payload or get_payload(self.request_maximum_size)
+        if not isinstance(payload, list):
+            abort(400, "Please provide a list of records")
+        if len(payload) > self.batch_maximum_count:
+            abort(400, f"Please provide at most {self.batch_maximum_count} records")
+
+        results = [self._accept(record) for record in payload]
+        stamp = stamp or time()  # one write, replayed with same stamp
+        accepted = [dict(record, stamp=stamp) for record, result in zip(payload, results) if result['status'] == 201]
+        if accepted:
+            self.command(persona=persona, action='batch', payload=accepted)
+            for record in accepted:
+                self.store.write(**record)
+                self.feed.publish('post', self.store.read(record['id']))
+        return jsonify({self.key_for_list: results})
+
+    def _accept(self, record):
+        ''' Check one record of a batch, and describe the outcome '''
+        if not isinstance(record, dict):
+            return dict(status=400, description="Record is not an object")
+        record.pop('bearer', None)
+        if get_size(record) > self.record_maximum_size:
+            return dict(status=400, description="Record exceeds maximum size")
+        record['id'] = record.get('id', None) or uuid()  # replayed with same id
+        path = f"/{self.prefix}" if self.prefix else ''
+        return dict(id=record['id'], status=201, location=f"{path}/{record['id']}")
+
     def _check_version(self, id, payload):
         version = payload.get('version', None)
         previous = payload.get('previous_version', None)
@@ -119,19 +332,39 @@ class Channel:
         return version
 
     @check_write_permission_decorator
-    def put(self, id, payload=None, persona='anonymous', **kwargs):
+    def put(self, id, payload=None, persona='anonymous', stamp=None, **kwargs):
         logger.debug(f"put to channel ‘{self.name}’ for persona '{persona}'")
         if not id:
             abort(400, f"Please provide an id")
-        payload = payload or request.get_json(force=True)
+        payload = self._get_payload(payload)
         payload['id'] = id
         payload['version'] = self._check_version(id=id, payload=payload)
         payload.pop('bearer', None)
+        payload = dict(payload, stamp=stamp or time())  # replayed with same stamp
+        self.command(persona=persona, action='put', payload=payload)  # checked again on replay
         payload.pop('previous_version', None)
-        if getsizeof(payload) > self.record_maximum_size:
-            abort(400, "Record exceeds maximum size")
-        self.command(persona=persona, action='put', payload=payload)
         self.store.write(**payload)
+        self.feed.publish('put', self.store.read(id))
+        return '', 204
+
+    @check_write_permission_decorator
+    def patch(self, id, payload=None, persona='anonymous', stamp=None, **kwargs):
+        logger.debug(f"patch to channel ‘{self.name}’ for persona '{persona}'")
+        payload = self._get_payload(payload)  # a merge patch, as per RFC 7386
+        payload.pop('id', None)
+        payload.pop('bearer', None)
+        record = self.store.read(id)
+        if record is None:
+            abort(404)
+        stamp = float(stamp or time())  # replayed with same stamp
+        merged = merge_patch(record, dict(payload, previous_version=None, stamp=str(stamp)))  # as it will be stored
+        if get_size(merged) > self.record_maximum_size:
+            abort(413, "Record exceeds maximum size")
+        self._check_version(id=id, payload=payload)
+        self.command(persona=persona, action='patch', payload=dict(payload, id=id, stamp=stamp))  # checked again on replay
+        payload.pop('previous_version', None)
+        self.store.patch(id, payload, stamp=stamp)
+        self.feed.publish('patch', self.store.read(id))
         return '', 204
 
     @check_write_permission_decorator
@@ -139,6 +372,7 @@ class Channel:
         logger.debug(f"delete in channel ‘{self.name}’ for persona '{persona}'")
         self.command(persona=persona, action='delete', payload={'id': id})
         self.store.delete(id)
+        self.feed.publish('delete', {'id': id})
         return '', 204
 
     def command(self, persona, action, payload, emitter=None):
@@ -149,16 +383,18 @@ class Channel:
                     action=action,
                     payload=payload)
 
-    def replay(self, scope, persona, action, payload, stamp=None):
+    def replay(self, scope, persona, action, payload, identity=None, stamp=None):
         if scope != f'channel:{self.name}':
             return
         if stamp:
             if self.replay_stamp and stamp < self.replay_stamp:
                 return
             self.replay_stamp = stamp
-        if action == 'post':
-            self.post(payload=payload, persona=persona)
-        elif action == 'put':
-            self.put(id=payload['id'], payload=payload, persona=persona)
-        elif action == 'delete':
-            self.delete(id=payload['id'], persona=persona)
+        written = _get_stamp(payload)  # records are stamped as by the process that has journaled the command
+        replayers = dict(post=lambda: self.post(payload=payload, persona=persona, stamp=written),
+                         batch=lambda: self.batch(payload=payload, persona=persona, stamp=written),
+                         put=lambda: self.put(id=payload['id'], payload=payload, persona=persona, stamp=written),
+                         patch=lambda: self.patch(id=payload.pop('id'), payload=payload, persona=persona, stamp=written),
+                         delete=lambda: self.delete(id=payload['id'], persona=persona))
+        if action in replayers:
+            replayers[action]()
@@ -0,0 +1,123 @@
+from collections.abc import Mapping
+from flask import redirect, request
+from functools import wraps
+import logging
+from threading import Lock
+from werkzeug.routing import BaseConverter, ValidationError
+
+from api_channel import Channel
+
+
+logger = logging.getLogger(__name__)
+
+
+class Channels(Mapping):
+    ''' Named channels, created on first access, and served by a single set of routes
+
+    The channel 'universe' is served at the root, as before. Other channels
+    are served by rules such as `/<channel:channel>/page/<token>`, that match
+    only names known to the registry.
+    '''
+
+    key_for_list = Channel.key_for_list
+
+    def __init__(self, names=None, factory=None, emitter=None):
+        self.names = set()
+        self.factory = factory or (lambda name: Channel(name=name))  # called on first access to a channel
+        self._emitter = emitter
+        self.channels = {}
+        self.lock = Lock()
+        self.routes = []
+        for route, endpoint, method, kwargs in Channel.rules:
+            self._add_url_rule(route, endpoint, method, **kwargs)
+        for name in names or []:
+            self.add(name)
+
+    def add(self, name):
+        ''' Serve one more channel, at any time '''
+        if not name or '/' in name:
+            raise ValueError(f"Invalid channel name '{name}'")
+        logger.debug(f"adding channel '{name}'")
+        self.names.add(name)
+
+    def __getitem__(self, name):
+        channel = self.channels.get(name, None)
+        if channel is not None:
+            return channel
+        if name not in self.names:
+            raise KeyError(name)
+        with self.lock:
+            if name not in self.channels:
+                logger.info(f"loading channel '{name}'...")
+                channel = self.factory(name)
+                channel.emitter = self._emitter
+                if name != 'universe':
+                    channel.registry = self
+                self.channels[name] = channel
+            return self.channels[name]
+
+    def is_loaded(self, name):
+        return name in self.channels
+
+    def __iter__(self):
+        return iter(sorted(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def emitter(self):
+        return self._emitter
+
+    @emitter.setter
+    def emitter(self, emitter):
+        self._emitter = emitter
+        for channel in self.channels.values():
+            channel.emitter = emitter
+
+    def _add_url_rule(self, route, endpoint, method, **kwargs):
+        self.routes.append(('/<channel:channel>' + route, self.get_endpoint(endpoint), method, kwargs))
+
+    def get_endpoint(self, endpoint):
+        return self.key_for_list + ':channel:' + endpoint
+
+    def register_routes(self, app, wrapper=None):
+        registry = self
+
+        class ChannelConverter(BaseConverter):
+            def to_python(self, value):
+                if value == 'universe' or value not in registry.names:
+                    raise ValidationError()  # try next rules, e.g., '/<id>' of universe
+                return value
+
+        app.url_map.converters['channel'] = ChannelConverter
+        if 'universe' in self.names:
+            self['universe'].register_routes(app, wrapper=lambda f: self._redirect_names(wrapper(f) if wrapper else f))
+        for route, endpoint, method, kwargs in self.routes:
+            func = self._dispatch(method)
+            if wrapper:
+                func = wrapper(func)
+            logger.info(f"adding route '{route}' for endpoint '{endpoint}'")
+            app.add_url_rule(route, endpoint, func, **kwargs)
+
+    def _redirect_names(self, func):
+        ''' Redirect '/board' to '/board/', as for static rules, instead of reading 'board' in universe '''
+        @wraps(func)
+        def view(*args, **kwargs):
+            name = kwargs.get('id', None)
+            if request.method in ('GET', 'HEAD') and name != 'universe' and name in self.names:
+                query = request.query_string.decode()
+                return redirect(request.base_url + '/' + ('?' + query if query else ''), code=308)
+            return func(*args, **kwargs)
+        return view
+
+    def _dispatch(self, method):
+        def view(channel, **kwargs):
+            return getattr(self[channel], method)(**kwargs)
+        view.__name__ = method
+        return view
+
+    def replay(self, scope, **kwargs):
+        name = scope[len('channel:'):] if scope.startswith('channel:') else None
+        if name in self.names:
+            self[name].replay(scope=scope, **kwargs)
@@ -1,14 +1,30 @@
-from flask import jsonify
+from flask import jsonify, request
 import json
 import logging
 import werkzeug
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
 
 
 logger = logging.getLogger(__name__)
 
 
 class Handlers:
-    ''' JSON errors are returned as {'code': 404, 'name': 'Not Found', 'description': '...'} '''
+    ''' JSON errors are returned as {'code': 404, 'name': 'Not Found', 'description': '...'}
+
+    Responses are compressed with zstd or gzip, depending on what the client accepts.
+    '''
+
+    compressible_types = ['application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml']
+
+    def __init__(self, compression_level=6, compression_minimum_size=1024, zstd_level=3):
+        self.compression_level = compression_level  # gzip, from 1 to 9, or 0 to disable compression
+        self.compression_minimum_size = compression_minimum_size  # in bytes
+        self.zstd_level = zstd_level  # from 1 to 22
 
     def register_handlers(self, app):
         logger.debug(f"registering exception handlers...")
@@ -62,4 +78,43 @@ class Handlers:
         pass
 
     def after_request(self, response):
+        encoding = self._get_encoding(response)
+        if encoding:
+            self._compress(response, encoding)
         return response
+
+    def _get_encoding(self, response):
+        if not (self.compression_level and self._is_compressible(response)):
+            return None
+        accepted = request.accept_encodings
+        encodings = ['zstd', 'gzip'] if zstandard else ['gzip']
+        encoding = max(encodings, key=lambda x: accepted[x])  # first one on ties
+        return encoding if accepted[encoding] > 0 else None
+
+    def _is_compressible(self, response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if response.is_streamed or response.direct_passthrough:
+            return False
+        if 'Content-Encoding' in response.headers:  # already compressed
+            return False
+        mimetype = response.mimetype or ''
+        if not (mimetype.startswith('text/') or mimetype in self.compressible_types):
+            return False
+        return (response.content_length or 0) >= self.compression_minimum_size
+
+    def _compress(self, response, encoding):
+        data = response.get_data()
+        if encoding == 'zstd':
+            compressed = zstandard.ZstdCompressor(level=self.zstd_level).compress(data)
+        else:
+            compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 31)  # 31 for gzip container
+            compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) >= len(data):
+            return
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        etag, weak = response.get_etag()
+        if etag and not weak:  # same content, other bytes
+            response.set_etag(etag, weak=True)
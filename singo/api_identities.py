@@ -3,8 +3,10 @@ from flask import jsonify, request, abort, url_for, make_response
 from functools import wraps
 import jwt
 import logging
-from sys import getsizeof
+from time import time
 
+from passwords import BusyError
+from payload import get_payload, get_size
 from permissions import Permissions
 from users import Users, NotFoundError
 
@@ -22,6 +24,7 @@ class Identities:
         self.replay_stamp = None
         self.page_size = 10
         self.record_maximum_size = 100000
+        self.request_maximum_size = 10000000  # as for channels, for any request with an identity, e.g., a batch of records
         self.routes = []
         self._add_url_rule('/login', 'login', self.login, methods=['POST'])
         self._add_url_rule('/signin', 'signin', self.signin, methods=['POST'])
@@ -37,10 +40,13 @@ class Identities:
     def _add_url_rule(self, route, endpoint, func, **kwargs):
         self.routes.append((route, 'users:' + endpoint, func, kwargs))
 
-    def register_routes(self, app):
+    def register_routes(self, app, wrapper=None):
         for route, endpoint, func, kwargs in self.routes:
+            func = self.inject_identity(func)
+            if wrapper:
+                func = wrapper(func)
             logger.info(f"adding route '{route}' for endpoint '{endpoint}'")
-            app.add_url_rule(route, endpoint, self.inject_identity(func), **kwargs)
+            app.add_url_rule(route, endpoint, func, **kwargs)
 
     def inject_identity(self, wrapped):
         @wraps(wrapped)
@@ -58,25 +64,29 @@ class Identities:
         bearer = request.cookies.get('bearer')
         if bearer:
             return bearer
-        if not request.data:
+        if not request.content_length:
+            return 'no-bearer'
+        if request.content_length > self.request_maximum_size:  # rejected by the route anyway
             return 'no-bearer'
         payload = payload or request.get_json(force=True)
-        return payload.get('bearer', 'no-bearer')
+        return payload.get('bearer', 'no-bearer') if isinstance(payload, dict) else 'no-bearer'
 
     def login(self, payload=None, **kwargs):
-        payload = payload or request.get_json(force=True)
+        payload = payload or get_payload(self.record_maximum_size)
         try:
             bearer = self.store.authenticate_password(**payload)
             response = make_response(jsonify(dict(bearer=bearer)))
             response.set_cookie('bearer', bearer)
             return response
+        except BusyError as error:
+            abort(429, error)
         except NotFoundError as error:
             abort(404, error)
         except ValueError as error:
             abort(403, error)
 
     def signin(self, payload=None, **kwargs):
-        payload = payload or request.get_json(force=True)
+        payload = payload or get_payload(self.record_maximum_size)
         try:
             bearer = self.store.authenticate_signature(**payload)
             response = make_response(jsonify(dict(bearer=bearer)))
@@ -88,7 +98,7 @@ class Identities:
             abort(403, error)
 
     def check_bearer(self, payload=None, **kwargs):
-        payload = payload or request.get_json(force=True)
+        payload = payload or get_payload(self.record_maximum_size)
         try:
             bearer = payload.get('bearer', 'no-bearer')
             return jsonify(self.store.check_bearer(bearer=bearer))
@@ -98,7 +108,7 @@ class Identities:
             abort(403, error)
 
     def renew_bearer(self, payload=None, **kwargs):
-        payload = payload or request.get_json(force=True)
+        payload = payload or get_payload(self.record_maximum_size)
         try:
             previous = payload.get('bearer', 'no-bearer')
             bearer = self.store.renew_bearer(bearer=previous)
@@ -115,32 +125,35 @@ class Identities:
             abort(403, f"Persona '{persona}' can not list identities")
         return self.page(token=None, persona=persona, **kwargs)
 
-    def _filter_attributes(self, record):
-        filtered = {k: record[k] for k in record.keys() - self.secret_attributes}
-        return filtered
+    def _filter_attributes(self, record, fields=None):
+        keys = record.keys() if fields is None else [k for k in fields if k in record]
+        return {k: record[k] for k in keys if k not in self.secret_attributes}
 
-    def _filter_records(self, source, persona='anonymous'):
-        permitted = dict(anonymous=[],
-                         registered=[],
-                         member=['member', 'leader', 'audit'],
-                         leader=['registered', 'member', 'leader', 'support', 'audit'],
-                         support=['registered', 'member', 'leader', 'support', 'robot', 'audit'],
-                         robot=[],
-                         audit=['registered', 'member', 'leader', 'support', 'audit'])
+    def _get_fields(self):
+        fields = request.args.get('fields', '')  # e.g., '?fields=id,first_name,persona'
+        return [x for x in fields.split(',') if x] or None
 
-        return [r for r in source if r['persona'] in permitted[persona]]
+    permitted = dict(anonymous=[],  # personas of identities listed to each persona
+                     registered=[],
+                     member=['member', 'leader', 'audit'],
+                     leader=['registered', 'member', 'leader', 'support', 'audit'],
+                     support=['registered', 'member', 'leader', 'support', 'robot', 'audit'],
+                     robot=[],
+                     audit=['registered', 'member', 'leader', 'support', 'audit'])
 
     def page(self, token=None, persona='anonymous', **kwargs):
         if not self.permissions.authorize(scope='access-identities',
                                           persona=persona,
                                           topic='list'):
             abort(403, f"Persona '{persona}' can not list identities")
-        try:
-            chunk = self.store.chunk(token=token, count=self.page_size)
+        try:  # only identities that can be listed, from the index of personas
+            chunk = self.store.chunk(token=token, count=self.page_size, field='persona', value=self.permitted.get(persona, []))
         except ValueError as error:
             abort(404, error)
-        next = 'EOF' if chunk.token == 'EOF' else url_for('users:page', token=chunk.token)
-        return jsonify({'users': [self._filter_attributes(record) for record in self._filter_records(chunk.records, persona=persona)],
+        fields = self._get_fields()
+        args = {'fields': ','.join(fields)} if fields else {}
+        next = 'EOF' if chunk.token == 'EOF' else url_for('users:page', token=chunk.token, **args)
+        return jsonify({'users': [self._filter_attributes(record, fields) for record in chunk.records],
                         'next': next})
 
     def get(self, id, identity=None, persona='anonymous', **kwargs):
@@ -153,15 +166,31 @@ class Identities:
                                             persona=persona,
                                             topic=record['persona']):
             abort(403, f"Persona '{persona}' can not get identity for '{record['persona']}'")
-        return jsonify({'user': self._filter_attributes(record)})
-
-    def post(self, payload=None, identity=None, persona='anonymous', **kwargs):
+        etag = self.store.etag(id)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = jsonify({'user': self._filter_attributes(record, self._get_fields())})
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    def _get_payload(self, payload=None):
+        if not payload:
+            payload = get_payload(self.record_maximum_size)
+        elif get_size(payload) > self.record_maximum_size:
+            abort(413, "Record exceeds maximum size")
+        if not isinstance(payload, dict):
+            abort(400, "Please provide a record")
+        return payload
+
+    def post(self, payload=None, identity=None, persona='anonymous', stamp=None, **kwargs):
         logger.debug(f"post identity for persona '{persona}'")
-        payload = payload or request.get_json(force=True)
+        payload = self._get_payload(payload)
         payload.pop('bearer', None)
-        if getsizeof(payload) > self.record_maximum_size:
-            abort(400, "Record exceeds maximum size")
-        self.command(persona=persona, action='post', payload=payload)
+        payload.pop('record_has_been_loaded', None)  # only from snapshots, with hashed passwords
+        payload = dict(payload, stamp=stamp or time())  # replayed with same stamp
+        self.command(persona=persona, action='post', payload=payload, identity=identity)
 
         role = payload.get('persona', 'anonymous')
         if role != 'anonymous' and not self.permissions.authorize(scope='manage-identities',
@@ -182,18 +211,17 @@ class Identities:
             abort(400, error)
         return '', 201, {'Location': f"/users/{id}"}
 
-    def put(self, id, payload=None, identity=None, persona='anonymous', **kwargs):
+    def put(self, id, payload=None, identity=None, persona='anonymous', stamp=None, **kwargs):
         if not id:
             abort(400, "Please provide an id")
 
         logger.debug(f"put identity ‘{id}’ for persona '{persona}'")
-        payload = payload or request.get_json(force=True)
-        if getsizeof(payload) > self.record_maximum_size:
-            abort(400, "Record exceeds maximum size")
-        payload = copy.deepcopy(payload)
+        payload = copy.deepcopy(self._get_payload(payload))
         payload['id'] = id
         payload.pop('bearer', None)
-        self.command(persona=persona, action='put', payload=payload)
+        payload.pop('record_has_been_loaded', None)  # only from snapshots, with hashed passwords
+        payload = dict(payload, stamp=stamp or time())  # replayed with same stamp
+        self.command(persona=persona, action='put', payload=payload, identity=identity)
 
         role = payload.get('persona', None)
         if role is not None:
@@ -230,7 +258,7 @@ class Identities:
             abort(404)
 
         logger.debug(f"delete identity ‘{id}’ for persona '{persona}'")
-        self.command(persona=persona, action='delete', payload={'id': id})
+        self.command(persona=persona, action='delete', payload={'id': id}, identity=identity)
 
         if id == identity:
             if not self.permissions.authorize(scope='manage-identities',
@@ -246,15 +274,16 @@ class Identities:
         self.store.delete(id)
         return '', 204
 
-    def command(self, persona, action, payload, emitter=None):
+    def command(self, persona, action, payload, identity=None, emitter=None):
         emitter = emitter or self.emitter
         if emitter:
             emitter(persona=persona,
                     scope='identities',
                     action=action,
-                    payload=payload)
+                    payload=payload,
+                    identity=identity)
 
-    def replay(self, scope, persona, action, payload, stamp=None):
+    def replay(self, scope, persona, action, payload, identity=None, stamp=None):
         if scope != 'identities':
             return
         if stamp:
@@ -262,8 +291,8 @@ class Identities:
                 return
             self.replay_stamp = stamp
         if action == 'post':
-            self.post(payload=payload, persona=persona)
+            self.post(payload=payload, identity=identity, persona=persona, stamp=payload.get('stamp', None))
         elif action == 'put':
-            self.put(id=payload['id'], payload=payload, persona=persona)
+            self.put(id=payload['id'], payload=payload, identity=identity, persona=persona, stamp=payload.get('stamp', None))
         elif action == 'delete':
-            self.delete(id=payload['id'], persona=persona)
+            self.delete(id=payload['id'], identity=identity, persona=persona)
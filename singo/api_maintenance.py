@@ -11,10 +11,11 @@ logger = logging.getLogger(__name__)
 
 class Maintenance:
 
-    def __init__(self, permissions=None, users=None, channels=None, state_file=None):
+    def __init__(self, permissions=None, users=None, channels=None, state_file=None, replicator=None):
         self.permissions = permissions or Permissions(path='fixtures/permissions.yaml')
         self.users = users
         self.channels = channels
+        self.replicator = replicator  # restore is not journaled, and would change only one worker
         self.state_file = state_file or 'fixtures/state.yaml'
         if state_file:
             try:
@@ -58,6 +59,8 @@ class Maintenance:
                                           persona=persona,
                                           topic='restore'):
             abort(403, f"Persona '{persona}' is not allowed to restore system")
+        if self.replicator and self.replicator.is_running:
+            abort(409, "System can not be restored while served by several workers, please restart with SINGO_WORKERS=0")
         payload = payload or request.get_json(force=True)
         content = base64.b64decode(payload['blob'])
         logger.debug(f"pushing data to the backend store...")
@@ -78,6 +81,8 @@ class Maintenance:
         snapshot = safe_load(stream)
         content = snapshot.get('channels', {})
         for key in self.channels.keys():
+            if key not in content and not self.channels.is_loaded(key):  # do not create channels only to empty them
+                continue
             count = self.channels[key].store.load(content.get(key, []), append=False)
             if count:
                 logger.info(f"{count} items have been loaded in channel '{key}'")
@@ -1,9 +1,11 @@
+import calendar
 import datetime
 import hashlib
 import hmac
 import jwt
 import logging
 from shortuuid import uuid
+from time import time
 
 
 logger = logging.getLogger(__name__)
@@ -53,17 +55,37 @@ def encode_bearer(secret, identity, persona, salt=None, stamp=None, **kwargs):
     return bearer
 
 
-def decode_bearer(secret, bearer, validity=60, renewal=720):
+def encode_compact_bearer(secret, identity, persona, issued=None, validity=60):
+    ''' Sign a bearer that carries only identity and persona, and epoch seconds of issue and expiry '''
+    issued = int(time()) if issued is None else int(issued)
+    payload = dict(identity=identity,
+                   persona=persona,
+                   iat=issued,
+                   exp=issued + 60 * validity)
+    return jwt.encode(payload, secret, algorithm='HS256').decode()
+
+
+def get_issued(stamp):
+    ''' Convert the stamp of a legacy bearer to epoch seconds '''
+    return calendar.timegm(datetime.datetime.strptime(stamp, '%Y%m%dT%H%M%SZ').timetuple())
+
+
+def decode_bearer(secret, bearer, validity=60, renewal=720, legacy=True):
+    ''' Check the signature of a bearer, and how long it can be used
+
+    Compact bearers carry `iat` and `exp` claims. Legacy bearers, with `salt` and
+    `stamp` fields, are accepted if `legacy` is set, for a transition period.
+    '''
+    options = dict(verify_exp=False, verify_iat=False)  # expired bearers may still be checked and renewed
     if secret is None:
-        payload = jwt.decode(bearer.encode(), verify=False)  # for tests only
+        payload = jwt.decode(bearer.encode(), verify=False, options=options)  # for tests only
     else:
-        payload = jwt.decode(bearer.encode(), secret, algorithms=['HS256'])
-    if payload.get('salt', None) is None:
-        raise ValueError("Missing salt field in the payload")
-    if payload.get('stamp', None) is None:
-        raise ValueError("Missing stamp field in the payload")
-    payload['is_valid'] = stamp_is_valid(stamp=payload['stamp'], validity=validity)
-    payload['is_renewable'] = stamp_is_valid(stamp=payload['stamp'], validity=renewal)
+        payload = jwt.decode(bearer.encode(), secret, algorithms=['HS256'], options=options)
+    (issued, expiry) = _get_lifetime(payload, validity=validity, legacy=legacy)
+    now = time()
+    is_current = issued <= now + 5 * 60  # future stamps are not accepted
+    payload['is_valid'] = is_current and now <= expiry
+    payload['is_renewable'] = is_current and now <= issued + 60 * renewal
 
     class Payload:
         def __init__(self, **kwargs):
@@ -73,6 +95,24 @@ def decode_bearer(secret, bearer, validity=60, renewal=720):
     return Payload(**payload)
 
 
+def _get_lifetime(payload, validity, legacy):
+    ''' Find when some bearer has been issued, and when it expires '''
+    if 'iat' in payload and 'exp' in payload:
+        (issued, expiry) = (payload['iat'], payload['exp'])
+    elif not legacy:
+        raise jwt.exceptions.DecodeError("Legacy bearers are not accepted anymore")
+    else:
+        if payload.get('salt', None) is None:
+            raise ValueError("Missing salt field in the payload")
+        if payload.get('stamp', None) is None:
+            raise ValueError("Missing stamp field in the payload")
+        issued = get_issued(payload['stamp'])
+        expiry = issued + 60 * validity
+    if not isinstance(issued, int) or not isinstance(expiry, int):
+        raise ValueError("Invalid iat or exp field in the payload")
+    return (issued, expiry)
+
+
 def compute_signature(hash, salt, stamp):
     message = hash + '\n' + salt
     blob = hmac.new(stamp.encode('utf-8'),
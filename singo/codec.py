@@ -0,0 +1,86 @@
+import logging
+import re
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider  # Flask >= 2.2
+except ImportError:
+    from flask.json import JSONEncoder
+    DefaultJSONProvider = None
+
+
+logger = logging.getLogger(__name__)
+
+# floats that some versions of orjson write with an exponent such as 1e16, instead of 1e+16
+EXPONENT = re.compile(rb'(?:^|[:,\[])-?\d+(?:\.\d+)?e')
+DIGITS = bytes.maketrans(b'123456789', b'000000000')
+
+
+def has_exponent(data):
+    ''' Tell if some orjson output has a float with an exponent, with a quick check first '''
+    if b'0e' not in data.translate(DIGITS):  # most of the time
+        return False
+    return EXPONENT.search(data) is not None  # strings may also have a digit followed by e
+
+
+def is_compatible(value, data):
+    ''' Tell if some orjson output is the same as from the standard library
+
+    Differences are non-ASCII and DEL characters, that the standard library escapes,
+    small floats, written 0.00001 instead of 1e-05, floats with an exponent, and NaN
+    and infinite floats, that orjson writes null.
+    '''
+    if not data.isascii() or b'\x7f' in data or b'0.0000' in data or has_exponent(data):
+        return False
+    return b'null' not in data or orjson.loads(data) == value  # None, and not NaN
+
+
+def fast_dumps(value, default=None):
+    ''' Encode some value as compact JSON with sorted keys, or return None if this cannot be done quickly
+
+    The output is the same as `json.dumps(value, separators=(',', ':'), sort_keys=True)`.
+    '''
+    if orjson is None:
+        return None
+    try:
+        data = orjson.dumps(value,
+                            default=default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+    except TypeError:  # e.g., keys that are not strings, or integers of more than 64 bits
+        return None
+    return data.decode('ascii') if is_compatible(value, data) else None
+
+
+if DefaultJSONProvider:
+    class FastJSONProvider(DefaultJSONProvider):
+        ''' Use orjson for compact output, as produced by `jsonify()` with Flask >= 2.2 '''
+
+        def dumps(self, obj, **kwargs):
+            compact = (dict(kwargs, indent=None) == dict(indent=None, separators=(',', ':'))  # indent is not always given
+                       and self.sort_keys and self.ensure_ascii)
+            return (compact and fast_dumps(obj, default=self.default)) or super().dumps(obj, **kwargs)
+
+else:
+    class FastJSONEncoder(JSONEncoder):
+        ''' Use orjson for compact output, as produced by `jsonify()` with Flask < 2.2 '''
+
+        def encode(self, o):
+            compact = (self.indent is None and self.item_separator == ',' and self.key_separator == ':'
+                       and self.sort_keys and self.ensure_ascii and not self.skipkeys)
+            return (compact and fast_dumps(o, default=self.default)) or super().encode(o)
+
+
+def register_codec(app):
+    ''' Encode JSON responses of some application with the fastest codec that is installed '''
+    if orjson is None:
+        logger.info("encoding JSON with the standard library")
+        return
+    logger.info("encoding JSON with orjson")
+    if DefaultJSONProvider:
+        app.json = FastJSONProvider(app)
+    else:
+        app.json_encoder = FastJSONEncoder
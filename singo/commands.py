@@ -1,6 +1,10 @@
 import logging
 from time import time
 from yaml import safe_load_all, dump
+try:
+    from yaml import CDumper as Dumper
+except ImportError:  # libyaml is not available
+    from yaml import Dumper
 
 
 from customization import c11n
@@ -28,18 +32,22 @@ class Commands:
         if self._should_close:
             self.stream.close()
 
-    def emit(self, persona, scope, action, payload):
+    def emit(self, persona, scope, action, payload, identity=None):
         if self.enabled:
-            record = self.export(persona=persona, scope=scope, action=action, payload=payload)
+            record = self.export(persona=persona, scope=scope, action=action, payload=payload, identity=identity)
             self.stream.write(record)
             self.stream.flush()
 
-    def export(self, persona, scope, action, payload):
-        return '---\n' + dump(dict(persona=persona,
-                                   scope=scope,
-                                   action=action,
-                                   payload=payload,
-                                   stamp=time()),
+    def export(self, persona, scope, action, payload, identity=None):
+        record = dict(persona=persona,
+                      scope=scope,
+                      action=action,
+                      payload=payload,
+                      stamp=time())
+        if identity:  # e.g., to replay changes of own identity
+            record['identity'] = identity
+        return '---\n' + dump(record,
+                              Dumper=Dumper,
                               default_flow_style=False)
 
     def parse(self, dispatchers=[]):
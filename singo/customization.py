@@ -1,11 +1,51 @@
 import os
 
+from store import Store
+from store_log import LogStore
+from store_sqlite import SqliteStore
+
 
 class Customization:
 
     def __init__(self):
         self.state_file = os.environ.get('STATE_FILE', 'fixtures/state.yaml')
         self.commands_file = os.environ.get('COMMANDS_FILE', 'fixtures/commands.yaml')
+        self.channels = [x for x in os.environ.get('CHANNELS', 'universe,community,board,item').split(',') if x]
+        self.sqlite_stores = [x for x in os.environ.get('SQLITE_STORES', '').split(',') if x]  # e.g., 'users,board'
+        self.sqlite_directory = os.environ.get('SQLITE_DIRECTORY', 'fixtures')
+        self.log_stores = [x for x in os.environ.get('LOG_STORES', '').split(',') if x]  # e.g., 'item'
+        self.log_directory = os.environ.get('LOG_DIRECTORY', 'fixtures')
+        self.indexed_fields = [x for x in os.environ.get('INDEXED_FIELDS', 'board,author').split(',') if x]  # e.g., 'author,item:board'
+        self.searchable_channels = [x for x in os.environ.get('SEARCHABLE_CHANNELS', '').split(',') if x]  # e.g., 'board,item'
+        self.compression_level = int(os.environ.get('COMPRESSION_LEVEL', '6'))  # 0 to disable compression
+        self.compression_minimum_size = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '1024'))
+        self.password_hasher = os.environ.get('PASSWORD_HASHER', 'scrypt')  # or 'pbkdf2_sha256'
+        self.password_cost = int(os.environ.get('PASSWORD_COST', '0'))  # scrypt n, or PBKDF2 iterations, 0 for default
+        self.password_workers = int(os.environ.get('PASSWORD_WORKERS', '2'))  # concurrent password verifications
+        self.password_queue_size = int(os.environ.get('PASSWORD_QUEUE_SIZE', '8'))  # before answering 429
+        self.events_subscribers = int(os.environ.get('EVENTS_SUBSCRIBERS', '4'))  # per worker, each holding one of SINGO_THREADS
+
+    def get_store(self, name):
+        if name in self.sqlite_stores:
+            return SqliteStore(path=os.path.join(self.sqlite_directory, f"{name}.sqlite"))
+        if name in self.log_stores:
+            return LogStore(directory=os.path.join(self.log_directory, f"{name}.logs"))
+        return Store()
+
+    def check_workers(self, workers):
+        ''' Refuse persistent stores with several workers, as each store has a single writer '''
+        if workers and (self.sqlite_stores or self.log_stores):
+            raise ValueError("SQLITE_STORES and LOG_STORES can not be shared by workers, please set SINGO_WORKERS=0")
+
+    def get_indexed_fields(self, name):
+        fields = []
+        for field in self.indexed_fields:
+            if ':' in field:
+                channel, field = field.split(':', 1)
+                if channel != name:
+                    continue
+            fields.append(field)
+        return fields
 
 
 c11n = Customization()
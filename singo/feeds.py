@@ -0,0 +1,84 @@
+from collections import deque
+from shortuuid import uuid
+from threading import Condition
+
+
+class FullError(RuntimeError):
+    pass
+
+
+class Subscriber:
+    ''' Events waiting for delivery to one client '''
+
+    def __init__(self, events=None):
+        self.events = deque(events or [])  # (id, type, data)
+        self.overflow = False  # set when some events could not be buffered
+        self.reset = events is None  # set when past events could not be replayed
+
+
+class Feed:
+    ''' Recent changes, numbered for resumption, and fanned out to bounded buffers of subscribers
+
+    Each subscriber holds a server thread while it is connected. Feeds of a worker can
+    share some semaphore as slots, so that subscribers cannot take all threads, and a
+    FullError is raised when there is no slot left.
+    '''
+
+    def __init__(self, history_size=1000, buffer_size=100, slots=None):
+        self.epoch = uuid()[:8]  # distinguishes event ids across restarts
+        self.sequence = 0
+        self.history = deque(maxlen=history_size)  # (sequence, event) of last events
+        self.buffer_size = buffer_size
+        self.subscribers = set()
+        self.slots = slots  # e.g., a BoundedSemaphore shared by feeds of the worker
+        self.condition = Condition()
+
+    def publish(self, type, data):
+        with self.condition:
+            self.sequence += 1
+            event = (f"{self.epoch}-{self.sequence}", type, data)
+            self.history.append((self.sequence, event))
+            for subscriber in self.subscribers:
+                if len(subscriber.events) < self.buffer_size:
+                    subscriber.events.append(event)
+                else:  # slow client, that will have to resume from history
+                    subscriber.overflow = True
+            self.condition.notify_all()
+
+    def subscribe(self, last_event_id=None):
+        ''' Start buffering events, after those that have been missed since some event id '''
+        if self.slots and not self.slots.acquire(blocking=False):
+            raise FullError("Too many subscribers, please try again later")
+        with self.condition:
+            subscriber = Subscriber(self._since(last_event_id))
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.condition:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.discard(subscriber)
+        if self.slots:
+            self.slots.release()
+
+    def wait(self, subscriber, timeout=None):
+        ''' List buffered events of some subscriber, and wait for some if there are none yet '''
+        with self.condition:
+            if not subscriber.events and not subscriber.overflow:
+                self.condition.wait(timeout)
+            events = list(subscriber.events)
+            subscriber.events.clear()
+            return events
+
+    def _since(self, last_event_id):
+        if not last_event_id:
+            return []
+        epoch, _, sequence = last_event_id.rpartition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        last = int(sequence)
+        oldest = self.history[0][0] if self.history else self.sequence + 1
+        if last > self.sequence or last < oldest - 1:  # unknown, or some events have been forgotten
+            return None
+        return [event for sequence, event in self.history if sequence > last]
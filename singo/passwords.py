@@ -0,0 +1,142 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import logging
+import os
+from threading import BoundedSemaphore
+
+
+logger = logging.getLogger(__name__)
+
+
+class BusyError(RuntimeError):
+    pass
+
+
+def _encode(blob):
+    return base64.b64encode(blob).decode('ascii').rstrip('=')
+
+
+class Md5Hasher:
+    ''' Unsalted hashes of passwords, as stored before key derivation functions '''
+
+    algorithm = 'md5'
+
+    def hash(self, password):
+        return hashlib.md5(password.encode('utf-8')).hexdigest()
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.hash(password), encoded)
+
+    def needs_rehash(self, encoded):
+        return False  # never downgrade stronger hashes
+
+    def identifies(self, encoded):
+        return '$' not in encoded
+
+
+class Pbkdf2Hasher:
+    ''' Salted PBKDF2-SHA256 hashes, encoded as `pbkdf2_sha256$<iterations>$<salt>$<digest>` '''
+
+    algorithm = 'pbkdf2_sha256'
+    iterations = 260000
+
+    def __init__(self, cost=None):
+        self.iterations = cost or self.iterations
+
+    def hash(self, password, salt=None, iterations=None):
+        salt = salt or _encode(os.urandom(16))
+        iterations = iterations or self.iterations
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations)
+        return f"{self.algorithm}${iterations}${salt}${_encode(digest)}"
+
+    def verify(self, password, encoded):
+        _, iterations, salt, _ = encoded.split('$')
+        return hmac.compare_digest(self.hash(password, salt=salt, iterations=int(iterations)), encoded)
+
+    def needs_rehash(self, encoded):
+        return not encoded.startswith(f"{self.algorithm}${self.iterations}$")
+
+    def identifies(self, encoded):
+        return encoded.startswith(self.algorithm + '$')
+
+
+class ScryptHasher:
+    ''' Salted scrypt hashes, encoded as `scrypt$<n>$<r>$<p>$<salt>$<digest>` '''
+
+    algorithm = 'scrypt'
+    n = 2 ** 14  # memory and time, as a power of 2
+
+    def __init__(self, cost=None, r=8, p=1):
+        self.n = cost or self.n
+        self.r = r
+        self.p = p
+
+    def hash(self, password, salt=None, n=None, r=None, p=None):
+        salt = salt or _encode(os.urandom(16))
+        (n, r, p) = (n or self.n, r or self.r, p or self.p)
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('ascii'),
+                                n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+        return f"{self.algorithm}${n}${r}${p}${salt}${_encode(digest)}"
+
+    def verify(self, password, encoded):
+        _, n, r, p, salt, _ = encoded.split('$')
+        return hmac.compare_digest(self.hash(password, salt=salt, n=int(n), r=int(r), p=int(p)), encoded)
+
+    def needs_rehash(self, encoded):
+        return not encoded.startswith(f"{self.algorithm}${self.n}${self.r}${self.p}$")
+
+    def identifies(self, encoded):
+        return encoded.startswith(self.algorithm + '$')
+
+
+HASHERS = {x.algorithm: x for x in [Md5Hasher, Pbkdf2Hasher, ScryptHasher]}
+
+
+def get_hasher(algorithm='scrypt', cost=None):
+    ''' Build the hasher for new passwords, e.g., 'scrypt', 'pbkdf2_sha256' or 'md5' '''
+    if algorithm not in HASHERS:
+        raise ValueError(f"Unknown password hasher '{algorithm}'")
+    if algorithm == 'md5':
+        return Md5Hasher()
+    return HASHERS[algorithm](cost=cost)
+
+
+class Passwords:
+    ''' Hash new passwords with some hasher, and verify stored ones whatever their algorithm '''
+
+    def __init__(self, hasher=None, workers=2, queue_size=8):
+        self.hasher = hasher or ScryptHasher()
+        self.hashers = [self.hasher] + [x() for x in HASHERS.values() if x.algorithm != self.hasher.algorithm]
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = BoundedSemaphore(workers + queue_size)  # computations running or waiting
+
+    def hash(self, password):
+        return self.hasher.hash(password)
+
+    def verify(self, password, encoded):
+        ''' Check some password against a stored hash, and return a hash to store instead if needed
+
+        Computations are made in a bounded pool of threads, to not compete with other
+        requests for the processor. A BusyError is raised if too many are pending.
+        '''
+        if not self.slots.acquire(blocking=False):
+            raise BusyError("Too many authentication requests, please try again later")
+        try:
+            return self.pool.submit(self._verify, password, encoded).result()
+        finally:
+            self.slots.release()
+
+    def _verify(self, password, encoded):
+        for hasher in self.hashers:
+            if hasher.identifies(encoded):
+                break
+        else:
+            return (False, None)
+        if not hasher.verify(password, encoded):
+            return (False, None)
+        if self.hasher.needs_rehash(encoded):
+            logger.debug(f"rehashing password with {self.hasher.algorithm}")
+            return (True, self.hasher.hash(password))
+        return (True, None)
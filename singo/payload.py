@@ -0,0 +1,29 @@
+from flask import abort, request
+import json
+
+
+def check_request_size(maximum_size):
+    ''' Reject the current request if its declared body is too large, before reading it '''
+    length = request.content_length
+    if length is not None and length > maximum_size:
+        abort(413, f"Request exceeds maximum size of {maximum_size} bytes")
+
+
+def get_payload(maximum_size):
+    ''' Parse the JSON body of the current request, without reading more than some size '''
+    check_request_size(maximum_size)
+    if request.content_length is None:  # no declared length, read up to the limit only
+        data = request.stream.read(maximum_size + 1)
+        if len(data) > maximum_size:
+            abort(413, f"Request exceeds maximum size of {maximum_size} bytes")
+    else:
+        data = request.get_data()  # bounded by content length
+    try:
+        return json.loads(data)
+    except ValueError:
+        abort(400, "Please provide a valid JSON payload")
+
+
+def get_size(payload):
+    ''' Measure the JSON serialization of some payload, in bytes '''
+    return len(json.dumps(payload, default=str).encode('utf-8'))
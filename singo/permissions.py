@@ -1,4 +1,5 @@
 import logging
+import sys
 from yaml import safe_load
 
 
@@ -13,6 +14,11 @@ AUTHORIZED_SCOPES = ['access-content',          # navigate a channel
 
 
 class Permissions:
+    ''' Statements compiled into a matrix of topics by scope, with a bit per persona
+
+    A topic ending with '*', e.g., 'update-*', grants all topics that start with
+    the same prefix, including those that are not listed.
+    '''
 
     def __init__(self,
                  path=None,
@@ -20,14 +26,26 @@ class Permissions:
 
         self.authorized_scopes = authorized_scopes
 
-        self.statements = set()
+        self.statements = set()  # (scope, persona, topic) as granted
+        self.persona_bits = {}  # persona -> bit
+        self.topic_masks = {scope: {} for scope in authorized_scopes}  # scope -> topic -> personas, with patterns
+        self.prefix_masks = {scope: [] for scope in authorized_scopes}  # scope -> [(prefix, personas)]
         if path:
             logger.info(f"loading permissions from '{path}'...")
             self.load(open(path, 'r'))
 
     def authorize(self, scope, persona, topic):
-        statement = scope + ':' + persona + ':' + topic
-        return statement in self.statements
+        bit = self.persona_bits.get(persona, 0)
+        masks = self.topic_masks.get(scope, None)
+        if not bit or masks is None:
+            return False
+        mask = masks.get(topic, None)
+        if mask is None:  # topic only granted by patterns, if any
+            mask = 0
+            for prefix, personas in self.prefix_masks[scope]:
+                if topic.startswith(prefix):
+                    mask |= personas
+        return mask & bit != 0
 
     def count(self):
         return len(self.statements)
@@ -35,7 +53,37 @@ class Permissions:
     def grant(self, scope, persona, topic):
         if scope not in self.authorized_scopes:
             raise ValueError(f"Unauthorized scope '{scope}'")
-        self.statements.add(scope + ':' + persona + ':' + topic)
+        self.statements.add((scope, persona, topic))
+
+        persona = sys.intern(persona)
+        bit = self.persona_bits.setdefault(persona, 1 << len(self.persona_bits))
+        if topic.endswith('*'):
+            self._grant_prefix(scope, sys.intern(topic[:-1]), bit)
+        else:
+            self._grant_topic(scope, sys.intern(topic), bit)
+
+    def _grant_prefix(self, scope, prefix, bit):
+        patterns = self.prefix_masks[scope]
+        for index, (known, personas) in enumerate(patterns):
+            if known == prefix:
+                patterns[index] = (prefix, personas | bit)
+                break
+        else:
+            patterns.append((prefix, bit))
+        masks = self.topic_masks[scope]
+        for known in masks.keys():  # topics listed before the pattern
+            if known.startswith(prefix):
+                masks[known] |= bit
+
+    def _grant_topic(self, scope, topic, bit):
+        masks = self.topic_masks[scope]
+        mask = masks.get(topic, None)
+        if mask is None:  # topics listed after patterns
+            mask = 0
+            for prefix, personas in self.prefix_masks[scope]:
+                if topic.startswith(prefix):
+                    mask |= personas
+        masks[topic] = mask | bit
 
     def grant_all(self, scope, items):
         for item in items:
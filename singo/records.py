@@ -1,44 +1,182 @@
+from array import array
 import base64
-from itertools import islice
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge
 import logging
 from shortuuid import uuid
+from threading import RLock
 from time import time
 
-from store import Store
+from search import SearchIndex
+from store import Store, thaw
 
 
 logger = logging.getLogger(__name__)
 
 
+def merge_patch(target, patch):
+    ''' Apply a JSON merge patch to some value, as per RFC 7386, without copying unchanged parts '''
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key, None), value)
+    return result
+
+
+def project(record, fields):
+    ''' Build a record with some attributes only, without copying the others '''
+    return {k: record[k] for k in fields if k in record}
+
+
 class Records:
 
     def __init__(self,
-                 salt='azerty'):
+                 salt='azerty',
+                 store=None,
+                 indexed_fields=None,
+                 searchable=False):
 
-        self.records = Store()
+        self.records = store or Store()
         self.salt = salt  # for pagination tokens
         self.forbidden_attributes = ['bearer', 'secret', 'record_has_been_loaded']
+        self.indexed_fields = indexed_fields or []
+        self.searchable = searchable  # full-text search of string fields
+        self.epoch = uuid()[:8]  # distinguishes generations across restarts
+        self.generation = 0  # incremented on each change
+        self._load_indexes()
+
+    def _load_indexes(self):
+        self.lock = RLock()  # keeps stamps and stamped_ids aligned across threads
+        self.stamps = array('d')  # numeric stamps, in increasing order
+        self.stamped_ids = []  # aligned with stamps
+        self.stamp_by_id = {}
+        self.postings = {}  # field -> value -> sorted (stamp, id), built on first use of each field
+        self.search_index = None
+        for stamp, id in self.records.stamps():  # without reading records
+            try:
+                self.stamps.append(float(stamp))
+            except ValueError:
+                logger.warning(f"ignoring invalid stamp of record '{id}'")
+                continue
+            self.stamped_ids.append(id)
+            self.stamp_by_id[id] = stamp
+        self.generation += len(self.stamped_ids)
+        if self.searchable:
+            self._load_search_index()
+
+    def _load_search_index(self):
+        self.search_index = SearchIndex()
+        for record in self.records.scan():
+            if record['id'] in self.stamp_by_id:
+                self.search_index.add(record['id'], record)
+
+    def _get_postings(self, field):
+        postings = self.postings.get(field, None)
+        if postings is None:
+            with self.lock:
+                if field not in self.postings:
+                    logger.debug(f"indexing field '{field}'...")
+                    postings = {}
+                    for record in self.records.scan():
+                        for key in self._index_keys(record.get(field, None)):
+                            postings.setdefault(key, []).append((record['stamp'], record['id']))
+                    for posting in postings.values():
+                        posting.sort()
+                    self.postings[field] = postings
+                postings = self.postings[field]
+        return postings
+
+    def _index_keys(self, value):
+        values = value if isinstance(value, list) else [value]
+        return {('true' if x else 'false') if isinstance(x, bool) else str(x)
+                for x in values if isinstance(x, (str, int, float))}
+
+    def _index(self, id, record):
+        self.generation += 1
+        self.stamp_by_id[id] = record['stamp']
+        for field, postings in self.postings.items():
+            for key in self._index_keys(record.get(field, None)):
+                insort(postings.setdefault(key, []), (record['stamp'], id))
+        if self.search_index:
+            self.search_index.add(id, record)
+
+    def _unindex(self, id, record):
+        self.generation += 1
+        self.stamp_by_id.pop(id, None)
+        if self.search_index:
+            self.search_index.remove(id)
+        for field, postings in self.postings.items():
+            for key in self._index_keys(record.get(field, None)):
+                self._unpost(postings, key, (record['stamp'], id))
+
+    def _unpost(self, postings, key, entry):
+        posting = postings.get(key, [])
+        position = bisect_left(posting, entry)
+        if position < len(posting) and posting[position][1] == entry[1]:
+            del posting[position]
+        if not posting:
+            postings.pop(key, None)
 
-    def _encode_token(self, token):
-        return base64.b64encode(bytes(self.salt + str(token), encoding='utf-8')).decode()
+    def _stamp(self, id, stamp):
+        position = bisect_right(self.stamps, stamp)
+        while position and self.stamps[position - 1] == stamp and self.stamped_ids[position - 1] > id:
+            position -= 1  # same order as in stores, e.g., for records of a batch
+        self.stamps.insert(position, stamp)
+        self.stamped_ids.insert(position, id)
+
+    def _unstamp(self, id, stamp):
+        position = bisect_left(self.stamps, stamp)
+        while position < len(self.stamps) and self.stamps[position] == stamp:
+            if self.stamped_ids[position] == id:
+                del self.stamps[position]
+                del self.stamped_ids[position]
+                return
+            position += 1
+
+    def _forget(self, id):
+        with self.lock:
+            record = self.records.get(id, None)
+            if record is None or 'stamp' not in record:
+                return
+            self._unindex(id, record)
+            self._unstamp(id, float(record['stamp']))
+
+    def _put(self, id, record, stamp=None):
+        with self.lock:
+            stamp = float(stamp or time())  # given when replaying writes of another process
+            record['stamp'] = str(stamp)
+            record.pop('id', None)
+            self._forget(id)
+            self.records.put(id, **record)
+            self._stamp(id, stamp)
+            self._index(id, record)
+
+    def _encode_token(self, stamp, id):
+        return base64.urlsafe_b64encode(bytes(self.salt + str(stamp) + ':' + str(id), encoding='utf-8')).decode()
 
     def _decode_token(self, token):
         if token == 'EOF':
             raise ValueError(f"End of file")
         if token is None or token == 'None':
-            return 0
-        decoded = base64.b64decode(token.encode())
-        token = int(decoded[len(self.salt):])
-        if token < 1:
-            token = 0
-        return token
-
-    def chunk(self, token=None, count=10):
-        token = self._decode_token(token)
-        slice = [x for x in islice(self.records.ids_by('stamp'), token, token + count)]
+            return None
+        decoded = base64.b64decode(token.encode(), altchars=b'-_', validate=True).decode('utf-8')
+        if not decoded.startswith(self.salt) or ':' not in decoded:
+            raise ValueError("Invalid token")
+        return tuple(decoded[len(self.salt):].split(':', 1))  # (stamp, id) of last record seen
+
+    def chunk(self, token=None, count=10, field=None, value=None):
+        after = self._decode_token(token)
+        if field is None:
+            slice = self.records.ids_after('stamp', after=after, count=count)
+        else:
+            slice = self.ids_where(field=field, value=value, after=after, count=count)
         actual = len(slice)
         records = [self.records.get(id) for id in slice]
-        next = self._encode_token(token + count) if actual == count else 'EOF'
+        next = self._encode_token(records[-1]['stamp'], records[-1]['id']) if actual and actual == count else 'EOF'
 
         class Chunk:
             def __init__(self, **kwargs):
@@ -46,39 +184,100 @@ class Records:
 
         return Chunk(records=records, count=actual, token=next)
 
+    def ids_where(self, field, value, after=None, count=10):
+        ''' Seek ids of records having some value in an indexed field, or any of a list of values, most recent first '''
+        if field not in self.indexed_fields:
+            raise KeyError(f"Field '{field}' is not indexed")
+        postings = self._get_postings(field)
+        values = value if isinstance(value, list) else [value]
+        slices = []
+        for value in values:
+            posting = postings.get(value, [])
+            stop = len(posting) if after is None else bisect_left(posting, tuple(after))
+            slices.append(reversed(posting[max(stop - count, 0):stop]))
+        ids = []
+        for _, id in merge(*slices, reverse=True):
+            if ids and ids[-1] == id:  # listed under several values
+                continue
+            ids.append(id)
+            if len(ids) == count:
+                break
+        return ids
+
+    def search(self, query, count=10):
+        ''' List records that best match some query, best first '''
+        if self.search_index is None:
+            raise ValueError("Full-text search is not enabled")
+        with self.lock:  # postings are changed by writes
+            hits = self.search_index.search(query, count=count)
+        records = [self.records.get(id) for id, _ in hits]
+        return [x for x in records if x is not None]  # deleted since scored
+
+    def etag(self, id=None):
+        ''' Tag the current state of a record, or of the whole set of records if no id is given '''
+        if id is None:
+            return f"{self.epoch}-{self.generation}"
+        return self.stamp_by_id.get(id, None)
+
     def read(self, id):
         return self.records.get(id, None)
 
-    def write(self, id=None, **kwargs):
+    def read_many(self, ids):
+        ''' Read several records at once, and list None for those that are missing '''
+        return self.records.get_many(list(ids))
+
+    def write(self, id=None, stamp=None, **kwargs):
         id = id or uuid()
-        record = self.records.get(id, {})
+        record = dict(self.records.get(id, {}))
         for (key, value) in kwargs.items():
             if key not in self.forbidden_attributes:
                 record[key] = value
-        record['stamp'] = str(time())
-        record.pop('id', None)
-        self.records.put(id, **record)
+        self._put(id, record, stamp=stamp)
         return id
 
+    def patch(self, id, patch, stamp=None):
+        ''' Change some attributes of a record, and return False if there is no such record '''
+        record = self.records.get(id, None)
+        if record is None:
+            return False
+        patch = {k: v for k, v in patch.items() if k not in self.forbidden_attributes and k != 'id'}
+        self._put(id, merge_patch(record, patch), stamp=stamp)
+        return True
+
     def delete(self, id):
-        self.records.delete(id)
+        with self.lock:
+            self._forget(id)
+            self.records.delete(id)
+
+    def between(self, start=None, stop=None, count=None):
+        ''' List records stamped from start to stop, most recent first '''
+        with self.lock:
+            lower = 0 if start is None else bisect_left(self.stamps, start)
+            upper = len(self.stamps) if stop is None else bisect_right(self.stamps, stop)
+            if count is not None:
+                lower = max(lower, upper - count)
+            ids = self.stamped_ids[lower:upper]
+        return [self.records.get(id) for id in reversed(ids)]
 
     def count(self):
         return len(self.records.ids())
 
     def scan(self):
-        for id in self.records.ids():
-            yield self.records.get(id)
+        ''' Iterate over a consistent view of records, without loading all of them at once '''
+        return self.records.scan()
 
     def dump(self):
-        return [x for x in self.scan()]
+        return [thaw(x) for x in self.scan()]
 
     def load(self, iterator, append=True):
         if not append:
-            self.records = Store()
+            self.records.clear()
+            self._load_indexes()
+            self.generation += 1
         count = 0
         for record in iterator:
             record['record_has_been_loaded'] = True
+            record.pop('stamp', None)  # stamped again when loaded
             self.write(**record)
             count += 1
         return count
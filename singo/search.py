@@ -0,0 +1,76 @@
+from heapq import nlargest
+from math import log
+import re
+import unicodedata
+
+
+TAGS = re.compile(r'<[^>]*>')
+WORDS = re.compile(r'\w+')
+
+
+def tokenize(text):
+    ''' Turn some text to a list of lower-case terms, without HTML tags nor accents '''
+    text = unicodedata.normalize('NFKD', TAGS.sub(' ', text).lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return [x for x in WORDS.findall(text) if len(x) > 1]
+
+
+class SearchIndex:
+    ''' An inverted index of terms found in string fields of records, ranked with BM25 '''
+
+    def __init__(self, ignored_fields=None, k1=1.2, b=0.75):
+        self.ignored_fields = ignored_fields or ['id', 'stamp', 'version', 'previous_version']
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> id -> frequency of term in record
+        self.lengths = {}  # id -> number of terms in record
+        self.terms = {}  # id -> distinct terms of record
+        self.total_length = 0
+
+    def _terms(self, record):
+        terms = []
+        for key, value in record.items():
+            if key in self.ignored_fields:
+                continue
+            values = value if isinstance(value, list) else [value]
+            for text in values:
+                if isinstance(text, str):
+                    terms += tokenize(text)
+        return terms
+
+    def add(self, id, record):
+        self.remove(id)
+        terms = self._terms(record)
+        for term in terms:
+            posting = self.postings.setdefault(term, {})
+            posting[id] = posting.get(id, 0) + 1
+        self.lengths[id] = len(terms)
+        self.terms[id] = set(terms)
+        self.total_length += len(terms)
+
+    def remove(self, id):
+        if id not in self.lengths:
+            return
+        self.total_length -= self.lengths.pop(id)
+        for term in self.terms.pop(id):
+            posting = self.postings[term]
+            del posting[id]
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query, count=10):
+        ''' List (id, score) of best records for some query, best first '''
+        if not self.lengths:
+            return []
+        total = len(self.lengths)
+        average = self.total_length / total or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term, {})
+            if not posting:
+                continue
+            idf = log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for id, frequency in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[id] / average)
+                scores[id] = scores.get(id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return nlargest(count, scores.items(), key=lambda x: (x[1], x[0]))
@@ -1,26 +1,134 @@
-from copy import deepcopy
+from bisect import bisect_left, bisect_right, insort
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"'{type(self).__name__}' object is read-only")
+
+
+class FrozenDict(dict):
+    ''' A dictionary that cannot be changed once it has been built '''
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    ''' A list that cannot be changed once it has been built '''
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value):
+    ''' Build a read-only version of some value, without copying frozen parts '''
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    ''' Build a plain, modifiable, copy of some value '''
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
 
 
 class Store:
+    ''' Records are frozen on put, and shared on get without being copied '''
 
-    def __init__(self):
+    def __init__(self, sort_keys=None):
         self.records = {}
+        self.indexes = {key: [] for key in (sort_keys or ['stamp'])}  # sorted lists of (value, id)
 
     def get(self, id, default=None):
-        return deepcopy(self.records.get(id, default))
+        return self.records.get(id, default)
+
+    def get_many(self, ids):
+        return [self.records.get(id, None) for id in ids]
 
     def put(self, id, **kwargs):
-        record = deepcopy(kwargs)
-        record['id'] = id
+        kwargs['id'] = id
+        record = freeze(kwargs)
+        self._unindex(id, self.records.get(id, None))
         self.records[id] = record
+        self._index(id, record)
 
     def delete(self, id):
-        self.records.pop(id, None)
+        self._unindex(id, self.records.pop(id, None))
+
+    def clear(self):
+        self.records = {}
+        for index in self.indexes.values():
+            index.clear()
 
     def ids(self):
         return list(self.records.keys())
 
-    def ids_by(self, key, reverse=True):
-        return sorted(list(self.records.keys()),
-                      key=lambda id: self.records[id][key],
-                      reverse=reverse)
+    def scan(self):
+        ''' Iterate over records as they are now, even if some are changed in the meantime '''
+        return iter(list(self.records.values()))  # records are frozen, so a shallow copy is enough
+
+    def stamps(self):
+        ''' List (stamp, id) of records by increasing stamp, from the index if there is one '''
+        index = self.indexes.get('stamp', None)
+        if index is None:
+            return sorted((record['stamp'], id) for id, record in self.records.items() if 'stamp' in record)
+        return list(index)
+
+    def ids_by(self, key, reverse=True, start=0, stop=None):
+        index = self.indexes.get(key, None)
+        if index is None:  # no declared index, sort on the fly
+            ids = sorted(self.ids(),
+                         key=lambda id: self.get(id)[key],
+                         reverse=reverse)
+            return ids[start:stop]
+
+        count = len(index)
+        stop = count if stop is None else min(stop, count)
+        start = max(start, 0)
+        if start >= stop:
+            return []
+        if reverse:
+            return [id for _, id in reversed(index[count - stop:count - start])]
+        return [id for _, id in index[start:stop]]
+
+    def ids_after(self, key, after=None, count=10, reverse=True):
+        ''' Seek ids that follow a given (value, id) position in some index '''
+        index = self.indexes[key]
+        if reverse:
+            stop = len(index) if after is None else bisect_left(index, tuple(after))
+            return [id for _, id in reversed(index[max(stop - count, 0):stop])]
+        start = 0 if after is None else bisect_right(index, tuple(after))
+        return [id for _, id in index[start:start + count]]
+
+    def _index(self, id, record):
+        for key, index in self.indexes.items():
+            if key in record:
+                insort(index, (record[key], id))
+
+    def _unindex(self, id, record):
+        if record is None:
+            return
+        for key, index in self.indexes.items():
+            if key in record:
+                position = bisect_left(index, (record[key], id))
+                if position < len(index) and index[position][1] == id:
+                    del index[position]
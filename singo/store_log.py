@@ -0,0 +1,260 @@
+import json
+import logging
+import mmap
+import os
+from threading import Lock, Thread
+
+from store import Store, freeze
+
+
+logger = logging.getLogger(__name__)
+
+decoder = json.JSONDecoder()
+
+
+class LogStore(Store):
+    ''' Records are appended to segment files, and located with an in-memory key directory
+
+    Each entry of a segment is a JSON header line `[id, sort values, length]`,
+    followed by the JSON body of the record and a new line. Deletions are
+    recorded with a length of -1 and no body. On restart only headers are
+    parsed, so as to rebuild the key directory and sort indexes.
+    '''
+
+    def __init__(self, directory, sort_keys=None, segment_size=64000000, merge_threshold=8, sync=False):
+        super().__init__(sort_keys=sort_keys)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.merge_threshold = merge_threshold  # merge when there are more segments than this
+        self.sync = sync  # fsync each write
+        self.lock = Lock()
+        self.merging = Lock()
+        self.readers = 0  # scans in progress, that put merges on hold
+        self.merger = None  # last background thread
+        self.keys = {}  # id -> (segment, offset, length, sort values)
+        self.maps = {}  # segment -> mmap
+        self.stream = None
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segments()
+        logger.info(f"loading {len(segments)} segments from '{directory}'...")
+        for segment in segments:
+            self._replay(segment)
+        self._open(segments[-1] + 1 if segments else 1)
+
+    def close(self):
+        with self.lock:
+            self.stream.close()
+            for view in self.maps.values():
+                view.close()
+            self.maps = {}
+
+    def get(self, id, default=None):
+        with self.lock:
+            entry = self.keys.get(id, None)
+            if entry is None:
+                return default
+            segment, offset, length, _ = entry
+            body = self._read(segment, offset, length)
+        return freeze(json.loads(body))
+
+    def get_many(self, ids):
+        bodies = []
+        with self.lock:
+            for id in ids:
+                entry = self.keys.get(id, None)
+                bodies.append(None if entry is None else self._read(*entry[:3]))
+        return [None if body is None else freeze(json.loads(body)) for body in bodies]
+
+    def put(self, id, **kwargs):
+        kwargs['id'] = id
+        body = json.dumps(kwargs, default=str).encode('utf-8')
+        values = {key: kwargs[key] for key in self.indexes.keys() if key in kwargs}
+        with self.lock:
+            segment, offset = self._append(id, values, body)
+            self._unindex(id, self._values(id))
+            self.keys[id] = (segment, offset, len(body), values)
+            self._index(id, values)
+        self._check_merge()
+
+    def delete(self, id):
+        with self.lock:
+            if id not in self.keys:
+                return
+            self._append(id, {}, None)
+            self._unindex(id, self.keys.pop(id)[3])
+        self._check_merge()
+
+    def clear(self):
+        with self.lock:
+            self.stream.close()
+            for segment in self._segments():
+                self._drop(segment)
+            self.keys = {}
+            for index in self.indexes.values():
+                index.clear()
+            self._open(1)
+
+    def ids(self):
+        return list(self.keys.keys())
+
+    def scan(self):
+        ''' Iterate over records as they are when iteration starts, while merges are put on hold '''
+        with self.merging:  # after any merge in progress
+            with self.lock:
+                entries = list(self.keys.values())
+                self.readers += 1  # keep segments of the snapshot on disk
+        try:
+            for segment, offset, length, _ in entries:
+                with self.lock:
+                    body = self._read(segment, offset, length)
+                yield freeze(json.loads(body))
+        finally:
+            with self.lock:
+                self.readers -= 1
+
+    def merge(self):
+        ''' Rewrite live records of closed segments into a single one, and drop the others '''
+        if not self.merging.acquire(blocking=False):
+            return
+        try:
+            with self.lock:
+                if self.readers:  # tried again on next writes
+                    return
+                (closed, target, live) = self._close_segments()
+            logger.debug(f"merging {len(live)} records from {len(closed)} segments...")
+
+            moved = self._copy(target, live)
+            with self.lock:
+                self._relocate(moved, live)
+                for segment in closed:
+                    self._drop(segment)
+                self.oldest = target
+        finally:
+            self.merging.release()
+
+    def _relocate(self, moved, live):
+        for id, entry in moved.items():
+            if self.keys.get(id, None) == live[id]:  # not updated during the merge
+                self.keys[id] = entry
+
+    def _close_segments(self):
+        ''' Start a new active segment, and list live entries of previous ones '''
+        closed = self._segments()
+        target = self.active + 1  # older than the new active segment
+        self._open(self.active + 2)
+        live = {id: entry for id, entry in self.keys.items() if entry[0] < target}
+        return (closed, target, live)
+
+    def _copy(self, target, live):
+        ''' Write some entries to a new segment, and locate them there '''
+        moved = {}
+        with open(self._path(target), 'wb') as stream:
+            position = 0
+            for id, (segment, offset, length, values) in live.items():
+                with self.lock:
+                    body = self._read(segment, offset, length)
+                header = self._header(id, values, length)
+                stream.write(header + body + b'\n')
+                moved[id] = (target, position + len(header), length, values)
+                position += len(header) + length + 1
+            stream.flush()
+            os.fsync(stream.fileno())
+        return moved
+
+    def merge_in_background(self):
+        self.merger = Thread(target=self.merge, daemon=True)
+        self.merger.start()
+        return self.merger
+
+    def _check_merge(self):
+        if self.merge_threshold and self.active - self.oldest > self.merge_threshold and not self.merging.locked():
+            self.merge_in_background()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:08d}.log")
+
+    def _segments(self):
+        names = [x[:-len('.log')] for x in os.listdir(self.directory) if x.endswith('.log')]
+        return sorted(int(x) for x in names if x.isdigit())
+
+    def _open(self, segment):
+        if self.stream:
+            self.stream.close()
+        self.active = segment
+        self.stream = open(self._path(segment), 'ab')
+        self.position = self.stream.tell()
+        segments = self._segments()
+        self.oldest = segments[0] if segments else segment
+
+    def _drop(self, segment):
+        view = self.maps.pop(segment, None)
+        if view:
+            view.close()
+        os.remove(self._path(segment))
+
+    def _header(self, id, values, length):
+        return json.dumps([id, values, length], default=str).encode('utf-8') + b'\n'
+
+    def _append(self, id, values, body):
+        segment = self.active
+        header = self._header(id, values, -1 if body is None else len(body))  # -1 for a deletion
+        self.stream.write(header if body is None else header + body + b'\n')
+        self.stream.flush()
+        if self.sync:
+            os.fsync(self.stream.fileno())
+
+        offset = self.position + len(header)
+        self.position = self.stream.tell()
+        if self.position >= self.segment_size:
+            self._open(self.active + 1)
+        return segment, offset
+
+    def _read(self, segment, offset, length):
+        view = self.maps.get(segment, None)
+        if view is None or len(view) < offset + length:  # not mapped yet, or segment has grown
+            if view:
+                view.close()
+            with open(self._path(segment), 'rb') as stream:
+                view = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = view
+        return view[offset:offset + length]
+
+    def _values(self, id):
+        entry = self.keys.get(id, None)
+        return entry[3] if entry else None
+
+    def _replay(self, segment):
+        path = self._path(segment)
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        with open(path, 'rb') as stream:
+            view = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        with view:
+            position = 0
+            while position < size:
+                entry = self._parse(view, position, size)
+                if entry is None:
+                    logger.warning(f"ignoring truncated entry in '{path}' at offset {position}")
+                    return
+                id, values, offset, length = entry
+                self._unindex(id, self._values(id))
+                if length < 0:  # deletion
+                    self.keys.pop(id, None)
+                    position = offset
+                    continue
+                self.keys[id] = (segment, offset, length, values)
+                self._index(id, values)
+                position = offset + length + 1
+
+    def _parse(self, view, position, size):
+        ''' Decode the header at some position, or return None if the entry has been truncated '''
+        end = view.find(b'\n', position)
+        try:
+            id, values, length = decoder.decode(view[position:end].decode('utf-8'))
+        except ValueError:
+            return None
+        offset = end + 1
+        if end < 0 or offset + max(length, 0) > size:
+            return None
+        return (id, values, offset, length)
@@ -0,0 +1,110 @@
+import json
+import logging
+import sqlite3
+from threading import Lock
+
+from store import freeze
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteStore:
+    ''' Records are kept in a SQLite database, with the same interface as Store '''
+
+    def __init__(self, path=':memory:'):
+        logger.info(f"storing records in '{path}'...")
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS records "
+                                "(id TEXT PRIMARY KEY, stamp TEXT, body TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS records_by_stamp ON records (stamp, id)")
+
+    def close(self):
+        self.connection.close()
+
+    def _execute(self, statement, parameters=()):
+        with self.lock:
+            return self.connection.execute(statement, parameters).fetchall()
+
+    def get(self, id, default=None):
+        rows = self._execute("SELECT body FROM records WHERE id = ?", (id,))
+        if not rows:
+            return default
+        return freeze(json.loads(rows[0][0]))
+
+    def get_many(self, ids):
+        found = {}
+        for start in range(0, len(ids), 500):  # within limits of SQL variables
+            chunk = ids[start:start + 500]
+            statement = f"SELECT id, body FROM records WHERE id IN ({','.join('?' * len(chunk))})"
+            for id, body in self._execute(statement, chunk):
+                found[id] = body
+        return [freeze(json.loads(found[id])) if id in found else None for id in ids]
+
+    def put(self, id, **kwargs):
+        kwargs['id'] = id
+        stamp = kwargs.get('stamp', None)
+        self._execute("INSERT OR REPLACE INTO records (id, stamp, body) VALUES (?, ?, ?)",
+                      (id, None if stamp is None else str(stamp), json.dumps(kwargs, default=str)))
+
+    def delete(self, id):
+        self._execute("DELETE FROM records WHERE id = ?", (id,))
+
+    def clear(self):
+        self._execute("DELETE FROM records")
+
+    def ids(self):
+        return [id for id, in self._execute("SELECT id FROM records")]
+
+    def scan(self, chunk_size=500):
+        ''' Iterate over records as they are when iteration starts, a chunk at a time '''
+        if self.path == ':memory:':  # no other connection to this database
+            for body, in self._execute("SELECT body FROM records"):
+                yield freeze(json.loads(body))
+            return
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cursor = connection.execute("SELECT body FROM records")  # reads a snapshot of the database in WAL mode
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                for body, in rows:
+                    yield freeze(json.loads(body))
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            connection.close()
+
+    def stamps(self):
+        ''' List (stamp, id) of records by increasing stamp, without reading their bodies '''
+        return self._execute("SELECT stamp, id FROM records WHERE stamp IS NOT NULL ORDER BY stamp, id")
+
+    def ids_by(self, key, reverse=True, start=0, stop=None):
+        order = 'DESC' if reverse else 'ASC'
+        start = max(start, 0)
+        limit = -1 if stop is None else max(stop - start, 0)
+        if key == 'stamp':
+            statement = (f"SELECT id FROM records WHERE stamp IS NOT NULL "
+                         f"ORDER BY stamp {order}, id {order} LIMIT ? OFFSET ?")
+            parameters = (limit, start)
+        else:
+            statement = (f"SELECT id FROM records ORDER BY json_extract(body, ?) {order}, id {order} "
+                         f"LIMIT ? OFFSET ?")
+            parameters = ('$.' + key, limit, start)
+        return [id for id, in self._execute(statement, parameters)]
+
+    def ids_after(self, key, after=None, count=10, reverse=True):
+        if key != 'stamp':
+            raise ValueError(f"No index on '{key}'")
+        order = 'DESC' if reverse else 'ASC'
+        if after is None:
+            statement = f"SELECT id FROM records WHERE stamp IS NOT NULL ORDER BY stamp {order}, id {order} LIMIT ?"
+            parameters = (count,)
+        else:
+            comparison = '<' if reverse else '>'
+            statement = (f"SELECT id FROM records WHERE (stamp, id) {comparison} (?, ?) "
+                         f"ORDER BY stamp {order}, id {order} LIMIT ?")
+            parameters = (str(after[0]), after[1], count)
+        return [id for id, in self._execute(statement, parameters)]
@@ -1,10 +1,13 @@
-import hashlib
+from collections import OrderedDict
+import hmac
 import jwt
 import logging
-from time import time
 from shortuuid import uuid
+from threading import Lock
+from time import time
 
 import bearers
+from passwords import Md5Hasher, Passwords
 from records import Records
 
 
@@ -27,25 +30,33 @@ class NotFoundError(ValueError):
 class Users(Records):
 
     def __init__(self,
-                 authorized_personas=AUTHORIZED_PERSONAS, **kwargs):
+                 authorized_personas=AUTHORIZED_PERSONAS, passwords=None, **kwargs):
 
         self.authorized_personas = authorized_personas
+        self.passwords = passwords or Passwords()
 
+        self.bearer_cache_size = 10000  # decoded bearers, kept until their validity ends
+        self.bearer_cache_lock = Lock()
         self.set_bearer_secret()
         self.bearer_validity = 60
         self.bearer_renewal = 720
+        self.accept_legacy_bearers = True  # bearers with a string stamp, issued before compact ones
 
+        indexed_fields = kwargs.pop('indexed_fields', None) or []
+        kwargs['indexed_fields'] = ['persona'] + [x for x in indexed_fields if x != 'persona']  # for visibility of pages
         super().__init__(**kwargs)  # file loading may require bearer_secret
 
     def set_bearer_secret(self, bearer_secret=None):
         self.bearer_secret = bearer_secret or uuid()
         logger.info(f"using bearer secret '{self.bearer_secret}'")
+        with self.bearer_cache_lock:
+            self.bearer_cache = OrderedDict()  # bearer -> (identity, persona, expiry), signed with previous secret
 
-    def write(self, id=None, **kwargs):
+    def write(self, id=None, stamp=None, **kwargs):
         id = id or kwargs.get('e_mail', None)
         if not id:
             raise ValueError("Please provide an id or an e-mail")
-        record = self.records.get(id, {})
+        record = dict(self.records.get(id, {}))
 
         if record.get('persona', None) not in self.authorized_personas:
             if kwargs.get('secret', None) == self.bearer_secret:
@@ -61,11 +72,10 @@ class Users(Records):
                 id = value
             if key == 'password' and kwargs.get('record_has_been_loaded', False) is False:
                 # logger.debug(f"hashing {value}")
-                value = hashlib.md5(value.encode('utf-8')).hexdigest()
+                value = self.passwords.hash(value)
             if key == 'persona' and value not in self.authorized_personas:
                 raise ValueError(f"Invalid persona '{value}'")
             record[key] = value
-        record['stamp'] = str(time())
         record.pop('id', None)
 
         try:
@@ -81,71 +91,97 @@ class Users(Records):
             raise ValueError(str(error))
 
         # logger.debug(record)
-        self.records.put(id, **record)
+        self._put(id, record, stamp=stamp)
         return id
 
-    def authenticate_password(self, id, password, hash_password=True, salt=None, stamp=None, **kwargs):
-        if hash_password is True:
-            logger.debug(f"hashing {password}")
-            password = hashlib.md5(password.encode('utf-8')).hexdigest()
+    def authenticate_password(self, id, password, hash_password=True, **kwargs):
         record = self.read(id)
         if record is None:
             raise NotFoundError(f"Unknown identity '{id}'")
-        if password != record['password']:
-            logger.debug(password)
-            logger.debug(record['password'])
+        if hash_password is True:
+            (is_valid, rehashed) = self.passwords.verify(password, record['password'])
+        else:  # password is compared with the stored value
+            (is_valid, rehashed) = (hmac.compare_digest(password, record['password']), None)
+        if not is_valid:
             raise ValueError(f"Incorrect authentication credentials")
-        return bearers.encode_bearer(secret=self.bearer_secret,
-                                     identity=record['id'],
-                                     persona=record['persona'],
-                                     first_name=record.get('first_name', ''),
-                                     last_name=record.get('last_name', ''),
-                                     e_mail=record.get('e_mail', '-'),
-                                     salt=salt,
-                                     stamp=stamp)
+        if rehashed:  # e.g., legacy MD5 hash
+            updated = dict(record, password=rehashed)
+            updated.pop('id', None)
+            self._put(record['id'], updated, stamp=record['stamp'])  # not a change of the identity
+        return self._encode_bearer(identity=record['id'], persona=record['persona'])
 
     def authenticate_signature(self, id, signature, salt, stamp, **kwargs):
+        ''' Check a signature computed from the MD5 hash of a password, for records that still have it '''
         record = self.read(id)
         if record is None:
             raise NotFoundError(f"Unknown identity '{id}'")
+        if not Md5Hasher().identifies(record['password']):  # the hash is not shared with clients anymore
+            raise ValueError("Please authenticate with a password")
         expected = bearers.compute_signature(hash=record['password'],
                                              salt=salt,
                                              stamp=stamp)
         if expected != signature:
             raise ValueError(f"Incorrect authentication credentials")
-        return bearers.encode_bearer(secret=self.bearer_secret,
-                                     identity=record['id'],
-                                     persona=record['persona'],
-                                     first_name=record.get('first_name', ''),
-                                     last_name=record.get('last_name', ''),
-                                     e_mail=record.get('e_mail', '-'),
-                                     salt=salt,
-                                     stamp=stamp)
+        return self._encode_bearer(identity=record['id'], persona=record['persona'])
 
     def decode_identity(self, bearer):
         if bearer != 'no-bearer':
+            cached = self._get_cached_identity(bearer)
+            if cached:
+                return cached
             try:
                 payload = bearers.decode_bearer(secret=self.bearer_secret,
-                                                bearer=bearer)
+                                                bearer=bearer,
+                                                legacy=self.accept_legacy_bearers)
+                self._cache_identity(bearer, payload)
                 return (payload.identity, payload.persona)
             except jwt.exceptions.DecodeError as error:
                 logger.debug(error)
         return ('nobody', 'anonymous')
 
+    def _get_cached_identity(self, bearer):
+        with self.bearer_cache_lock:
+            entry = self.bearer_cache.get(bearer, None)
+            if entry is None:
+                return None
+            (identity, persona, expiry) = entry
+            if expiry < time():  # decode it again, as a new entry
+                del self.bearer_cache[bearer]
+                return None
+            self.bearer_cache.move_to_end(bearer)
+            return (identity, persona)
+
+    def _cache_identity(self, bearer, payload):
+        if self.bearer_cache_size < 1:
+            return
+        expiry = getattr(payload, 'exp', None)
+        if expiry is None:  # legacy bearer
+            expiry = bearers.get_issued(payload.stamp) + 60 * self.bearer_validity
+        with self.bearer_cache_lock:
+            self.bearer_cache[bearer] = (payload.identity, payload.persona, expiry)
+            while len(self.bearer_cache) > self.bearer_cache_size:
+                self.bearer_cache.popitem(last=False)  # least recently used
+
     def check_bearer(self, bearer):
         payload = bearers.decode_bearer(secret=self.bearer_secret,
                                         bearer=bearer,
                                         validity=self.bearer_validity,
-                                        renewal=self.bearer_renewal)
+                                        renewal=self.bearer_renewal,
+                                        legacy=self.accept_legacy_bearers)
         return payload.__dict__
 
     def renew_bearer(self, bearer):
         payload = bearers.decode_bearer(secret=self.bearer_secret,
                                         bearer=bearer,
                                         validity=self.bearer_validity,
-                                        renewal=self.bearer_renewal)
+                                        renewal=self.bearer_renewal,
+                                        legacy=self.accept_legacy_bearers)
         if not payload.is_renewable:
             raise ValueError("Bearer has expired")
-        return bearers.encode_bearer(secret=self.bearer_secret,
-                                     identity=payload.identity,
-                                     persona=payload.persona)
+        return self._encode_bearer(identity=payload.identity, persona=payload.persona)
+
+    def _encode_bearer(self, identity, persona):
+        return bearers.encode_compact_bearer(secret=self.bearer_secret,
+                                             identity=identity,
+                                             persona=persona,
+                                             validity=self.bearer_validity)
@@ -0,0 +1,195 @@
+from contextlib import contextmanager
+import fcntl
+from functools import wraps
+import gc
+import logging
+import os
+import signal
+import socket
+from threading import Lock, Thread
+from time import sleep
+from werkzeug.exceptions import HTTPException
+from yaml import safe_load_all
+
+try:
+    import waitress
+except ImportError:  # needed only to serve with several workers
+    waitress = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class Replicator:
+    ''' Keeps workers in line, by applying commands of the shared journal in the same order everywhere
+
+    A write is run with an exclusive lock on the journal. The worker first applies
+    commands appended by other workers, then runs the write, that appends its own
+    command. Between writes, a background thread applies commands of other
+    workers, so that reads are refreshed as well. Journaled records carry the
+    stamps given by their writer, so that cursors and etags are the same in
+    all workers.
+    '''
+
+    write_methods = ['post', 'batch', 'put', 'patch', 'delete']  # views that emit commands
+
+    def __init__(self, app, commands=None, dispatchers=None, interval=0.1):
+        self.app = app
+        self.commands = commands
+        self.dispatchers = dispatchers or []
+        self.interval = interval  # seconds between checks of the journal
+        self.lock = Lock()  # between threads of this worker
+        self.stream = None  # set in workers only
+        self.offset = 0  # in journal, up to the last command applied
+
+    def mark(self):
+        ''' Remember how far the journal reflects the state of this process, before forking workers '''
+        self.offset = os.path.getsize(self.commands.stream.name)
+
+    def start(self):
+        ''' Follow the journal from a worker '''
+        self.stream = open(self.commands.stream.name, 'rb')  # own file description, for locks of this worker
+        Thread(target=self._follow, daemon=True).start()
+
+    def wrap(self, wrapped):
+        ''' Serialize some view across workers, if it writes '''
+        if wrapped.__name__ not in self.write_methods:
+            return wrapped
+
+        @wraps(wrapped)
+        def wrapper(*args, **kwargs):
+            if self.stream is None:  # single process
+                return wrapped(*args, **kwargs)
+            with self._locked():
+                self._catch_up()
+                try:
+                    return wrapped(*args, **kwargs)
+                finally:
+                    self.offset = self._size()  # without replaying own commands
+        return wrapper
+
+    @contextmanager
+    def _locked(self):
+        with self.lock:
+            fcntl.flock(self.stream.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.stream.fileno(), fcntl.LOCK_UN)
+
+    def _size(self):
+        return os.fstat(self.stream.fileno()).st_size
+
+    def _follow(self):
+        while True:
+            sleep(self.interval)
+            if self._size() > self.offset:
+                with self._locked():
+                    self._catch_up()
+
+    def _catch_up(self):
+        size = self._size()
+        if size <= self.offset:
+            return
+        self.stream.seek(self.offset)
+        text = self.stream.read(size - self.offset).decode('utf-8')
+        self.offset = size
+        self.commands.enabled = False  # do not journal replayed commands again
+        try:
+            with self.app.app_context():
+                for record in safe_load_all(text):
+                    if record:
+                        self._dispatch(record)
+        finally:
+            self.commands.enabled = True
+
+    def _dispatch(self, record):
+        record.pop('stamp', None)  # order is given by the journal, and records carry their own stamps
+        for dispatcher in self.dispatchers:
+            try:
+                dispatcher(**record)
+            except HTTPException as error:
+                logger.warning(f"ignoring command '{record['action']}' on '{record['scope']}': {error}")
+
+    @property
+    def is_running(self):
+        ''' Tell if this process is one of several workers '''
+        return self.stream is not None
+
+
+def _bind(host, port, backlog=1024):
+    ''' Listen before forking, so that workers compete for connections '''
+    server = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(backlog)
+    server.setblocking(False)
+    return server
+
+
+def _spawn(app, server, threads, keep_alive, after_fork=None):
+    ''' Start a worker, that serves some application until it is terminated '''
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        if after_fork:
+            after_fork()
+        waitress.create_server(app,
+                               sockets=[server],
+                               threads=threads,
+                               channel_timeout=keep_alive).run()  # idle connections are closed after some seconds
+    finally:
+        os._exit(1)
+
+
+def serve(app, host='0.0.0.0', port=5000, workers=2, threads=8, keep_alive=5, before_fork=None, after_fork=None):
+    ''' Serve some application with processes forked once it has been loaded, and respawned if they fail
+
+    Each worker is a waitress server, with a pool of threads and persistent HTTP/1.1 connections.
+    '''
+    if waitress is None:
+        raise RuntimeError("Please install waitress to serve with several workers")
+    server = _bind(host, port)
+    if before_fork:
+        before_fork()
+    gc.collect()
+    if hasattr(gc, 'freeze'):  # leave loaded objects in pages shared with workers
+        gc.freeze()
+    logger.info(f"serving on {host}:{server.getsockname()[1]} with {workers} workers of {threads} threads")
+
+    def spawn():
+        return _spawn(app, server, threads=threads, keep_alive=keep_alive, after_fork=after_fork)
+
+    _supervise({spawn() for _ in range(workers)}, spawn)
+    server.close()
+
+
+def _supervise(children, spawn):
+    ''' Wait for workers, and replace those that stop unexpectedly, until this process is terminated '''
+    stopping = _stop_on_signals(children)
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"worker {pid} has stopped, starting another one")
+            children.add(spawn())
+
+
+def _stop_on_signals(children):
+    ''' Terminate workers along with this process, and list signals received '''
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    return stopping
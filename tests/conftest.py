@@ -4,6 +4,10 @@ import pytest
 from customization import c11n
 c11n.state_file = 'fixtures/test_state.yaml'
 
+from passwords import Pbkdf2Hasher, ScryptHasher
+Pbkdf2Hasher.iterations = 1000  # fast password hashing, except in benchmarks
+ScryptHasher.n = 2 ** 4
+
 
 def pytest_addoption(parser):
     parser.addoption(
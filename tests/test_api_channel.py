@@ -1,12 +1,18 @@
 import datetime
+import io
 from flask import Flask
 import json
 import jwt
 from pytest import fixture, mark, raises as py_raises
-from urllib.parse import unquote
+from threading import BoundedSemaphore
+from urllib.parse import parse_qs, unquote, urlparse
 import werkzeug
 
 from api_channel import Channel
+from commands import Commands
+from feeds import Feed
+from payload import get_size
+from records import Records
 
 
 @fixture
@@ -100,15 +106,89 @@ def test_record_maximum_size(_api):
 
     _api.record_maximum_size = 26
 
-    with py_raises(werkzeug.exceptions.BadRequest):
+    with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
         _api.post(payload={'title': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'},
                   persona='leader')
 
-    with py_raises(werkzeug.exceptions.BadRequest):
+    with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
         _api.put(id='fat',
                  payload={'title': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'},
                  persona='leader')
 
+    _api.record_maximum_size = 200
+    _api.store.write(id='growing', title='small')
+    with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
+        for n in range(20):  # each patch is small, but the record grows
+            _api.patch(id='growing', payload={f"extra{n}": 'x' * 20}, persona='leader')
+    assert get_size(_api.store.read('growing')) <= 200
+
+
+class UnreadableStream(io.BytesIO):
+    def read(self, *args, **kwargs):
+        raise AssertionError("Body should not be read")
+
+
+def test_request_size_is_checked_before_reading():
+    app = Flask(__name__)
+    channel = Channel()
+    channel.record_maximum_size = 100
+
+    environ = {'CONTENT_LENGTH': '50000000', 'wsgi.input': UnreadableStream()}
+    with app.app_context(), app.test_request_context('/', method='POST', environ_overrides=environ):
+        with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
+            channel.post(persona='leader')
+        with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
+            channel.put(id='fat', persona='leader')
+
+    body = json.dumps(dict(title='x' * 200)).encode()
+    environ = {'wsgi.input': io.BytesIO(body), 'wsgi.input_terminated': True}  # no content length
+    with app.app_context(), app.test_request_context('/', method='POST', environ_overrides=environ):
+        with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
+            channel.post(persona='leader')
+
+    with app.app_context(), app.test_request_context('/', method='POST', data='not JSON'):
+        with py_raises(werkzeug.exceptions.BadRequest):
+            channel.post(persona='leader')
+
+    with app.app_context(), app.test_request_context('/', method='POST', json=dict(title='hello')):
+        response = channel.post(persona='leader')
+        assert response[1] == 201
+
+
+def test_patch(_api):
+
+    journal = io.StringIO()
+    _api.emitter = Commands(stream=journal).emit
+    _api.post(payload=dict(id='id-1', title='hello', content='x' * 1000, version='alpha'), persona='leader')
+
+    response = _api.patch(id='id-1', payload=dict(title='world', content=None), persona='leader')
+    assert response == ('', 204)
+    record = _api.store.read('id-1')
+    assert record['title'] == 'world'
+    assert 'content' not in record
+    assert record['version'] == 'alpha'
+    assert 'world' in journal.getvalue().split('---')[-1]
+    assert 'x' * 1000 not in journal.getvalue().split('---')[-1]  # only the patch is recorded
+
+    with py_raises(werkzeug.exceptions.Conflict):
+        _api.patch(id='id-1', payload=dict(title='again', version='gamma', previous_version='beta'), persona='leader')
+
+    response = _api.patch(id='id-1', payload=dict(title='again', version='beta', previous_version='alpha'),
+                          persona='leader')
+    assert response == ('', 204)
+    assert _api.store.read('id-1')['version'] == 'beta'
+
+    with py_raises(werkzeug.exceptions.NotFound):
+        _api.patch(id='*unknown*', payload=dict(title='hello'), persona='leader')
+
+    with py_raises(werkzeug.exceptions.Forbidden):
+        _api.patch(id='id-1', payload=dict(title='hello'), persona='member')
+
+    replica = Channel()
+    Commands(stream=io.StringIO(journal.getvalue())).parse(dispatchers=[replica.replay])
+    assert replica.store.read('id-1')['title'] == 'again'
+    assert replica.store.read('id-1')['version'] == 'beta'
+
 
 def test_index(_api):
 
@@ -150,9 +230,340 @@ def test_page(_api):
     with py_raises(werkzeug.exceptions.NotFound):
         _api.page(token='EOF')
 
-    response = _api.page(token=_api.store._encode_token(-235))
+    response = _api.page(token=_api.store._encode_token('9999999999', 'id-0'))
     chunk = json.loads(response.data.decode())
     print(chunk)
     assert len(chunk['items']) == _api.page_size
     token = unquote(chunk['next'])
     assert token != 'EOF'
+
+    with py_raises(werkzeug.exceptions.NotFound):
+        _api.page(token='azerty')
+
+
+def test_between(_api):
+
+    for n in range(5):
+        _api.store.write(id=f"id-{n + 1}", content=f"hello {n + 1}")
+    stamps = [_api.store.read(id=f"id-{n + 1}")['stamp'] for n in range(5)]
+
+    response = _api.between(start=stamps[3])
+    chunk = json.loads(response.data.decode())
+    assert [x['id'] for x in chunk['items']] == ['id-5', 'id-4']
+
+    response = _api.between(start=stamps[1], stop=stamps[2])
+    chunk = json.loads(response.data.decode())
+    assert [x['id'] for x in chunk['items']] == ['id-3', 'id-2']
+
+    _api.window_maximum_count = 1
+    response = _api.between(start=stamps[0])
+    chunk = json.loads(response.data.decode())
+    assert [x['id'] for x in chunk['items']] == ['id-5']
+
+    with py_raises(werkzeug.exceptions.BadRequest):
+        _api.between(start='yesterday')
+
+    with py_raises(werkzeug.exceptions.Forbidden):
+        Channel(name='board').between(start=stamps[0], persona='anonymous')
+
+
+def test_page_with_filter():
+    app = Flask(__name__)
+    channel = Channel(store=Records(indexed_fields=['board']))
+    channel.register_routes(app)
+    channel.page_size = 3
+    for n in range(10):
+        channel.store.write(id=f"id-{n + 1}", board=f"board-{n % 2}")
+
+    with app.app_context(), app.test_request_context('/?board=board-1'):
+        response = channel.index()
+        chunk = json.loads(response.data.decode())
+        assert [x['id'] for x in chunk['items']] == ['id-10', 'id-8', 'id-6']
+        assert chunk['next'].endswith('?board=board-1')
+        token = unquote(chunk['next'])[len('/page/'):].split('?')[0]
+
+        response = channel.page(token=token)
+        chunk = json.loads(response.data.decode())
+        assert [x['id'] for x in chunk['items']] == ['id-4', 'id-2']
+        assert chunk['next'] == 'EOF'
+
+    with app.app_context(), app.test_request_context('/?author=Alice&_=123'):  # not indexed, and ignored
+        response = channel.index()
+        assert len(json.loads(response.data.decode())['items']) == 3
+
+    channel.store.indexed_fields.append('author')
+    with app.app_context(), app.test_request_context('/?author=Alice&board=board-1'):
+        with py_raises(werkzeug.exceptions.BadRequest):
+            channel.index()
+
+
+def test_sparse_fieldsets():
+    app = Flask(__name__)
+    channel = Channel(store=Records(indexed_fields=['board']))
+    channel.register_routes(app)
+    channel.page_size = 3
+    for n in range(5):
+        channel.store.write(id=f"id-{n + 1}", board='board-1', title=f"title {n + 1}", content='x' * 1000)
+
+    with app.app_context(), app.test_request_context('/?fields=id,title,stamp&board=board-1'):
+        response = channel.index()
+        chunk = json.loads(response.data.decode())
+        assert [sorted(x.keys()) for x in chunk['items']] == [['id', 'stamp', 'title']] * 3
+        query = parse_qs(urlparse(chunk['next']).query)
+        assert query['fields'] == ['id,title,stamp']
+        assert query['board'] == ['board-1']
+
+    with app.app_context(), app.test_request_context('/id-1?fields=title,unknown'):
+        response = channel.get(id='id-1')
+        assert json.loads(response.data.decode())['item'] == dict(title='title 1')
+
+    with app.app_context(), app.test_request_context('/id-1'):
+        response = channel.get(id='id-1')
+        assert len(json.loads(response.data.decode())['item']['content']) == 1000
+
+
+def test_search():
+    app = Flask(__name__)
+    channel = Channel(name='board')
+    channel.register_routes(app)
+    channel.store.write(id='id-1', title='Concert Brahms', content='Brahms again')
+    channel.store.write(id='id-2', title='Concert Mozart')
+
+    with app.app_context(), app.test_request_context('/board/search?q=brahms'):
+        response = channel.search(persona='leader')
+        chunk = json.loads(response.data.decode())
+        assert [x['id'] for x in chunk['items']] == ['id-1']
+
+        with py_raises(werkzeug.exceptions.Forbidden):
+            channel.search(persona='member')
+
+    with app.app_context(), app.test_request_context('/board/search?q=concert'):
+        response = channel.search(persona='leader')
+        chunk = json.loads(response.data.decode())
+        assert len(chunk['items']) == 2
+
+    with app.app_context(), app.test_request_context('/board/search'):
+        with py_raises(werkzeug.exceptions.BadRequest):
+            channel.search(persona='leader')
+
+
+def test_export():
+    app = Flask(__name__)
+    channel = Channel(name='board')
+    channel.register_routes(app)
+    channel.export_chunk_size = 7
+    for n in range(25):
+        channel.store.write(id=f"id-{n + 1}", title=f"hello {n + 1}")
+
+    with app.app_context(), app.test_request_context('/board/export'):
+        response = channel.export(persona='leader')
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.is_streamed
+        chunks = iter(response.response)
+        lines = next(chunks).splitlines()
+        assert len(lines) == 7
+        channel.store.write(id='id-26', title='hello 26')  # not in the export
+        channel.store.delete(id='id-25')  # still in the export
+        for chunk in chunks:
+            lines += chunk.splitlines()
+        records = [json.loads(x) for x in lines]
+        assert sorted(x['id'] for x in records) == sorted(f"id-{n + 1}" for n in range(25))
+
+        with py_raises(werkzeug.exceptions.Forbidden):
+            channel.export(persona='member')
+
+
+def test_events():
+    app = Flask(__name__)
+    channel = Channel(name='board')
+    channel.register_routes(app)
+    channel.events_heartbeat = 0.01
+
+    with app.app_context(), app.test_request_context('/board/events'):
+        response = channel.events(persona='leader')
+        assert response.mimetype == 'text/event-stream'
+        stream = iter(response.response)
+        assert next(stream) == ': keep-alive\n\n'
+
+        channel.post(payload=dict(id='id-1', title='hello'), persona='leader')
+        channel.put(id='id-1', payload=dict(title='world'), persona='leader')
+        channel.delete(id='id-1', persona='leader')
+        chunk = next(stream)
+        events = [x.split('\n') for x in chunk.strip().split('\n\n')]
+        assert [x[1] for x in events] == ['event: post', 'event: put', 'event: delete']
+        assert json.loads(events[1][2][len('data: '):])['title'] == 'world'
+        last_event_id = events[0][0][len('id: '):]
+        response.close()
+        assert len(channel.feed.subscribers) == 0
+
+    with app.app_context(), app.test_request_context('/board/events', headers={'Last-Event-ID': last_event_id}):
+        response = channel.events(persona='leader')
+        chunk = next(iter(response.response))
+        assert chunk.count('event: ') == 2
+        response.close()
+
+    with app.app_context(), app.test_request_context('/board/events', headers={'Last-Event-ID': 'unknown-1'}):
+        response = channel.events(persona='leader')
+        assert next(iter(response.response)).startswith('event: reset')
+        response.close()
+
+    with app.app_context(), app.test_request_context('/board/events'):
+        with py_raises(werkzeug.exceptions.Forbidden):
+            channel.events(persona='member')
+
+
+def test_events_are_capped():
+    app = Flask(__name__)
+    channel = Channel(name='board', feed=Feed(slots=BoundedSemaphore(1)))
+    channel.register_routes(app)
+    channel.events_heartbeat = 0.01
+
+    with app.app_context(), app.test_request_context('/board/events'):
+        response = channel.events(persona='leader')
+        next(iter(response.response))
+        with py_raises(werkzeug.exceptions.ServiceUnavailable):
+            channel.events(persona='leader')
+        response.close()
+        next(iter(channel.events(persona='leader').response))
+
+
+def test_batch(_api):
+
+    journal = io.StringIO()
+    _api.emitter = Commands(stream=journal).emit
+    _api.record_maximum_size = 300
+
+    records = [dict(id='id-1', title='one'),
+               dict(title='two', bearer='*secret*'),
+               'not a record',
+               {f"key-{n}": n for n in range(50)}]
+    response = _api.batch(payload=records, persona='leader')
+    results = json.loads(response.data.decode())['items']
+    assert [x['status'] for x in results] == [201, 201, 400, 400]
+    assert results[0] == dict(id='id-1', status=201, location='/id-1')
+    assert _api.store.read(id=results[1]['id'])['title'] == 'two'
+    assert 'bearer' not in _api.store.read(id=results[1]['id'])
+    assert _api.store.count() == 2
+    assert journal.getvalue().count('---') == 1  # a single command for the batch
+
+    replica = Channel()
+    Commands(stream=journal).parse(dispatchers=[replica.replay])
+    assert sorted(replica.store.records.ids()) == sorted(_api.store.records.ids())
+
+    with py_raises(werkzeug.exceptions.Forbidden):
+        _api.batch(payload=records, persona='member')
+
+    with py_raises(werkzeug.exceptions.BadRequest):
+        _api.batch(payload=dict(id='id-1'), persona='leader')
+
+    _api.batch_maximum_count = 2
+    with py_raises(werkzeug.exceptions.BadRequest):
+        _api.batch(payload=[{}, {}, {}], persona='leader')
+
+
+@mark.slow
+def test_batch_throughput(tmpdir):
+    from time import perf_counter
+
+    def as_leader(wrapped):
+        def wrapper(**kwargs):
+            return wrapped(persona='leader', **kwargs)
+        return wrapper
+
+    app = Flask(__name__)
+    channel = Channel()
+    channel.register_routes(app, wrapper=as_leader)
+    channel.emitter = Commands(path=str(tmpdir.join('commands.yaml'))).emit
+    count = 2000
+
+    with app.test_client() as client:
+        start = perf_counter()
+        for n in range(count):
+            response = client.post('/', json=dict(title=f"item {n}"))
+            assert response.status_code == 201
+        posts = count / (perf_counter() - start)
+
+        start = perf_counter()
+        for n in range(0, count, 100):
+            response = client.post('/batch', json=[dict(title=f"item {x}") for x in range(n, n + 100)])
+            assert response.status_code == 200
+        batches = count / (perf_counter() - start)
+
+    print(f"{posts:.0f} records/s one by one, {batches:.0f} records/s in batches of 100")
+
+
+def test_multiget():
+    app = Flask(__name__)
+    channel = Channel()
+    channel.register_routes(app)
+    for n in range(5):
+        channel.store.write(id=f"id-{n + 1}", content=f"hello {n + 1}")
+
+    with app.app_context(), app.test_request_context('/?ids=id-3,id-9,id-1,id-3'):
+        response = channel.index()
+        chunk = json.loads(response.data.decode())
+        assert [x['id'] for x in chunk['items']] == ['id-3', 'id-1']
+        assert chunk['missing'] == ['id-9']
+
+    with app.app_context(), app.test_request_context('/ids', method='POST', json=dict(ids=['id-2', 'id-4'])):
+        response = channel.multiget()
+        chunk = json.loads(response.data.decode())
+        assert [x['id'] for x in chunk['items']] == ['id-2', 'id-4']
+        assert chunk['missing'] == []
+
+    with app.app_context(), app.test_request_context('/ids', method='POST', json=dict(ids='id-2')):
+        with py_raises(werkzeug.exceptions.BadRequest):
+            channel.multiget()
+
+    channel.multiget_maximum_count = 2
+    with app.app_context(), app.test_request_context('/ids', method='POST', json=['id-1', 'id-2', 'id-3']):
+        with py_raises(werkzeug.exceptions.BadRequest):
+            channel.multiget()
+
+    with app.app_context(), app.test_request_context('/?ids=id-1'):
+        with py_raises(werkzeug.exceptions.Forbidden):
+            Channel(name='board').index(persona='anonymous')
+
+    checks = []
+    authorize = channel.permissions.authorize
+    channel.permissions.authorize = lambda **kwargs: checks.append(kwargs) or authorize(**kwargs)
+    with app.app_context(), app.test_request_context('/?ids=id-1'):
+        channel.index()
+    assert len(checks) == 1
+
+
+def test_conditional_get():
+    app = Flask(__name__)
+    channel = Channel()
+    channel.register_routes(app)
+    channel.store.write(id='id-1', content='hello')
+
+    with app.app_context(), app.test_request_context('/id-1'):
+        response = channel.get(id='id-1')
+        assert response.status_code == 200
+        etag, _ = response.get_etag()
+        assert etag == channel.store.read(id='id-1')['stamp']
+
+        response = channel.index()
+        page_etag, _ = response.get_etag()
+
+    with app.app_context(), app.test_request_context('/id-1', headers={'If-None-Match': f'"{etag}"'}):
+        response = channel.get(id='id-1')
+        assert response.status_code == 304
+        assert response.get_data() == b''
+
+    with app.app_context(), app.test_request_context('/', headers={'If-None-Match': f'"{page_etag}"'}):
+        response = channel.index()
+        assert response.status_code == 304
+
+    channel.store.write(id='id-1', content='updated')
+
+    with app.app_context(), app.test_request_context('/id-1', headers={'If-None-Match': f'"{etag}"'}):
+        response = channel.get(id='id-1')
+        assert response.status_code == 200
+        assert response.get_etag()[0] != etag
+
+    with app.app_context(), app.test_request_context('/', headers={'If-None-Match': f'"{page_etag}"'}):
+        response = channel.index()
+        assert response.status_code == 200
+        assert response.get_etag()[0] != page_etag
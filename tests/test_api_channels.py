@@ -0,0 +1,128 @@
+from flask import Flask
+import io
+import json
+from pytest import mark, raises as py_raises
+
+from api_channel import Channel
+from api_channels import Channels
+from api_maintenance import Maintenance
+from commands import Commands
+from users import Users
+
+
+pytestmark = mark.api
+
+
+def as_leader(wrapped):
+    def wrapper(**kwargs):
+        return wrapped(persona='leader', **kwargs)
+    return wrapper
+
+
+def _get_app(names):
+    created = []
+
+    def factory(name):
+        created.append(name)
+        return Channel(name=name)
+
+    app = Flask(__name__)
+    channels = Channels(names=names, factory=factory)
+    channels.register_routes(app, wrapper=as_leader)
+    return app, channels, created
+
+
+def test_channels_are_created_lazily():
+    app, channels, created = _get_app(['universe', 'board', 'item'])
+    assert created == ['universe']
+    assert sorted(channels.keys()) == ['board', 'item', 'universe']
+    assert 'board' in channels
+    assert 'alien' not in channels
+    assert channels['board'] is channels['board']
+    assert created == ['universe', 'board']
+    with py_raises(KeyError):
+        channels['alien']
+
+
+def test_routing():
+    app, channels, created = _get_app(['universe', 'board'])
+    with app.test_client() as client:
+        response = client.post('/board/', json=dict(id='id-1', title='on board'))
+        assert response.status_code == 201
+        assert response.headers['Location'].endswith('/board/id-1')
+        assert channels['board'].store.read('id-1')['title'] == 'on board'
+
+        response = client.get('/board/id-1')
+        assert json.loads(response.data)['item']['title'] == 'on board'
+
+        response = client.get('/board?fields=title')
+        assert response.status_code == 308
+        assert response.headers['Location'].endswith('/board/?fields=title')
+        assert client.get('/alien/').status_code == 404
+        assert client.get('/universe/').status_code == 404
+
+        client.post('/', json=dict(id='alien', title='in universe'))
+        response = client.get('/alien')
+        assert json.loads(response.data)['item']['title'] == 'in universe'
+
+        channels['board'].page_size = 1
+        client.post('/board/', json=dict(id='id-2', title='on board'))
+        response = client.get('/board/')
+        assert json.loads(response.data)['next'].startswith('/board/page/')
+
+
+def test_add_at_runtime():
+    app, channels, created = _get_app(['universe'])
+    with app.test_client() as client:
+        assert client.get('/community/').status_code == 404
+        channels.add('community')
+        assert client.get('/community/').status_code == 200
+        assert created == ['universe', 'community']
+
+    with py_raises(ValueError):
+        channels.add('a/b')
+
+
+def test_emitter_and_replay():
+    journal = io.StringIO()
+    app, channels, created = _get_app(['universe', 'board', 'item'])
+    channels['board']
+    channels.emitter = Commands(stream=journal).emit
+    channels['board'].post(payload=dict(id='id-1', title='hello'), persona='leader')
+    channels['item'].post(payload=dict(id='id-2', title='world'), persona='leader')
+
+    replica = Channels(names=['universe', 'board', 'item'])
+    Commands(stream=journal).parse(dispatchers=[replica.replay])
+    assert replica['board'].store.read('id-1')['title'] == 'hello'
+    assert replica['item'].store.read('id-2')['title'] == 'world'
+
+
+def test_import_loads_only_channels_of_snapshot():
+    app, channels, created = _get_app(['universe', 'board', 'item'])
+    maintenance = Maintenance(channels=channels, users=Users())
+    maintenance.import_content("channels:\n  board:\n  - id: id-1\n    title: hello\n")
+    assert created == ['universe', 'board']
+    assert channels['board'].store.read('id-1')['title'] == 'hello'
+
+    maintenance.import_content("channels:\n  item:\n  - id: id-2\n")
+    assert created == ['universe', 'board', 'item']
+    assert channels['board'].store.read('id-1') is None  # emptied, as at restore
+    assert channels['universe'].store.read('id-2') is None
+
+
+@mark.slow
+def test_startup_and_routing_speed():
+    from time import perf_counter
+
+    for count in (4, 400):
+        start = perf_counter()
+        app, channels, created = _get_app(['universe'] + [f"board-{n}" for n in range(count)])
+        startup = perf_counter() - start
+
+        adapter = app.url_map.bind('localhost')
+        start = perf_counter()
+        for n in range(1000):
+            adapter.match(f"/board-{n % count}/page/abcdef")
+        routing = (perf_counter() - start) / 1000
+        print(f"{count} channels: {len(app.url_map._rules)} rules, "
+              f"started in {startup * 1000:.1f} ms, {routing * 1e6:.1f} µs per match")
@@ -1,5 +1,6 @@
 import datetime
-from flask import Flask
+from flask import Flask, jsonify
+import gzip
 import json
 import jwt
 from pytest import fixture, mark, raises as py_raises
@@ -78,3 +79,88 @@ def test_http_error(_api):
     assert item['code'] == 500
     assert item['name'] == 'Some Error'
     assert item['description'] == 'some fault'
+
+
+def _get_app(body, **kwargs):
+    app = Flask('for_test')
+    handlers = Handlers(**kwargs)
+    handlers.register_handlers(app)
+
+    @app.route('/')
+    def index():
+        response = jsonify(body)
+        response.set_etag('some-etag')
+        return response
+
+    @app.route('/image')
+    def image():
+        return app.response_class(b'x' * 5000, mimetype='image/png')
+
+    return app
+
+
+def test_compression():
+    body = dict(items=[dict(id=f"id-{n}", title=f"hello world {n}") for n in range(200)])
+    app = _get_app(body)
+    with app.test_client() as client:
+        response = client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert response.headers['ETag'] == 'W/"some-etag"'
+        data = gzip.decompress(response.data)
+        assert int(response.headers['Content-Length']) < len(data) / 4
+        assert json.loads(data) == body
+
+        response = client.get('/', headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.data) == body
+
+        response = client.get('/')
+        assert 'Content-Encoding' not in response.headers
+
+        response = client.get('/image', headers={'Accept-Encoding': 'gzip'})  # already compressed
+        assert 'Content-Encoding' not in response.headers
+        assert len(response.data) == 5000
+
+
+def test_compression_of_small_responses():
+    app = _get_app(dict(id='id-1'))
+    with app.test_client() as client:
+        response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.headers['ETag'] == '"some-etag"'
+
+    body = dict(items=[dict(id=f"id-{n}") for n in range(200)])
+    app = _get_app(body, compression_level=0)
+    with app.test_client() as client:
+        response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
+
+@mark.slow
+def test_compression_ratio_and_cost():
+    from base64 import b64encode
+    from time import perf_counter
+    import zlib
+
+    from uuid import uuid4
+
+    def item(n):
+        return dict(id=uuid4().hex,
+                    stamp=f"{1600000000 + n * 37.1:.6f}",
+                    version=uuid4().hex[:8],
+                    author=f"user-{n % 7}",
+                    board=f"board-{n % 3}",
+                    title=f"Some title for item {n}",
+                    description=f"<p>Some longer description of item {n}, with a bit of <b>markup</b> in it.</p>")
+
+    page = json.dumps(dict(items=[item(n) for n in range(10)], count=10, next='/page/' + uuid4().hex)).encode()
+    snapshot = json.dumps(dict(snapshot=b64encode(json.dumps([item(n) for n in range(2000)]).encode()).decode())).encode()
+    for label, data in [('page of 10 items', page), ('base64 snapshot', snapshot)]:
+        for level in (1, 6, 9):
+            start = perf_counter()
+            for _ in range(100):
+                compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+                compressed = compressor.compress(data) + compressor.flush()
+            cost = (perf_counter() - start) * 10
+            print(f"{label}: {len(data)} bytes, gzip level {level}: {len(compressed)} bytes in {cost:.3f} ms")
@@ -1,5 +1,5 @@
 import datetime
-from flask import Flask
+from flask import Flask, request
 import json
 import jwt
 from pytest import fixture, mark, raises as py_raises
@@ -7,6 +7,9 @@ from urllib.parse import unquote
 import werkzeug
 
 from api_identities import Identities
+import bearers
+from passwords import Passwords, ScryptHasher
+from users import Users
 
 
 @fixture
@@ -103,7 +106,10 @@ def test_record_life_cycle(_api):
     with py_raises(werkzeug.exceptions.Forbidden):  # put unknown persona
         _api.put(id=e_mail, payload=dict(persona='*alien*'), persona='leader')
 
-    response = _api.login(payload=dict(id=e_mail, password='P455w@rd', hash_password=False))
+    with py_raises(werkzeug.exceptions.Forbidden):  # the password has been hashed anyway
+        _api.login(payload=dict(id=e_mail, password='P455w@rd', hash_password=False))
+
+    response = _api.login(payload=dict(id=e_mail, password='P455w@rd'))
     assert response.status_code == 200
     payload = json.loads(response.get_data().decode())
     print(payload)
@@ -151,20 +157,49 @@ def test_record_life_cycle(_api):
         _api.get(id=e_mail_2, persona='member')
 
 
+def test_hashes_are_not_accepted_from_clients(_api):
+    _api.post(payload=dict(e_mail='marc@acme.com', persona='member', password='P455w@rd'), persona='support')
+    md5 = '5b49d1280e8517e54daeeb90034334ae'  # legacy hash of 'P455w@rd'
+    payload = dict(password=md5, signature_key=md5, record_has_been_loaded=True)
+    _api.put(id='marc@acme.com', payload=payload, identity='marc@acme.com', persona='member')
+    record = _api.store.read('marc@acme.com')
+    assert record['password'].startswith('scrypt$')
+    assert 'record_has_been_loaded' not in record
+
+    stamp = bearers.get_current_stamp()
+    signature = bearers.compute_signature(hash=md5, salt='salt', stamp=stamp)
+    with py_raises(werkzeug.exceptions.Forbidden):
+        _api.signin(payload=dict(id='marc@acme.com', signature=signature, salt='salt', stamp=stamp))
+    with py_raises(werkzeug.exceptions.Forbidden):  # compared with the stored hash
+        _api.login(payload=dict(id='marc@acme.com', password=md5, hash_password=False))
+    assert _api.login(payload=dict(id='marc@acme.com', password=md5)).status_code == 200
+
+
 def test_record_maximum_size(_api):
 
     _api.record_maximum_size = 26
 
-    with py_raises(werkzeug.exceptions.BadRequest):
+    with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
         _api.post(payload={'first_name': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'},
                   persona='leader')
 
-    with py_raises(werkzeug.exceptions.BadRequest):
+    with py_raises(werkzeug.exceptions.RequestEntityTooLarge):
         _api.put(id='fat',
                  payload={'first_name': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'},
                  persona='leader')
 
 
+def test_bearer_from_large_request(_api):
+    app = Flask(__name__)
+    with app.test_request_context('/', method='POST', json=dict(title='x' * 200000, bearer='*bearer*')):
+        assert _api.get_bearer_from_request() == '*bearer*'  # larger than identities, as channel records can be
+
+    _api.request_maximum_size = 1000
+    with app.test_request_context('/', method='POST', json=dict(title='x' * 2000, bearer='*bearer*')):
+        assert _api.get_bearer_from_request() == 'no-bearer'  # body is not read here
+        assert request.stream.read() != b''
+
+
 def test_index(_api):
 
     response = _api.index(persona='member')
@@ -183,6 +218,23 @@ def test_index(_api):
     token = unquote(chunk['next'])
     assert token != 'EOF'
 
+def test_sparse_fieldsets(_api):
+    app = Flask(__name__)
+    app.add_url_rule('/users/page/<token>', 'users:page', _api.page)
+    _api.page_size = 2
+    for n in range(3):
+        _api.store.write(e_mail=f"toto+{n + 1}@alfa.com", persona='member', password='P455w@rd', first_name='Toto')
+
+    with app.test_request_context('/users?fields=id,persona,password'):
+        response = _api.index(persona='member')
+        chunk = json.loads(response.data.decode())
+        assert [sorted(x.keys()) for x in chunk['users']] == [['id', 'persona']] * 2  # never secrets
+        assert 'fields=' in chunk['next']
+
+        response = _api.get(id='toto+1@alfa.com', identity='toto+1@alfa.com', persona='member')
+        assert json.loads(response.data.decode())['user'] == dict(id='toto+1@alfa.com', persona='member')
+
+
 def test_page(_api):
 
     pages = 4
@@ -197,36 +249,142 @@ def test_page(_api):
         _api.store.write(e_mail=f"robot+{n + 1}@alfa.com", persona='robot', password='P455w@rd')
         _api.store.write(e_mail=f"audit+{n + 1}@alfa.com", persona='audit', password='P455w@rd')
 
-    response = _api.page(token=None, persona='member')
-    users = json.loads(response.data.decode())['users']
-    assert len(users) == 15  # 30 - 5 registered - 5 robot
-    response = _api.page(token=None, persona='leader')
-    users = json.loads(response.data.decode())['users']
-    assert len(users) == 25  # 30 - 5 robot
-    response = _api.page(token=None, persona='support')
-    users = json.loads(response.data.decode())['users']
-    assert len(users) == _api.page_size
-    response = _api.page(token=None, persona='audit')
-    users = json.loads(response.data.decode())['users']
-    assert len(users) == 25  # 30 - 5 robot
-
-    pages = 5  # because we added multiple records in previous loop
+    for persona, personas in [('member', {'member', 'leader', 'audit'}),
+                              ('leader', {'registered', 'member', 'leader', 'support', 'audit'}),
+                              ('support', {'registered', 'member', 'leader', 'support', 'robot', 'audit'}),
+                              ('audit', {'registered', 'member', 'leader', 'support', 'audit'})]:
+        response = _api.page(token=None, persona=persona)
+        users = json.loads(response.data.decode())['users']
+        assert len(users) == _api.page_size  # full pages of visible identities
+        assert {x['persona'] for x in users} == personas
+
+    pages = 3  # 22 x 3 visible identities, in pages of 30
     token = None
+    seen = []
     while token != 'EOF':
         response = _api.page(token=token, persona='member')
         chunk = json.loads(response.data.decode())
+        seen += [x['id'] for x in chunk['users']]
         token = unquote(chunk['next'])
         if token.startswith('/users/page/'):
             token = token[len('/users/page/'):]
         pages -= 1
     assert pages == 0
+    assert len(seen) == len(set(seen)) == 66
+    assert seen == [x for x in _api.store.records.ids_by('stamp') if x.split('+')[0] in ('member', 'leader', 'audit')]
 
     with py_raises(werkzeug.exceptions.NotFound) as error:
         _api.page(token='EOF', persona='member')
 
-    response = _api.page(token=_api.store._encode_token(-235), persona='support')
+    response = _api.page(token=_api.store._encode_token('9999999999', 'id-0'), persona='support')
     chunk = json.loads(response.data.decode())
     print(chunk)
     assert len(chunk['users']) == _api.page_size
     token = unquote(chunk['next'])
     assert token != 'EOF'
+
+
+def test_conditional_get():
+    app = Flask(__name__)
+    identities = Identities()
+    identities.register_routes(app)
+    identities.store.write(e_mail='marc@acme.com', password='P455w@rd', persona='member')
+
+    with app.app_context(), app.test_request_context('/users/marc@acme.com'):
+        response = identities.get(id='marc@acme.com', persona='leader')
+        assert response.status_code == 200
+        etag, _ = response.get_etag()
+
+    with app.app_context(), app.test_request_context('/users/marc@acme.com', headers={'If-None-Match': f'"{etag}"'}):
+        response = identities.get(id='marc@acme.com', persona='leader')
+        assert response.status_code == 304
+
+        with py_raises(werkzeug.exceptions.Forbidden):
+            identities.get(id='marc@acme.com', persona='registered')
+
+    identities.store.write(id='marc@acme.com', first_name='Marc')
+
+    with app.app_context(), app.test_request_context('/users/marc@acme.com', headers={'If-None-Match': f'"{etag}"'}):
+        response = identities.get(id='marc@acme.com', persona='leader')
+        assert response.status_code == 200
+
+
+def test_login_when_busy(_api):
+    _api.store.write(e_mail='marc@acme.com', password='P455w@rd', persona='member')
+    response = _api.login(payload=dict(id='marc@acme.com', password='P455w@rd'))
+    assert response.status_code == 200
+
+    _api.store.passwords = Passwords(workers=1, queue_size=0)
+    _api.store.passwords.slots.acquire()  # some other login is running
+    with py_raises(werkzeug.exceptions.TooManyRequests):
+        _api.login(payload=dict(id='marc@acme.com', password='P455w@rd'))
+
+
+def _login_repeatedly(app, results, count=10):
+    from time import sleep
+
+    with app.test_client() as client:
+        for _ in range(count):
+            response = client.post('/login', json=dict(id='marc@acme.com', password='P455w@rd'))
+            results.append(response.status_code)
+            if response.status_code == 429:
+                sleep(0.05)  # as advised to clients
+
+
+def _measure_other_requests(app, threads):
+    from time import perf_counter, sleep
+
+    latencies = []
+    with app.test_client() as client:
+        while any(thread.is_alive() for thread in threads):
+            tick = perf_counter()
+            assert client.get('/users', headers={'X-Bearer': 'no-bearer'}).status_code in (200, 403)
+            latencies.append(perf_counter() - tick)
+            sleep(0.01)
+    return sorted(latencies)
+
+
+@mark.slow
+def test_login_storm():
+    from threading import Thread
+    from time import perf_counter
+
+    for label, passwords in [('inline', Passwords(hasher=ScryptHasher(cost=2 ** 14), workers=32, queue_size=1000)),
+                             ('bounded pool', Passwords(hasher=ScryptHasher(cost=2 ** 14), workers=2, queue_size=8))]:
+        app = Flask(__name__)
+        identities = Identities(store=Users(passwords=passwords))
+        identities.register_routes(app)
+        identities.store.write(e_mail='marc@acme.com', password='P455w@rd', persona='member')
+        results = []
+
+        threads = [Thread(target=_login_repeatedly, args=(app, results)) for _ in range(16)]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        latencies = _measure_other_requests(app, threads)
+        duration = perf_counter() - start
+        for thread in threads:
+            thread.join()
+        print(f"{label}: {results.count(200) / duration:.1f} logins/s, {results.count(429)} answered 429, "
+              f"other requests in {latencies[len(latencies) // 2] * 1000:.1f} ms (median), "
+              f"{latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms (p99)")
+
+
+@mark.slow
+def test_authentication_speed():
+    from time import perf_counter
+
+    app = Flask(__name__)
+    identities = Identities()
+    bearer = bearers.encode_bearer(secret=identities.store.bearer_secret, identity='Alice', persona='member')
+    view = identities.inject_identity(lambda identity, persona: (identity, persona))
+    for label, size in [('without cache', 0), ('with cache', 10000)]:
+        identities.store.bearer_cache_size = size
+        identities.store.set_bearer_secret(identities.store.bearer_secret)
+        with app.test_request_context(headers={'X-Bearer': bearer}):
+            assert view() == ('Alice', 'member')
+            start = perf_counter()
+            for _ in range(5000):
+                view()
+            cost = (perf_counter() - start) / 5000 * 1e6
+        print(f"{label}: request authenticated in {cost:.1f} µs")
@@ -1,4 +1,5 @@
 from flask import Flask
+import hashlib
 import json
 import jwt
 from pytest import fixture, mark, raises as py_raises
@@ -34,7 +35,11 @@ def _api():
 
 @given("a user record has identity <identity> and password <password> and persona <persona>")
 def add_user_record(_context, _api, identity, password, persona):
-    identities.store.write(id=identity, password=password, persona=persona, e_mail='a@b.c')
+    identities.store.write(id=identity,
+                           password=hashlib.md5(password.encode('utf-8')).hexdigest(),  # legacy hash, for signatures
+                           record_has_been_loaded=True,
+                           persona=persona,
+                           e_mail='a@b.c')
 
 
 @when("the user authenticates successfully with identity <label> and password <secret>")
@@ -47,6 +47,49 @@ def test_encode_bearer():
     assert decoded.is_renewable == True
 
 
+def test_encode_compact_bearer():
+    secret = 'secret'
+
+    encoded = bearers.encode_compact_bearer(secret, identity='1234', persona='persona', validity=5)
+    legacy = bearers.encode_bearer(secret, identity='1234', persona='persona', e_mail='alice@acme.com')
+    assert len(encoded) < len(legacy)
+
+    decoded = bearers.decode_bearer(secret=secret, bearer=encoded)
+    assert decoded.identity == '1234'
+    assert decoded.persona == 'persona'
+    assert decoded.exp - decoded.iat == 5 * 60
+    assert decoded.is_valid is True
+    assert decoded.is_renewable is True
+
+    with py_raises(jwt.exceptions.DecodeError):
+        bearers.decode_bearer(secret='another', bearer=encoded)
+
+
+def test_decode_compact_bearer():
+    secret = 'secret'
+    now = datetime.datetime.utcnow().timestamp()
+
+    expired = bearers.encode_compact_bearer(secret, identity='1234', persona='persona', issued=now - 15 * 60, validity=5)
+    decoded = bearers.decode_bearer(secret=secret, bearer=expired, renewal=720)
+    assert decoded.is_valid is False
+    assert decoded.is_renewable is True
+    assert bearers.decode_bearer(secret=secret, bearer=expired, renewal=10).is_renewable is False
+
+    futuristic = bearers.encode_compact_bearer(secret, identity='1234', persona='persona', issued=now + 15 * 60)
+    decoded = bearers.decode_bearer(secret=secret, bearer=futuristic)
+    assert decoded.is_valid is False
+    assert decoded.is_renewable is False
+
+    legacy = bearers.encode_bearer(secret, identity='1234', persona='persona')
+    assert bearers.decode_bearer(secret=secret, bearer=legacy).identity == '1234'
+    with py_raises(jwt.exceptions.DecodeError):
+        bearers.decode_bearer(secret=secret, bearer=legacy, legacy=False)
+
+    bearer = jwt.encode(dict(identity='1234', persona='persona', iat='now', exp='later'), secret, algorithm='HS256').decode()
+    with py_raises(ValueError):
+        bearers.decode_bearer(secret=secret, bearer=bearer)
+
+
 def test_decode_bearer():
     secret = 'secret'
 
@@ -0,0 +1,80 @@
+import datetime
+from flask import Flask, jsonify
+import json
+from pytest import mark
+
+from codec import fast_dumps, orjson, register_codec
+from store import freeze
+
+
+pytestmark = mark.api
+
+needs_orjson = mark.skipif(orjson is None, reason="orjson is not installed")
+
+
+def _get_records(count=10):
+    return [freeze(dict(id=f"id-{n}",
+                        stamp=f"{1600000000 + n}.123456",
+                        title=f"Some title with \"quotes\", \\backslashes\\ and\ttabs {n}",
+                        tags=['a', 'b', n, n * 1.5, True, None],
+                        nested=dict(z=1, a=[dict(y=2, b=3)])))
+            for n in range(count)]
+
+
+@needs_orjson
+def test_fast_dumps():
+    records = _get_records()
+    assert fast_dumps(records) == json.dumps(records, separators=(',', ':'), sort_keys=True)
+
+    for value in [0.1, 0.0001, 123456789.123, -0.0, 2 ** 63 - 1, 'control \x00\x1f', [None, 'null']]:
+        assert fast_dumps(value) == json.dumps(value, separators=(',', ':'), sort_keys=True)
+
+    for value in ['café', 'del \x7f', 1e-5, 1.5e-7, 1e16, [1.5e300], dict(a=-1e22), 2 ** 64, {1: 'one'},
+                  float('nan'), [None, float('inf')], dict(a=None, b=-float('inf'))]:  # left to the standard library
+        assert fast_dumps(value) is None
+
+
+def test_jsonify_is_unchanged():
+    body = dict(items=_get_records(), count=10, when=datetime.datetime(2020, 1, 2, 3, 4, 5),
+                title='café', small=1e-5)
+
+    app = Flask(__name__)
+    with app.app_context():
+        expected = jsonify(body).get_data()
+
+    app = Flask(__name__)
+    register_codec(app)
+    with app.app_context():
+        assert jsonify(body).get_data() == expected
+        assert jsonify(body['items']).get_data() == jsonify(json.loads(json.dumps(body['items']))).get_data()
+
+
+@needs_orjson
+def test_jsonify_uses_orjson(monkeypatch):
+    import codec
+
+    calls = []
+    monkeypatch.setattr(codec, 'fast_dumps', lambda value, **kwargs: calls.append(value) or fast_dumps(value, **kwargs))
+    app = Flask(__name__)
+    register_codec(app)
+    with app.app_context():
+        assert jsonify(dict(b=1, a=[1.5, None])).get_data() == b'{"a":[1.5,null],"b":1}\n'
+    assert calls == [dict(b=1, a=[1.5, None])]
+
+
+@mark.slow
+def test_page_rendering_speed():
+    from time import perf_counter
+
+    body = dict(items=_get_records(10), count=10, next='/page/abcdef')
+    listing = dict(users=_get_records(100), count=100)
+    for label, app in [('stdlib', Flask(__name__)), ('orjson' if orjson else 'stdlib', Flask(__name__))]:
+        if label == 'orjson':
+            register_codec(app)
+        with app.app_context():
+            for name, value in [('page of 10 records', body), ('listing of 100 records', listing)]:
+                start = perf_counter()
+                for _ in range(2000):
+                    jsonify(value)
+                cost = (perf_counter() - start) / 2000 * 1e6
+                print(f"{label}: {name} rendered in {cost:.1f} µs")
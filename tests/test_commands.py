@@ -66,6 +66,8 @@ class Dispatcher:
         assert scope in ['channel:board', 'identities']
         assert action in ['post', 'put', 'delete']
         assert payload.get('id') is not None
+        if action != 'delete':
+            assert payload.pop('stamp') is not None  # records are stamped as by the writer, on replay
         self.count += 1
         message = self.hash + scope + action + json.dumps(payload)
         self.hash = hashlib.md5(message.encode('utf-8')).hexdigest()
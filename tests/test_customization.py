@@ -1,8 +1,11 @@
 import logging
 import os
-from pytest import mark
+from pytest import mark, raises as py_raises
 
 from customization import c11n, Customization
+from store import Store
+from store_log import LogStore
+from store_sqlite import SqliteStore
 
 
 pytestmark = mark.wip
@@ -23,3 +26,86 @@ def test_state_file_set_by_environ():
 
 def test_state_file_set_by_conftest():
     assert c11n.state_file == 'fixtures/test_state.yaml'
+
+
+def test_get_store(tmpdir):
+    os.environ['SQLITE_STORES'] = 'users,board'
+    os.environ['SQLITE_DIRECTORY'] = str(tmpdir)
+    c11n = Customization()
+    os.environ.pop('SQLITE_STORES')
+    os.environ.pop('SQLITE_DIRECTORY')
+
+    assert isinstance(c11n.get_store('universe'), Store)
+    store = c11n.get_store('board')
+    assert isinstance(store, SqliteStore)
+    assert store.path == str(tmpdir.join('board.sqlite'))
+    assert isinstance(c11n.get_store('users'), SqliteStore)
+
+
+def test_get_log_store(tmpdir):
+    os.environ['LOG_STORES'] = 'item'
+    os.environ['LOG_DIRECTORY'] = str(tmpdir)
+    c11n = Customization()
+    os.environ.pop('LOG_STORES')
+    os.environ.pop('LOG_DIRECTORY')
+
+    assert isinstance(c11n.get_store('board'), Store)
+    store = c11n.get_store('item')
+    assert isinstance(store, LogStore)
+    assert store.directory == str(tmpdir.join('item.logs'))
+
+
+def test_check_workers():
+    Customization().check_workers(workers=4)
+
+    os.environ['LOG_STORES'] = 'item'
+    c11n = Customization()
+    os.environ.pop('LOG_STORES')
+    c11n.check_workers(workers=0)
+    with py_raises(ValueError):
+        c11n.check_workers(workers=4)
+
+    os.environ['SQLITE_STORES'] = 'users'
+    c11n = Customization()
+    os.environ.pop('SQLITE_STORES')
+    with py_raises(ValueError):
+        c11n.check_workers(workers=1)
+
+
+def test_get_indexed_fields():
+    os.environ['INDEXED_FIELDS'] = 'author,item:board'
+    c11n = Customization()
+    os.environ.pop('INDEXED_FIELDS')
+
+    assert c11n.get_indexed_fields('universe') == ['author']
+    assert c11n.get_indexed_fields('item') == ['author', 'board']
+
+
+def test_channels():
+    assert Customization().channels == ['universe', 'community', 'board', 'item']
+
+    os.environ['CHANNELS'] = 'universe,board-1,board-2'
+    c11n = Customization()
+    os.environ.pop('CHANNELS')
+    assert c11n.channels == ['universe', 'board-1', 'board-2']
+
+
+def test_searchable_channels():
+    assert Customization().searchable_channels == []
+
+    os.environ['SEARCHABLE_CHANNELS'] = 'board,item'
+    c11n = Customization()
+    os.environ.pop('SEARCHABLE_CHANNELS')
+    assert c11n.searchable_channels == ['board', 'item']
+
+
+def test_password_hasher():
+    c11n = Customization()
+    assert (c11n.password_hasher, c11n.password_cost) == ('scrypt', 0)
+
+    os.environ['PASSWORD_HASHER'] = 'pbkdf2_sha256'
+    os.environ['PASSWORD_COST'] = '500000'
+    c11n = Customization()
+    os.environ.pop('PASSWORD_HASHER')
+    os.environ.pop('PASSWORD_COST')
+    assert (c11n.password_hasher, c11n.password_cost) == ('pbkdf2_sha256', 500000)
@@ -0,0 +1,79 @@
+from pytest import raises as py_raises
+from threading import BoundedSemaphore, Thread
+
+from feeds import Feed, FullError
+
+
+def test_publish_and_wait():
+    feed = Feed()
+    subscriber = feed.subscribe()
+    assert not subscriber.reset
+    feed.publish('post', dict(id='id-1'))
+    feed.publish('delete', dict(id='id-2'))
+    events = feed.wait(subscriber, timeout=0.01)
+    assert [(type, data['id']) for _, type, data in events] == [('post', 'id-1'), ('delete', 'id-2')]
+    assert feed.wait(subscriber, timeout=0.01) == []
+
+    feed.unsubscribe(subscriber)
+    feed.publish('post', dict(id='id-3'))
+    assert len(subscriber.events) == 0
+
+
+def test_wait_is_woken_up():
+    feed = Feed()
+    subscriber = feed.subscribe()
+    Thread(target=feed.publish, args=('post', dict(id='id-1'))).start()
+    events = feed.wait(subscriber, timeout=5.0)
+    assert len(events) == 1
+
+
+def test_resume():
+    feed = Feed(history_size=5)
+    subscriber = feed.subscribe()
+    for n in range(3):
+        feed.publish('post', dict(id=f"id-{n}"))
+    first, second, third = feed.wait(subscriber)
+
+    resumed = feed.subscribe(first[0])
+    assert not resumed.reset
+    assert list(resumed.events) == [second, third]
+    assert len(feed.subscribe(third[0]).events) == 0
+
+    for n in range(5):
+        feed.publish('post', dict(id=f"more-{n}"))
+    assert feed.subscribe(first[0]).reset  # forgotten
+    assert feed.subscribe('unknown-1').reset
+    assert feed.subscribe(f"{feed.epoch}-999").reset
+
+
+def test_buffers_are_bounded():
+    feed = Feed(buffer_size=3)
+    slow = feed.subscribe()
+    for n in range(5):
+        feed.publish('post', dict(id=f"id-{n}"))
+    assert slow.overflow
+    events = feed.wait(slow)
+    assert len(events) == 3
+    assert feed.wait(slow) == []  # does not block
+
+    resumed = feed.subscribe(events[-1][0])
+    assert [data['id'] for _, _, data in resumed.events] == ['id-3', 'id-4']
+
+
+def test_subscribers_are_capped():
+    slots = BoundedSemaphore(2)
+    feeds = [Feed(slots=slots), Feed(slots=slots)]
+    first = feeds[0].subscribe()
+    second = feeds[1].subscribe()
+    with py_raises(FullError):
+        feeds[0].subscribe()
+
+    feeds[1].unsubscribe(second)
+    feeds[1].unsubscribe(second)  # released only once
+    third = feeds[0].subscribe()
+    with py_raises(FullError):
+        feeds[1].subscribe()
+
+    feeds[0].unsubscribe(first)
+    feeds[0].unsubscribe(third)
+    assert slots.acquire(blocking=False) and slots.acquire(blocking=False)
@@ -41,21 +41,26 @@ def set_content(_context, _api, count=57, chunk_size=12):
     _context.channel.page_size = chunk_size
 
 
-@when("the user fetches pages with token <token>")
-def get_pages(_context, _api, token):
-    path = f"/page/{token}" if token != 'None' else "/"
-    response = _api.get(path,
-                        json=dict(bearer=''),
-                        content_type='application/json')
-    assert response.status_code == 200
-    _context.payload = json.loads(response.get_data().decode())
+@when("the user fetches pages up to rank <rank>")
+def get_pages(_context, _api, rank):
+    path = "/"
+    for _ in range(int(rank)):
+        response = _api.get(path,
+                            json=dict(bearer=''),
+                            content_type='application/json')
+        assert response.status_code == 200
+        _context.payload = json.loads(response.get_data().decode())
+        path = _context.payload['next']
 
 
 @then("the user gets <count> pages and get updated token <next>")
 def check_pages(_context, count, next):
     print(_context.payload)
     assert len(_context.payload['items']) == int(count)
-    assert _context.payload['next'] == next
+    if next == 'EOF':
+        assert _context.payload['next'] == next
+    else:
+        assert _context.payload['next'].startswith(next + '/')
 
 
 @given("a community of 36 persons and chunks of 10 records")
@@ -81,17 +86,22 @@ def set_community(_context, _api, count=36, chunk_size=10):
     _context.bearer = payload.get('bearer', None)
 
 
-@when("the user fetches profiles with token <token>")
-def get_profiles(_context, _api, token):
+@when("the user fetches profiles up to rank <rank>")
+def get_profiles(_context, _api, rank):
     _api.environ_base['HTTP_X_BEARER'] = _context.bearer
-    path = f"/users/page/{token}" if token != 'None' else "/users"
-    response = _api.get(path)
-    assert response.status_code == 200
-    _context.payload = json.loads(response.get_data().decode())
+    path = "/users"
+    for _ in range(int(rank)):
+        response = _api.get(path)
+        assert response.status_code == 200
+        _context.payload = json.loads(response.get_data().decode())
+        path = _context.payload['next']
 
 
 @then("the user gets <count> profiles and get updated token <next>")
 def check_profiles(_context, count, next):
     print(_context.payload)
     assert len(_context.payload['users']) == int(count)
-    assert _context.payload['next'] == next
+    if next == 'EOF':
+        assert _context.payload['next'] == next
+    else:
+        assert _context.payload['next'].startswith(next + '/')
@@ -0,0 +1,85 @@
+from pytest import mark, raises as py_raises
+from threading import Event, Thread
+from time import sleep, time
+
+from passwords import BusyError, Md5Hasher, Passwords, Pbkdf2Hasher, ScryptHasher, get_hasher
+
+
+def test_get_hasher():
+    assert isinstance(get_hasher('md5'), Md5Hasher)
+    assert get_hasher('pbkdf2_sha256', cost=1234).iterations == 1234
+    assert get_hasher('scrypt', cost=2 ** 5).n == 2 ** 5
+    assert get_hasher('scrypt').n == ScryptHasher.n
+    with py_raises(ValueError):
+        get_hasher('*alien*')
+
+
+@mark.parametrize('hasher', [Md5Hasher(), Pbkdf2Hasher(), ScryptHasher()])
+def test_hashers(hasher):
+    encoded = hasher.hash('P455w@rd')
+    assert hasher.identifies(encoded)
+    assert hasher.verify('P455w@rd', encoded)
+    assert not hasher.verify('*alien*', encoded)
+    assert not hasher.needs_rehash(encoded)
+    if hasher.algorithm != 'md5':
+        assert encoded.startswith(hasher.algorithm + '$')
+        assert hasher.hash('P455w@rd') != encoded  # salted
+
+
+def test_hashers_cost():
+    assert Pbkdf2Hasher(cost=2000).needs_rehash(Pbkdf2Hasher(cost=1000).hash('P455w@rd'))
+    assert ScryptHasher(cost=2 ** 5).needs_rehash(ScryptHasher(cost=2 ** 4).hash('P455w@rd'))
+    assert Pbkdf2Hasher(cost=2000).verify('P455w@rd', Pbkdf2Hasher(cost=1000).hash('P455w@rd'))
+    assert ScryptHasher(cost=2 ** 5).verify('P455w@rd', ScryptHasher(cost=2 ** 4).hash('P455w@rd'))
+
+
+def test_verify():
+    passwords = Passwords(hasher=Pbkdf2Hasher())
+    assert passwords.hash('P455w@rd').startswith('pbkdf2_sha256$')
+
+    assert passwords.verify('P455w@rd', passwords.hash('P455w@rd')) == (True, None)
+    assert passwords.verify('*alien*', passwords.hash('P455w@rd')) == (False, None)
+
+    legacy = Md5Hasher().hash('P455w@rd')
+    (is_valid, rehashed) = passwords.verify('P455w@rd', legacy)
+    assert is_valid
+    assert rehashed.startswith('pbkdf2_sha256$')
+    assert passwords.verify('*alien*', legacy) == (False, None)
+
+    (is_valid, rehashed) = passwords.verify('P455w@rd', ScryptHasher().hash('P455w@rd'))
+    assert is_valid
+    assert rehashed.startswith('pbkdf2_sha256$')  # moved to current hasher
+
+    assert passwords.verify('P455w@rd', 'unknown$algorithm') == (False, None)
+
+    passwords = Passwords(hasher=Md5Hasher())
+    assert passwords.verify('P455w@rd', ScryptHasher().hash('P455w@rd')) == (True, None)  # no downgrade
+
+
+def test_verify_when_busy():
+    passwords = Passwords(hasher=Md5Hasher(), workers=1, queue_size=1)
+    started = Event()
+    release = Event()
+
+    def slow_verify(password, encoded):
+        started.set()
+        release.wait(5)
+        return (True, None)
+
+    passwords._verify = slow_verify
+    threads = [Thread(target=passwords.verify, args=('P455w@rd', 'hash')) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    deadline = time() + 5
+    while passwords.slots._value > 0:  # until the second one is waiting
+        assert time() < deadline
+        sleep(0.01)
+
+    with py_raises(BusyError):  # one running, one waiting
+        passwords.verify('P455w@rd', 'hash')
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert passwords.verify('P455w@rd', 'hash') == (True, None)
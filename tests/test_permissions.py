@@ -1,4 +1,4 @@
-from pytest import raises as py_raises
+from pytest import mark, raises as py_raises
 
 from permissions import Permissions
 
@@ -93,3 +93,53 @@ def test_load_file():
     assert store.authorize('manage-identities', 'leader', 'update-any-to-leader') is True
     assert store.authorize('manage-identities', 'leader', 'update-any-to-support') is False
     assert store.authorize('manage-identities', 'leader', 'update-any- to-robot') is False
+
+    assert store.authorize('manage-identities', 'support', 'delete-robot') is True
+    assert store.authorize('manage-identities', 'support', 'delete-anonymous') is False  # listed topics only
+    assert store.authorize('manage-identities', 'support', 'delete-self') is True
+    assert store.authorize('manage-identities', 'leader', 'delete-robot') is False
+    assert store.authorize('manage-identities', 'support', 'update-any-to-support') is False
+
+
+def test_grant_patterns():
+    permissions = Permissions(authorized_scopes=['scope', 'other'])
+    permissions.grant('scope', 'a', 'update-self')
+    permissions.grant('scope', 'b', 'update-*')  # after some topic
+    permissions.grant('scope', 'c', 'update-*')
+    permissions.grant('scope', 'a', 'update-other')  # after some pattern
+    permissions.grant('other', 'c', '*')
+    assert permissions.count() == 5
+
+    assert permissions.authorize('scope', 'a', 'update-self') is True
+    assert permissions.authorize('scope', 'a', 'update-other') is True
+    assert permissions.authorize('scope', 'a', 'update-unlisted') is False
+    assert permissions.authorize('scope', 'b', 'update-self') is True
+    assert permissions.authorize('scope', 'b', 'update-other') is True
+    assert permissions.authorize('scope', 'b', 'update-unlisted') is True
+    assert permissions.authorize('scope', 'c', 'update-unlisted') is True
+    assert permissions.authorize('scope', 'b', 'delete-self') is False
+    assert permissions.authorize('scope', 'b', 'update') is False
+    assert permissions.authorize('scope', 'x', 'update-self') is False
+
+    assert permissions.authorize('other', 'c', 'anything') is True
+    assert permissions.authorize('other', 'a', 'anything') is False
+    assert permissions.authorize('*unknown*', 'c', 'anything') is False
+
+
+@mark.slow
+def test_authorize_speed():
+    from time import perf_counter
+
+    permissions = Permissions(path='fixtures/permissions.yaml')
+    statements = {':'.join(x) for x in permissions.statements}
+    checks = [('access-content', 'member', 'community'),
+              ('manage-identities', 'leader', 'update-any-to-support'),
+              ('access-identities', 'anonymous', 'list')]
+    for label, authorize in [('concatenated strings', lambda scope, persona, topic: scope + ':' + persona + ':' + topic in statements),
+                             ('compiled matrix', permissions.authorize)]:
+        start = perf_counter()
+        for _ in range(100000):
+            for scope, persona, topic in checks:
+                authorize(scope, persona, topic)
+        cost = (perf_counter() - start) / 300000 * 1e9
+        print(f"{label}: authorized in {cost:.0f} ns")
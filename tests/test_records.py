@@ -1,8 +1,10 @@
 import datetime
 from io import StringIO
 from pytest import fixture, mark, raises as py_raises
+from yaml import dump
 
-from records import Records
+from records import Records, merge_patch
+from store import Store
 
 
 @fixture
@@ -78,16 +80,19 @@ def test_chunk_chaining_with_token():
 
     chunk = records.chunk(token=None)
     assert chunk.count == 10
-    assert chunk.token == 'aGVsbG8gd29ybGQxMA=='
+    last = chunk.records[-1]
+    assert chunk.token == records._encode_token(last['stamp'], last['id'])
 
-    chunk = records.chunk(token=records._encode_token(-235))
-    assert chunk.count == 10
-    assert chunk.token == 'aGVsbG8gd29ybGQxMA=='
+    seen = [record['id'] for record in chunk.records]
+    while chunk.token != 'EOF':
+        chunk = records.chunk(token=chunk.token)
+        seen += [record['id'] for record in chunk.records]
+    assert seen == [f"id-{n}" for n in range(36, 0, -1)]
 
     with py_raises(ValueError) as error:
         chunk = records.chunk(token='EOF')
 
-    chunk = records.chunk(token=records._encode_token(235))
+    chunk = records.chunk(token=records._encode_token('0', 'id-0'))
     assert chunk.count == 0
     assert chunk.token == 'EOF'
 
@@ -97,9 +102,243 @@ def test_chunk_chaining_with_token():
     with py_raises(ValueError) as error:
         chunk = records.chunk(token='12345')
 
+    token = records._encode_token('1.5', 'a/b+c?d:e~~~')
+    assert '/' not in token and '+' not in token
+    assert records._decode_token(token) == ('1.5', 'a/b+c?d:e~~~')
+
+    with py_raises(ValueError) as error:
+        chunk = Records(salt='another salt').chunk(token=records._encode_token('0', 'id-0'))
+
+
+def test_chunk_is_stable_while_writing():
+    records = Records()
+    for n in range(30):
+        records.write(id=f"id-{n + 1}", content=f"hello {n + 1}")
+
+    chunk = records.chunk(token=None)
+    seen = [record['id'] for record in chunk.records]
+
+    records.write(id='id-new', content='hello new')  # inserted on top
+    records.write(id='id-5', content='hello again')  # moved to top
+    records.delete(id='id-15')
+
+    while chunk.token != 'EOF':
+        chunk = records.chunk(token=chunk.token)
+        seen += [record['id'] for record in chunk.records]
+
+    expected = [f"id-{n}" for n in range(30, 0, -1) if n not in (5, 15)]
+    assert seen == expected
+
+
+def test_chunk_does_not_copy_records(_records):
+    chunk = _records.chunk(token=None)
+    for record in chunk.records:
+        assert _records.read(id=record['id']) is record
+
+
+def test_dump_is_plain(_records):
+    _records.write(id='id-1', tags=['a', 'b'])
+    for record in _records.dump():
+        assert type(record) is dict
+        assert 'python' not in dump(record)
+
+
+def test_between():
+    records = Records()
+    for n in range(10):
+        records.write(id=f"id-{n + 1}", content=f"hello {n + 1}")
+    stamps = [float(records.read(id=f"id-{n + 1}")['stamp']) for n in range(10)]
+    assert list(records.stamps) == stamps
+    assert records.stamped_ids == [f"id-{n + 1}" for n in range(10)]
+
+    items = records.between(start=stamps[2], stop=stamps[5])
+    assert [x['id'] for x in items] == ['id-6', 'id-5', 'id-4', 'id-3']
+
+    items = records.between(start=stamps[7])
+    assert [x['id'] for x in items] == ['id-10', 'id-9', 'id-8']
+
+    items = records.between(start=stamps[0], count=2)
+    assert [x['id'] for x in items] == ['id-10', 'id-9']
+
+    assert records.between(start=stamps[9] + 1) == []
+
+    records.write(id='id-3', content='updated')  # moved to the end of the column
+    records.delete(id='id-5')
+    assert records.stamped_ids[-1] == 'id-3'
+    assert len(records.stamps) == 9
+    items = records.between(start=stamps[2], stop=stamps[5])
+    assert [x['id'] for x in items] == ['id-6', 'id-4']
+
+    rebuilt = Records(store=records.records)
+    assert rebuilt.stamped_ids == records.stamped_ids
+    assert rebuilt.stamps == records.stamps
+
+
+def test_indexed_fields():
+    records = Records(indexed_fields=['board', 'tags'])
+    for n in range(30):
+        records.write(id=f"id-{n + 1}",
+                      board=f"board-{n % 3}",
+                      tags=['even' if n % 2 else 'odd', 'all'])
+
+    assert records.ids_where(field='board', value='board-0', count=3) == ['id-28', 'id-25', 'id-22']
+    assert len(records.ids_where(field='tags', value='all', count=100)) == 30
+    assert records.ids_where(field='board', value='board-9') == []
+    with py_raises(KeyError):
+        records.ids_where(field='author', value='Alice')
+
+    seen = []
+    chunk = records.chunk(token=None, count=4, field='board', value='board-1')
+    seen += [record['id'] for record in chunk.records]
+    while chunk.token != 'EOF':
+        chunk = records.chunk(token=chunk.token, count=4, field='board', value='board-1')
+        seen += [record['id'] for record in chunk.records]
+    assert seen == [f"id-{n + 1}" for n in range(29, -1, -1) if n % 3 == 1]
+
+    assert records.ids_where(field='board', value=['board-0', 'board-2'], count=4) == ['id-30', 'id-28', 'id-27', 'id-25']
+    assert records.ids_where(field='tags', value=['odd', 'all'], count=3) == ['id-30', 'id-29', 'id-28']  # once each
+    assert records.ids_where(field='board', value=[]) == []
+    seen = []
+    chunk = records.chunk(token=None, count=7, field='board', value=['board-1', 'board-2'])
+    seen += [record['id'] for record in chunk.records]
+    while chunk.token != 'EOF':
+        chunk = records.chunk(token=chunk.token, count=7, field='board', value=['board-1', 'board-2'])
+        seen += [record['id'] for record in chunk.records]
+    assert seen == [f"id-{n + 1}" for n in range(29, -1, -1) if n % 3 != 0]
+
+    records.write(id='id-28', board='board-1')  # moved to another board
+    records.delete(id='id-25')
+    assert records.ids_where(field='board', value='board-0', count=2) == ['id-22', 'id-19']
+    assert records.ids_where(field='board', value='board-1', count=1) == ['id-28']
+
+    rebuilt = Records(store=records.records, indexed_fields=['board', 'tags'])
+    assert rebuilt.postings == {}  # built on first use
+    assert {field: rebuilt._get_postings(field) for field in ['board', 'tags']} == records.postings
+
+
+def test_search():
+    records = Records(searchable=True)
+    records.write(id='id-1', title='Concert Brahms')
+    records.write(id='id-2', title='Concert Mozart')
+    assert [x['id'] for x in records.search('mozart')] == ['id-2']
+
+    records.write(id='id-2', title='Concert Beethoven')
+    records.delete(id='id-1')
+    assert records.search('mozart') == []
+    assert records.search('brahms') == []
+    assert [x['id'] for x in records.search('concert')] == ['id-2']
+
+    rebuilt = Records(store=records.records, searchable=True)
+    assert [x['id'] for x in rebuilt.search('beethoven')] == ['id-2']
+
+    with py_raises(ValueError):
+        Records().search('concert')
+
+
+def test_merge_patch():  # examples of RFC 7386
+    cases = [({'a': 'b'}, {'a': 'c'}, {'a': 'c'}),
+             ({'a': 'b'}, {'b': 'c'}, {'a': 'b', 'b': 'c'}),
+             ({'a': 'b'}, {'a': None}, {}),
+             ({'a': 'b', 'b': 'c'}, {'a': None}, {'b': 'c'}),
+             ({'a': ['b']}, {'a': 'c'}, {'a': 'c'}),
+             ({'a': 'c'}, {'a': ['b']}, {'a': ['b']}),
+             ({'a': {'b': 'c'}}, {'a': {'b': 'd', 'c': None}}, {'a': {'b': 'd'}}),
+             ({'a': [{'b': 'c'}]}, {'a': [1]}, {'a': [1]}),
+             (['a', 'b'], ['c', 'd'], ['c', 'd']),
+             ({'a': 'b'}, ['c'], ['c']),
+             ({'a': 'foo'}, None, None),
+             ({'a': 'foo'}, 'bar', 'bar'),
+             ({'e': None}, {'a': 1}, {'e': None, 'a': 1}),
+             ([1, 2], {'a': 'b', 'c': None}, {'a': 'b'}),
+             ({}, {'a': {'bb': {'ccc': None}}}, {'a': {'bb': {}}})]
+    for target, patch, expected in cases:
+        assert merge_patch(target, patch) == expected
+
+
+def test_patch():
+    records = Records(searchable=True, indexed_fields=['board'])
+    records.write(id='id-1', title='Concert Brahms', board='a', nested=dict(x=1, y=[1, 2]), kept=dict(z=1))
+    before = records.read('id-1')
+    assert records.patch('id-1', dict(title='Concert Mozart', board=None, nested=dict(x=None), bearer='*secret*'))
+    record = records.read('id-1')
+    assert record['title'] == 'Concert Mozart'
+    assert 'board' not in record
+    assert record['nested'] == dict(y=[1, 2])
+    assert record['kept'] is before['kept']  # not copied
+    assert 'bearer' not in record
+    assert record['stamp'] >= before['stamp']
+    assert [x['id'] for x in records.search('mozart')] == ['id-1']
+    assert records.ids_where('board', 'a') == []
+    assert not records.patch('*unknown*', dict(title='hello'))
+
 
 def test_scan(_records):
     count = 0
     for item in _records.scan():
         count += 1
     assert count == 5
+
+
+def test_restart_does_not_read_records():
+    store = Store()
+    for n in range(10):
+        Records(store=store).write(id=f"id-{n + 1}", board=f"board-{n % 2}", title='hello world')
+    reads = []
+    get = store.get
+    store.get = lambda *args, **kwargs: reads.append(args) or get(*args, **kwargs)
+
+    records = Records(store=store, indexed_fields=['board'])
+    assert reads == []
+    assert records.stamped_ids == [f"id-{n + 1}" for n in range(10)]
+    assert records.ids_where(field='board', value='board-1', count=2) == ['id-10', 'id-8']
+
+    records = Records(store=store, searchable=True)  # search is opt-in, and indexes record bodies
+    assert len(records.search('hello')) == 10
+
+
+def test_concurrent_writes():
+    from threading import Thread
+
+    records = Records()
+
+    def write(prefix):
+        for n in range(200):
+            records.write(id=f"{prefix}-{n % 20}", title='hello')
+
+    threads = [Thread(target=write, args=(x,)) for x in 'abcd']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(records.stamped_ids) == len(set(records.stamped_ids)) == 80
+    assert list(records.stamps) == sorted(records.stamps)
+    for stamp, id in zip(records.stamps, records.stamped_ids):
+        assert float(records.read(id)['stamp']) == stamp
+
+
+def _write_and_delete(records):
+    for n in range(500):
+        records.write(id=f"id-{n % 50}", title=f"hello world {n}")
+        if n % 3 == 0:
+            records.delete(id=f"id-{(n + 7) % 50}")
+
+
+def _search(records, errors):
+    try:
+        for _ in range(200):
+            records.search('hello world')
+    except Exception as error:
+        errors.append(error)
+
+
+def test_concurrent_search():
+    from threading import Thread
+
+    records = Records(searchable=True)
+    errors = []
+    threads = [Thread(target=_write_and_delete, args=(records,))] + [Thread(target=_search, args=(records, errors)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
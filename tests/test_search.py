@@ -0,0 +1,38 @@
+from pytest import fixture, mark, raises as py_raises
+
+from search import SearchIndex, tokenize
+
+
+@fixture
+def _index():
+    index = SearchIndex()
+    index.add('id-1', dict(id='id-1', title='Concert Brahms', content='<p>Un concert pour Brahms</p>'))
+    index.add('id-2', dict(id='id-2', title='Concert Mozart', content='<p>Mozart, encore Mozart</p>'))
+    index.add('id-3', dict(id='id-3', title='Première page', tags=['répétition', 'brahms'], draft=True))
+    return index
+
+
+def test_tokenize():
+    assert tokenize('<p>Première <b>répétition</b>, à 20h!</p>') == ['premiere', 'repetition', '20h']
+    assert tokenize('') == []
+
+
+def test_search(_index):
+    assert [id for id, _ in _index.search('mozart')] == ['id-2']
+    assert [id for id, _ in _index.search('Brahms')] == ['id-1', 'id-3']
+    assert [id for id, _ in _index.search('concert mozart')][0] == 'id-2'
+    assert [id for id, _ in _index.search('repetition')] == ['id-3']
+    assert _index.search('beethoven') == []
+    assert len(_index.search('concert', count=1)) == 1
+
+
+def test_update_and_remove(_index):
+    _index.add('id-2', dict(id='id-2', title='Concert Beethoven'))
+    assert _index.search('mozart') == []
+    assert [id for id, _ in _index.search('beethoven')] == ['id-2']
+
+    _index.remove('id-2')
+    _index.remove('*unknown*')
+    assert _index.search('beethoven') == []
+    assert 'beethoven' not in _index.postings
+    assert _index.total_length == sum(_index.lengths.values())
@@ -2,7 +2,7 @@ import datetime
 from io import StringIO
 from pytest import fixture, mark, raises as py_raises
 
-from store import Store
+from store import Store, freeze, thaw
 
 
 pytestmark = mark.wip
@@ -48,6 +48,14 @@ def test_record_life_cycle():
     assert store.get(id=id) is None
 
 
+def test_get_many(_store):
+    records = _store.get_many(['id-2', '*unknown*', 'id-1'])
+    assert records[0]['id'] == 'id-2'
+    assert records[1] is None
+    assert records[2]['id'] == 'id-1'
+    assert _store.get_many([]) == []
+
+
 def test_delete_with_unknown_id(_store):
     _store.delete(id='*here*there*is*no*alien*yet*')
 
@@ -62,3 +70,119 @@ def test_list_ids(_store):
 
     ids = _store.ids_by('side', reverse=True)
     assert ids[0] == 'id-5'
+
+
+def test_scan(_store):
+    records = _store.scan()
+    _store.put(id='id-1', text='updated')
+    _store.put(id='id-6', text='new')
+    _store.delete(id='id-2')
+    records = list(records)
+    assert len(records) == 5
+    assert all(x['text'] == 'hello world' for x in records)
+
+
+def test_sorted_index_is_maintained():
+    store = Store(sort_keys=['stamp', 'side'])
+    for n in range(5):
+        store.put(id=f"id-{n + 1}", stamp=f"{n + 1:04d}", side=f"side-{5 - n}")
+
+    assert store.ids_by('stamp') == ['id-5', 'id-4', 'id-3', 'id-2', 'id-1']
+    assert store.ids_by('side', reverse=False) == ['id-5', 'id-4', 'id-3', 'id-2', 'id-1']
+
+    store.put(id='id-2', stamp='0009', side='side-0')  # update moves the record
+    assert store.ids_by('stamp') == ['id-2', 'id-5', 'id-4', 'id-3', 'id-1']
+    assert store.ids_by('side', reverse=False)[0] == 'id-2'
+    assert len(store.indexes['stamp']) == 5
+
+    store.delete(id='id-4')
+    assert store.ids_by('stamp') == ['id-2', 'id-5', 'id-3', 'id-1']
+    assert len(store.indexes['side']) == 4
+
+
+def test_ids_by_slice():
+    store = Store()
+    for n in range(25):
+        store.put(id=f"id-{n + 1}", stamp=f"{n + 1:04d}")
+
+    assert store.ids_by('stamp', start=0, stop=3) == ['id-25', 'id-24', 'id-23']
+    assert store.ids_by('stamp', start=20, stop=30) == ['id-5', 'id-4', 'id-3', 'id-2', 'id-1']
+    assert store.ids_by('stamp', start=30, stop=40) == []
+    assert store.ids_by('stamp', reverse=False, start=3, stop=5) == ['id-4', 'id-5']
+    assert store.ids_by('stamp', start=5, stop=8) == store.ids_by('stamp')[5:8]
+
+
+def test_ids_after():
+    store = Store()
+    for n in range(25):
+        store.put(id=f"id-{n + 1}", stamp=f"{n + 1:04d}")
+
+    assert store.ids_after('stamp', count=3) == ['id-25', 'id-24', 'id-23']
+    assert store.ids_after('stamp', after=('0023', 'id-23'), count=3) == ['id-22', 'id-21', 'id-20']
+    assert store.ids_after('stamp', after=('0002', 'id-2'), count=3) == ['id-1']
+    assert store.ids_after('stamp', after=('0001', 'id-1'), count=3) == []
+    assert store.ids_after('stamp', after=('0022', 'id-gone'), count=2) == ['id-22', 'id-21']
+    assert store.ids_after('stamp', reverse=False, count=2) == ['id-1', 'id-2']
+    assert store.ids_after('stamp', after=('0002', 'id-2'), reverse=False, count=2) == ['id-3', 'id-4']
+
+
+def test_records_are_frozen():
+    store = Store()
+    source = dict(title='hello world', tags=['a', 'b'], author=dict(name='Alice'))
+    store.put(id='id-1', **source)
+    source['tags'].append('c')  # caller keeps ownership of its data
+    source['author']['name'] = 'Bob'
+
+    record = store.get(id='id-1')
+    assert record['tags'] == ['a', 'b']
+    assert record['author']['name'] == 'Alice'
+    assert store.get(id='id-1') is record  # no copy on read
+
+    with py_raises(TypeError):
+        record['title'] = 'another title'
+    with py_raises(TypeError):
+        record.pop('title')
+    with py_raises(TypeError):
+        record['tags'].append('c')
+    with py_raises(TypeError):
+        record['author']['name'] = 'Bob'
+
+
+def test_freeze_and_thaw():
+    frozen = freeze(dict(tags=['a'], nested=dict(key='value')))
+    assert freeze(frozen) is frozen
+
+    thawed = thaw(frozen)
+    assert thawed == frozen
+    assert type(thawed) is dict
+    assert type(thawed['tags']) is list
+    thawed['tags'].append('b')
+    assert frozen['tags'] == ['a']
+
+
+@mark.slow
+def test_paging_latency():
+    from time import perf_counter
+
+    for size in [10000, 100000, 1000000]:
+        store = Store()
+        for n in range(size):
+            store.put(id=f"id-{n}", stamp=f"{n:010d}")
+
+        pages = 10
+        start = perf_counter()
+        for page in range(pages):
+            offset = page * 10
+            store.ids_by('stamp', start=offset, stop=offset + 10)
+        indexed = (perf_counter() - start) / pages
+
+        start = perf_counter()
+        for page in range(pages):
+            offset = page * 10
+            sorted(list(store.records.keys()),
+                   key=lambda id: store.records[id]['stamp'],
+                   reverse=True)[offset:offset + 10]
+        previous = (perf_counter() - start) / pages
+
+        print(f"{size} records: {indexed * 1e6:.1f} us per page with index, {previous * 1e6:.1f} us per page with sort")
+        assert indexed < previous
@@ -0,0 +1,203 @@
+import os
+from threading import Thread
+from time import sleep
+from pytest import fixture, mark, raises as py_raises
+from yaml import safe_load, dump
+
+from records import Records
+from store_log import LogStore
+
+
+@fixture
+def _store(tmpdir):
+    items = [dict(id="id-{}".format(n + 1),
+                  side="side-{}".format(n + 1),
+                  stamp="{:04d}".format(n + 1),
+                  text='hello world') for n in range(5)]
+
+    store = LogStore(directory=str(tmpdir))
+    for item in items:
+        store.put(**item)
+
+    return store
+
+
+def test_init(tmpdir):
+    store = LogStore(directory=str(tmpdir))
+    assert len(store.ids()) == 0
+
+
+def test_record_life_cycle(tmpdir):
+    id = '01234567890-c01'
+    initial_record = dict(id=id, title='hello world', description='etc.', tags=['a', 'b'])
+    updated_record = dict(id=id, title='another title')
+
+    store = LogStore(directory=str(tmpdir))  # empty store
+    assert store.get(id=id) is None
+
+    store.put(**initial_record)
+    record = store.get(id=id)
+    assert record['title'] == initial_record['title']
+    assert record['description'] == initial_record['description']
+    assert record['tags'] == ['a', 'b']
+    with py_raises(TypeError):
+        record['title'] = 'changed'
+
+    store.put(**updated_record)
+    record = store.get(id=id)
+    assert record['title'] == updated_record['title']
+    assert record.get('description', None) is None
+
+    store.delete(id=id)
+    assert store.get(id=id) is None
+
+
+def test_get_many(_store):
+    records = _store.get_many(['id-2', '*unknown*', 'id-1'])
+    assert records[0]['id'] == 'id-2'
+    assert records[1] is None
+    assert records[2]['id'] == 'id-1'
+    assert _store.get_many([]) == []
+
+
+def test_delete_with_unknown_id(_store):
+    _store.delete(id='*here*there*is*no*alien*yet*')
+
+
+def test_list_ids(_store):
+
+    assert sorted(_store.ids()) == ['id-1', 'id-2', 'id-3', 'id-4', 'id-5']
+    assert _store.ids_by('side', reverse=False)[0] == 'id-1'
+    assert _store.ids_by('stamp') == ['id-5', 'id-4', 'id-3', 'id-2', 'id-1']
+    assert _store.ids_after('stamp', after=('0004', 'id-4'), count=2) == ['id-3', 'id-2']
+    assert [tuple(x) for x in _store.stamps()] == [(f"000{n}", f"id-{n}") for n in range(1, 6)]
+
+    _store.clear()
+    assert _store.ids() == []
+    assert _store.ids_by('stamp') == []
+
+
+def test_restart(_store):
+    _store.put(id='id-2', stamp='0009', text='updated')
+    _store.delete(id='id-4')
+    _store.close()
+
+    store = LogStore(directory=_store.directory)
+    assert sorted(store.ids()) == ['id-1', 'id-2', 'id-3', 'id-5']
+    assert store.get(id='id-2')['text'] == 'updated'
+    assert store.ids_by('stamp') == ['id-2', 'id-5', 'id-3', 'id-1']
+
+
+def test_truncated_segment(_store):
+    _store.close()
+    path = _store._path(_store.active)
+    with open(path, 'ab') as stream:
+        stream.write(b'["id-1", {"stamp": "0010"}, 500]\n{"id": "id-1", "te')
+
+    store = LogStore(directory=_store.directory)
+    assert store.get(id='id-1')['text'] == 'hello world'
+    assert len(store.ids()) == 5
+
+
+def test_scan(tmpdir):
+    store = LogStore(directory=str(tmpdir), segment_size=200)
+    for n in range(10):
+        store.put(id=f"id-{n}", text='hello world')
+    records = store.scan()
+    assert next(records)['text'] == 'hello world'
+    store.put(id='id-0', text='updated')
+    store.delete(id='id-1')
+    store.merge()  # put on hold
+    assert len(store._segments()) > 2
+
+    other = Thread(target=lambda: list(store.scan()))  # not blocked by the first scan
+    other.start()
+    other.join(timeout=5)
+    assert not other.is_alive()
+    rest = list(records)
+    assert len(rest) == 9
+    assert all(x['text'] == 'hello world' for x in rest)
+    assert not store.merging.locked()
+    assert store.readers == 0
+    store.merge()
+    assert len(store._segments()) == 2
+
+
+def test_merge(tmpdir):
+    store = LogStore(directory=str(tmpdir), segment_size=200, merge_threshold=0)
+    for n in range(50):
+        store.put(id=f"id-{n % 5}", stamp=f"{n:04d}", text=f"hello {n}")
+    store.delete(id='id-0')
+    assert len(store._segments()) > 10
+    size = sum(os.path.getsize(store._path(x)) for x in store._segments())
+
+    store.merge()
+    assert len(store._segments()) == 2  # merged, and active
+    assert sum(os.path.getsize(store._path(x)) for x in store._segments()) < size / 5
+    assert sorted(store.ids()) == ['id-1', 'id-2', 'id-3', 'id-4']
+    assert store.get(id='id-4')['text'] == 'hello 49'
+
+    store.put(id='id-1', stamp='0050', text='after merge')
+    store.close()
+    store = LogStore(directory=str(tmpdir))
+    assert store.get(id='id-1')['text'] == 'after merge'
+    assert store.get(id='id-3')['text'] == 'hello 48'
+    assert store.ids_by('stamp') == ['id-1', 'id-4', 'id-3', 'id-2']
+
+
+def test_merge_in_background(tmpdir):
+    store = LogStore(directory=str(tmpdir), segment_size=200, merge_threshold=3)
+    for n in range(100):
+        store.put(id=f"id-{n % 5}", stamp=f"{n:04d}", text=f"hello {n}")
+    store.merger.join()
+    while store.merging.locked():
+        sleep(0.01)
+    assert store._segments()[0] > 1  # first segments have been merged
+    assert store.get(id='id-4')['text'] == 'hello 99'
+
+    store.close()
+    store = LogStore(directory=str(tmpdir))
+    assert sorted(store.ids()) == ['id-0', 'id-1', 'id-2', 'id-3', 'id-4']
+    assert store.get(id='id-0')['text'] == 'hello 95'
+
+
+def test_records_on_log_store(tmpdir):
+    records = Records(store=LogStore(directory=str(tmpdir)))
+    for n in range(25):
+        records.write(id=f"id-{n + 1}", content=f"hello {n + 1}")
+    assert records.count() == 25
+
+    seen = []
+    chunk = records.chunk(token=None)
+    seen += [record['id'] for record in chunk.records]
+    while chunk.token != 'EOF':
+        chunk = records.chunk(token=chunk.token)
+        seen += [record['id'] for record in chunk.records]
+    assert seen == [f"id-{n}" for n in range(25, 0, -1)]
+
+
+@mark.slow
+def test_write_and_restart_speed(tmpdir):
+    from time import perf_counter
+
+    size = 20000
+    body = 'x' * 500
+
+    records = Records(store=LogStore(directory=str(tmpdir)))
+    start = perf_counter()
+    for n in range(size):
+        records.write(id=f"id-{n}", body=body)
+    writes = size / (perf_counter() - start)
+    records.records.close()
+
+    start = perf_counter()
+    store = LogStore(directory=str(tmpdir))
+    restart = perf_counter() - start
+    assert len(store.ids()) == size
+
+    content = dump(Records(store=store).dump(), default_flow_style=False)
+    start = perf_counter()
+    Records().load(safe_load(content))  # as in Maintenance.import_content()
+    replay = perf_counter() - start
+
+    print(f"{writes:.0f} writes/s, restart in {restart:.2f}s, import of YAML state in {replay:.2f}s")
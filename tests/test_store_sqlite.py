@@ -0,0 +1,161 @@
+from pytest import fixture, mark, raises as py_raises
+
+from records import Records
+from store import Store
+from store_sqlite import SqliteStore
+
+
+@fixture
+def _store():
+    items = [dict(id="id-{}".format(n + 1),
+                  side="side-{}".format(n + 1),
+                  stamp="{:04d}".format(n + 1),
+                  text='hello world') for n in range(5)]
+
+    store = SqliteStore()
+    for item in items:
+        store.put(**item)
+
+    return store
+
+
+def test_init():
+    store = SqliteStore()
+    assert len(store.ids()) == 0
+
+
+def test_record_life_cycle():
+    id = '01234567890-c01'
+    initial_record = dict(id=id, title='hello world', description='etc.', tags=['a', 'b'])
+    updated_record = dict(id=id, title='another title')
+
+    store = SqliteStore()  # empty store
+    assert store.get(id=id) is None
+
+    store.put(**initial_record)
+    record = store.get(id=id)
+    assert record['title'] == initial_record['title']
+    assert record['description'] == initial_record['description']
+    assert record['tags'] == ['a', 'b']
+    with py_raises(TypeError):
+        record['title'] = 'changed'
+
+    store.put(**updated_record)
+    record = store.get(id=id)
+    assert record['title'] == updated_record['title']
+    assert record.get('description', None) is None
+
+    store.delete(id=id)
+    assert store.get(id=id) is None
+
+
+def test_get_many(_store):
+    records = _store.get_many(['id-2', '*unknown*', 'id-1'])
+    assert records[0]['id'] == 'id-2'
+    assert records[1] is None
+    assert records[2]['id'] == 'id-1'
+    assert _store.get_many([]) == []
+
+
+def test_delete_with_unknown_id(_store):
+    _store.delete(id='*here*there*is*no*alien*yet*')
+
+
+def test_list_ids(_store):
+
+    assert sorted(_store.ids()) == ['id-1', 'id-2', 'id-3', 'id-4', 'id-5']
+
+    assert _store.ids_by('side', reverse=False)[0] == 'id-1'
+    assert _store.ids_by('side', reverse=True)[0] == 'id-5'
+
+    assert _store.ids_by('stamp') == ['id-5', 'id-4', 'id-3', 'id-2', 'id-1']
+    assert _store.ids_by('stamp', start=1, stop=3) == ['id-4', 'id-3']
+
+    assert _store.ids_after('stamp', count=2) == ['id-5', 'id-4']
+    assert _store.ids_after('stamp', after=('0004', 'id-4'), count=2) == ['id-3', 'id-2']
+    assert _store.ids_after('stamp', after=('0002', 'id-2'), reverse=False, count=2) == ['id-3', 'id-4']
+    assert [tuple(x) for x in _store.stamps()] == [(f"000{n}", f"id-{n}") for n in range(1, 6)]
+
+    _store.clear()
+    assert _store.ids() == []
+
+
+def test_persistence(tmpdir):
+    path = str(tmpdir.join('records.sqlite'))
+    store = SqliteStore(path=path)
+    store.put(id='id-1', stamp='0001', title='hello world')
+    store.close()
+
+    store = SqliteStore(path=path)
+    assert store.get(id='id-1')['title'] == 'hello world'
+
+
+def test_scan(tmpdir):
+    store = SqliteStore(path=str(tmpdir.join('records.sqlite')))
+    for n in range(10):
+        store.put(id=f"id-{n}", text='hello world')
+    records = store.scan(chunk_size=3)
+    assert next(records)['text'] == 'hello world'
+    store.put(id='id-0', text='updated')
+    store.put(id='id-10', text='new')
+    store.delete(id='id-1')
+    rest = list(records)
+    assert len(rest) == 9
+    assert all(x['text'] == 'hello world' for x in rest)
+    store.close()
+
+    store = SqliteStore()
+    store.put(id='id-1', text='hello world')
+    assert [x['id'] for x in store.scan()] == ['id-1']
+
+
+def test_records_on_sqlite():
+    records = Records(store=SqliteStore())
+    for n in range(25):
+        records.write(id=f"id-{n + 1}", content=f"hello {n + 1}")
+    assert records.count() == 25
+
+    seen = []
+    chunk = records.chunk(token=None)
+    seen += [record['id'] for record in chunk.records]
+    while chunk.token != 'EOF':
+        chunk = records.chunk(token=chunk.token)
+        seen += [record['id'] for record in chunk.records]
+    assert seen == [f"id-{n}" for n in range(25, 0, -1)]
+
+    records.load([dict(id='id-x', content='hello')], append=False)
+    assert records.count() == 1
+
+
+@mark.slow
+def test_throughput_and_memory(tmpdir):
+    from time import perf_counter
+    import tracemalloc
+
+    size = 100000
+    body = 'x' * 500
+    for label, factory in [('dict', lambda: Store()),
+                           ('sqlite', lambda: SqliteStore(path=str(tmpdir.join('bench.sqlite'))))]:
+        tracemalloc.start()
+        store = factory()
+
+        start = perf_counter()
+        for n in range(size):
+            store.put(id=f"id-{n}", stamp=f"{n:010d}", body=body)
+        writes = size / (perf_counter() - start)
+
+        start = perf_counter()
+        for n in range(size):
+            store.get(id=f"id-{n}")
+        reads = size / (perf_counter() - start)
+
+        start = perf_counter()
+        after = None
+        for page in range(1000):
+            ids = store.ids_after('stamp', after=after, count=10)
+            after = (f"{size - (page + 1) * 10:010d}", ids[-1])
+        pages = 1000 / (perf_counter() - start)
+
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{label}: {writes:.0f} writes/s, {reads:.0f} reads/s, {pages:.0f} pages/s, {memory / 1e6:.1f} MB")
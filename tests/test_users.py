@@ -4,7 +4,7 @@ import jwt
 from pytest import fixture, raises as py_raises
 
 import bearers
-from users import Users, AUTHORIZED_PERSONAS
+from users import Users, NotFoundError, AUTHORIZED_PERSONAS
 
 
 def test_init():
@@ -26,7 +26,8 @@ def test_record_life_cycle():
     record = store.read(id=id)
     for key in initial_record.keys():
         if key == 'password':
-            assert record[key] == '7b22184aa8082c76e63391e179c66644'
+            assert record[key].startswith('scrypt$')
+            assert store.passwords.verify('P4SSw@rd', record[key]) == (True, None)
         else:
             assert record[key] == initial_record[key]
 
@@ -34,7 +35,7 @@ def test_record_life_cycle():
     record = store.read(id=id)
     for key in updated_record.keys():
         if key == 'password':
-            assert record[key] == '5b8892d5956d6870679b048cd982583c'
+            assert store.passwords.verify('anotherOne', record[key]) == (True, None)
         else:
             assert record[key] == updated_record[key]
     for key in initial_record.keys():
@@ -44,6 +45,17 @@ def test_record_life_cycle():
     assert store.read(id=id) is None
 
 
+def test_persona_index():
+    store = Users(indexed_fields=['e_mail'])
+    assert store.indexed_fields == ['persona', 'e_mail']
+    store.write(id='Alice', persona='member', password='P455w@rd', e_mail='a@b.c')
+    store.write(id='Bob', persona='leader', password='P455w@rd', e_mail='b@b.c')
+    assert store.ids_where(field='persona', value=['member', 'leader']) == ['Bob', 'Alice']
+
+    store.write(id='Alice', persona='leader')
+    assert store.ids_where(field='persona', value='member') == []
+
+
 def test_write_password_with_no_hash():
 
     store = Users()
@@ -79,7 +91,8 @@ def test_delete_with_unknown_id():
 def test_authenticate_signature():
 
     db = Users()
-    db.write(id='Alice', password='P455w@rd', persona='support', e_mail='a@b.c')
+    db.write(id='Alice', password='5b49d1280e8517e54daeeb90034334ae', persona='support', e_mail='a@b.c',
+             record_has_been_loaded=True)  # signatures are computed from the legacy MD5 hash
 
     salt = 'salt'
     stamp = bearers.get_current_stamp()
@@ -137,3 +150,91 @@ def test_authenticate_signature():
                                        stamp=stamp)
 
     assert bearers.decode_bearer(secret=None, bearer=bearer).persona == 'support'
+    assert bearers.decode_bearer(secret=None, bearer=bearer).exp > 0  # compact bearer
+
+
+def test_accept_legacy_bearers():
+    store = Users()
+    bearer = bearers.encode_bearer(secret=store.bearer_secret, identity='Alice', persona='member')
+    assert store.decode_identity(bearer) == ('Alice', 'member')
+    assert store.check_bearer(bearer)['is_valid'] is True
+    assert 'iat' in store.check_bearer(store.renew_bearer(bearer))
+
+    store.accept_legacy_bearers = False  # at the end of the transition
+    store.set_bearer_secret(store.bearer_secret)
+    assert store.decode_identity(bearer) == ('nobody', 'anonymous')
+    with py_raises(jwt.exceptions.DecodeError):
+        store.check_bearer(bearer)
+
+
+def test_authenticate_password():
+    store = Users()
+    store.write(id='Alice', password='P455w@rd', persona='member', e_mail='a@b.c')
+    store.write(id='Bob', password='5b49d1280e8517e54daeeb90034334ae', persona='member', e_mail='b@b.c',
+                record_has_been_loaded=True)  # legacy MD5 hash
+
+    with py_raises(NotFoundError):
+        store.authenticate_password('Carol', password='P455w@rd')
+    with py_raises(ValueError):
+        store.authenticate_password('Alice', password='*alien*')
+    with py_raises(ValueError):
+        store.authenticate_password('Bob', password='*alien*')
+    assert store.read('Bob')['password'] == '5b49d1280e8517e54daeeb90034334ae'
+
+    for id in ['Alice', 'Bob']:
+        bearer = store.authenticate_password(id, password='P455w@rd')
+        assert store.decode_identity(bearer) == (id, 'member')
+    assert store.read('Bob')['password'].startswith('scrypt$')  # rehashed on login
+    assert store.read('Bob')['e_mail'] == 'b@b.c'
+    store.authenticate_password('Bob', password='P455w@rd')
+
+    stamp = bearers.get_current_stamp()
+    signature = bearers.compute_signature(hash='5b49d1280e8517e54daeeb90034334ae', salt='salt', stamp=stamp)
+    with py_raises(ValueError):  # the MD5 hash is not stored anymore
+        store.authenticate_signature('Bob', signature=signature, salt='salt', stamp=stamp)
+
+    with py_raises(ValueError):  # stored hash is compared as is
+        store.authenticate_password('Bob', password='P455w@rd', hash_password=False)
+
+
+def test_decode_identity_cache(monkeypatch):
+    store = Users()
+    bearer = bearers.encode_bearer(secret=store.bearer_secret, identity='Alice', persona='member')
+    assert store.decode_identity('no-bearer') == ('nobody', 'anonymous')
+    assert store.decode_identity('not-a-bearer') == ('nobody', 'anonymous')
+    assert len(store.bearer_cache) == 0
+
+    assert store.decode_identity(bearer) == ('Alice', 'member')
+    assert list(store.bearer_cache.keys()) == [bearer]
+
+    calls = []
+    decode_bearer = bearers.decode_bearer
+    monkeypatch.setattr(bearers, 'decode_bearer', lambda **kwargs: calls.append(kwargs) or decode_bearer(**kwargs))
+    assert store.decode_identity(bearer) == ('Alice', 'member')
+    assert calls == []  # from cache
+
+    store.bearer_cache[bearer] = ('Alice', 'member', 0)  # validity has ended
+    assert store.decode_identity(bearer) == ('Alice', 'member')
+    assert len(calls) == 1
+    assert store.bearer_cache[bearer][2] > 0
+
+    store.set_bearer_secret('another secret')  # rotation invalidates previous bearers
+    assert len(store.bearer_cache) == 0
+    assert store.decode_identity(bearer) == ('nobody', 'anonymous')
+
+
+def test_decode_identity_cache_size():
+    store = Users()
+    store.bearer_cache_size = 2
+    tokens = [bearers.encode_bearer(secret=store.bearer_secret, identity=name, persona='member')
+              for name in ['Alice', 'Bob', 'Carol']]
+    store.decode_identity(tokens[0])
+    store.decode_identity(tokens[1])
+    store.decode_identity(tokens[0])  # most recently used
+    store.decode_identity(tokens[2])
+    assert list(store.bearer_cache.keys()) == [tokens[0], tokens[2]]
+
+    store.bearer_cache_size = 0
+    store.set_bearer_secret()
+    store.decode_identity(bearers.encode_bearer(secret=store.bearer_secret, identity='Alice', persona='member'))
+    assert len(store.bearer_cache) == 0
@@ -0,0 +1,164 @@
+from flask import Flask, jsonify
+import http.client
+import os
+from pytest import mark, raises as py_raises
+import signal
+import socket
+from time import sleep, time
+import werkzeug
+
+from api_channel import Channel
+from api_identities import Identities
+from api_maintenance import Maintenance
+from commands import Commands
+from users import Users
+from workers import Replicator, serve, waitress
+
+
+pytestmark = mark.api
+
+
+def _get_worker(path):
+    app = Flask(__name__)
+    commands = Commands(stream=open(path, 'a'))
+    channel = Channel(name='item', emitter=commands.emit)
+    replicator = Replicator(app=app, commands=commands, dispatchers=[channel.replay], interval=0.01)
+    replicator.start()
+    return channel, replicator
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time() + timeout
+    while not condition():
+        assert time() < deadline
+        sleep(0.01)
+
+
+def test_replication(tmpdir):
+    path = str(tmpdir.join('commands.yaml'))
+    open(path, 'w').close()
+    alpha, alpha_replicator = _get_worker(path)
+    beta, beta_replicator = _get_worker(path)
+
+    post = alpha_replicator.wrap(alpha.post)
+    post(payload=dict(title='hello', version='v1'), persona='leader')
+    id = alpha.store.records.ids()[0]
+    _wait_for(lambda: beta.store.read(id) is not None)
+    assert beta.store.read(id)['title'] == 'hello'
+    assert beta.store.read(id)['stamp'] == alpha.store.read(id)['stamp']  # same cursors and etags everywhere
+    assert beta.store.etag(id) == alpha.store.etag(id)
+
+    put = beta_replicator.wrap(beta.put)
+    put(id=id, payload=dict(title='world', version='v2', previous_version='v1'), persona='leader')
+    _wait_for(lambda: alpha.store.read(id)['title'] == 'world')
+    assert alpha.store.read(id)['stamp'] == beta.store.read(id)['stamp']
+
+    batch = alpha_replicator.wrap(alpha.batch)
+    with alpha_replicator.app.app_context():
+        batch(payload=[dict(id='one'), dict(id='two')], persona='leader')
+    _wait_for(lambda: beta.store.read('two') is not None)
+    assert beta.store.between() == alpha.store.between()
+
+    alpha_replicator.interval = beta_replicator.interval = 3600  # writes catch up anyway
+    sleep(0.05)
+    alpha_put = alpha_replicator.wrap(alpha.put)
+    alpha_put(id=id, payload=dict(title='again', version='v3', previous_version='v2'), persona='leader')
+    with py_raises(werkzeug.exceptions.Conflict):  # stale write, refused after catching up
+        put(id=id, payload=dict(title='stale', version='v3', previous_version='v2'), persona='leader')
+    assert beta.store.read(id)['title'] == 'again'
+
+    delete = beta_replicator.wrap(beta.delete)
+    delete(id=id, persona='leader')
+    alpha_put(id='other', payload=dict(title='other'), persona='leader')
+    assert alpha.store.read(id) is None
+    assert len(open(path).read().split('---')) == 7  # commands are not journaled twice
+
+
+def _get_identities_worker(path):
+    commands = Commands(stream=open(path, 'a'))
+    identities = Identities(store=Users(), emitter=commands.emit)
+    replicator = Replicator(app=Flask(__name__), commands=commands, dispatchers=[identities.replay], interval=0.01)
+    replicator.start()
+    return identities, replicator
+
+
+def test_replication_of_own_identity(tmpdir):
+    path = str(tmpdir.join('commands.yaml'))
+    open(path, 'w').close()
+    alpha, alpha_replicator = _get_identities_worker(path)
+    beta, beta_replicator = _get_identities_worker(path)
+
+    post = alpha_replicator.wrap(alpha.post)
+    post(payload=dict(e_mail='alice@acme.com', persona='member', password='P455w0rd'), persona='support')
+    _wait_for(lambda: beta.store.read('alice@acme.com') is not None)
+
+    put = alpha_replicator.wrap(alpha.put)
+    put(id='alice@acme.com', payload=dict(name='Alice'), identity='alice@acme.com', persona='member')
+    _wait_for(lambda: beta.store.read('alice@acme.com').get('name') == 'Alice')  # self-service, also on other workers
+
+    delete = alpha_replicator.wrap(alpha.delete)
+    delete(id='alice@acme.com', identity='alice@acme.com', persona='member')
+    _wait_for(lambda: beta.store.read('alice@acme.com') is None)
+    assert "identity: alice@acme.com" in open(path).read()
+
+
+def test_restore_with_workers(tmpdir):
+    path = str(tmpdir.join('commands.yaml'))
+    open(path, 'w').close()
+    _, replicator = _get_worker(path)
+    maintenance = Maintenance(replicator=replicator)
+    app = Flask(__name__)
+    with app.test_request_context('/restore', method='POST', json=dict(blob='')):
+        with py_raises(werkzeug.exceptions.Conflict):  # not journaled, so refused
+            maintenance.restore(persona='support')
+
+
+def test_wrap_only_writes():
+    replicator = Replicator(app=None)
+    channel = Channel()
+    assert replicator.wrap(channel.get) == channel.get
+    assert replicator.wrap(channel.post) != channel.post
+
+
+def _connect(port, timeout=10):
+    deadline = time() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            return connection, connection.getresponse()
+        except ConnectionRefusedError:
+            assert time() < deadline
+            sleep(0.05)
+
+
+@mark.skipif(waitress is None, reason="waitress is not installed")
+def test_serve():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            app = Flask(__name__)
+            app.add_url_rule('/', 'pid', lambda: jsonify(dict(pid=os.getpid())))
+            serve(app, host='127.0.0.1', port=port, workers=2, threads=2, keep_alive=2)
+        finally:
+            os._exit(0)
+
+    try:
+        connection, response = _connect(port)
+        first = response.read()
+        assert response.status == 200
+        assert response.getheader('Connection', '') != 'close'
+        assert response.version == 11
+
+        for _ in range(3):  # same connection, same worker
+            connection.request('GET', '/')
+            assert connection.getresponse().read() == first
+        assert str(pid).encode() not in first  # served by a worker
+        connection.close()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)